@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
 from rest_framework import viewsets, permissions
 
+from thermometer.replicas import ReplicaReadMixin
 from utils.permissions import IsOwnerOrReadOnly, IsSelfOrAdmin, IsUserOrReadOnly
 
 from .models import UserProfile
@@ -21,9 +22,9 @@ class UserViewset(viewsets.ModelViewSet):
     permission_classes = (IsSelfOrAdmin,)
 
 
-class UserProfileViewset(viewsets.ModelViewSet):
+class UserProfileViewset(ReplicaReadMixin, viewsets.ModelViewSet):
     """
-    Viewset for User Profiles.
+    Viewset for User Profiles. Safe requests read from the read replica, if there is one.
     """
 
     queryset = UserProfile.objects.all().order_by('created_date')
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class TemperatureConfig(AppConfig):
     name = 'temperature'
+
+    def ready(self):
+        # Database profile hooks: SQLite pragmas and connection health checks
+        from thermometer.database import connect_signals
+        connect_signals()
@@ -0,0 +1,111 @@
+import json
+import re
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .views import device_status, device_upload, get_device_key
+
+INGEST_PATH = re.compile(r'^/ingest/(?P<therm_id>[0-9a-f-]+)/$')
+
+
+def call_with_connection(func, *args):
+    """
+    Run a database function in a worker thread the way Django runs a request, closing stale
+    connections before and after.
+    """
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+class DeviceIngestApplication:
+    """ASGI application that serves device uploads natively and passes everything else on.
+
+    Device connections are mostly idle while a sensor waits for its next reading, so reading
+    their request bodies on the event loop lets thousands of them share one process. Only the
+    short authenticate-and-store step runs in a worker thread; with the ingestion buffer enabled
+    that is just a queue append. Other requests are handed to the wrapped Django application.
+
+    Fields:
+        application: ASGI application for all other requests
+        max_body_size: Largest upload accepted, from settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    Methods:
+        __call__: Route a connection to the ingest handler or the wrapped application
+        handle: Serve GET and POST requests for /ingest/<therm_id>/
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.max_body_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            match = INGEST_PATH.match(scope['path'])
+            if match:
+                try:
+                    therm_id = uuid.UUID(match.group('therm_id'))
+                except ValueError:
+                    return await self.respond(send, 404, {'detail': 'Not found.'})
+                return await self.handle(scope, receive, send, therm_id)
+        return await self.application(scope, receive, send)
+
+    async def handle(self, scope, receive, send, therm_id):
+        headers = {name.decode('latin1').lower(): value.decode('latin1')
+                   for name, value in scope['headers']}
+        key = get_device_key(headers.get('authorization'))
+
+        if scope['method'] == 'GET':
+            result = await sync_to_async(call_with_connection, thread_sensitive=False)(
+                device_status, therm_id, key
+            )
+            return await self.respond(send, *result)
+        if scope['method'] != 'POST':
+            return await self.respond(send, 405, {'detail': 'Method not allowed.'},
+                                      {'Allow': 'GET, POST'})
+
+        body = await self.read_body(receive)
+        if body is None:
+            return await self.respond(send, 413, {'detail': 'Upload is too large.'})
+
+        content_type = headers.get('content-type', '').split(';')[0].strip()
+        result = await sync_to_async(call_with_connection, thread_sensitive=False)(
+            device_upload, therm_id, key, content_type, body
+        )
+        return await self.respond(send, *result)
+
+    async def read_body(self, receive):
+        """
+        Read the whole request body, or return None if it is bigger than max_body_size.
+        """
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return b''
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body_size is not None and size > self.max_body_size:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    async def respond(self, send, status, data, headers=None):
+        response_headers = [
+            (name.lower().encode('latin1'), value.encode('latin1'))
+            for name, value in (headers or {}).items()
+        ]
+        body = b''
+        if data is not None:
+            body = json.dumps(data).encode()
+            response_headers.append((b'content-type', b'application/json'))
+        response_headers.append((b'content-length', str(len(body)).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,259 @@
+"""Compressed cold storage for a thermometer-day of readings.
+
+Old readings are rarely read at full resolution, but each one costs a table row and an index
+entry. The compactreadings command packs every reading a thermometer took in one UTC day into a
+single ReadingBlock, and the read paths decode blocks back into readings when they need them.
+
+A block is a 15-byte header followed by a zlib-compressed stream of variable-length integers:
+
+    header: magic b'RB', version (uint8), reading count (uint32),
+            time of the first reading in microseconds since the unix epoch (int64)
+    per reading: delta-of-delta of the time in microseconds,
+                 change in temperature since the previous reading in thousandths of a degree,
+                 microseconds from the time to valid_until plus one, or 0 if there is none
+
+Signed values are zigzag encoded. Readings are taken at steady intervals and temperatures move
+slowly, so most readings encode as three zero bytes, which zlib then squeezes to almost nothing.
+Temperatures are stored as the integers the database stores, so deltas are exact; XOR encoding
+is for floating point values and would gain nothing here.
+
+Sequence numbers aren't kept. They only exist to deduplicate retried uploads, and readings are
+far past being retried by the time they are compacted.
+"""
+import datetime
+import struct
+import zlib
+
+from django.db import transaction
+
+from .codecs import EPOCH
+from .models import ReadingBlock, TemperatureReading, Thermometer
+
+MAGIC = b'RB'
+VERSION = 1
+HEADER = struct.Struct('<2sBIq')
+MICROSECOND = datetime.timedelta(microseconds=1)
+DAY = datetime.timedelta(days=1)
+
+MILLIDEGREES = TemperatureReading._meta.get_field('degrees_c')
+
+
+def microseconds(time):
+    """
+    Return a datetime as microseconds since the unix epoch.
+    """
+    return (time - EPOCH) // MICROSECOND
+
+
+def write_varint(buffer, value):
+    """
+    Append a signed integer to a bytearray, zigzag and then LEB128 encoded.
+    """
+    value = (value << 1) ^ (value >> 63)
+    while value >= 0x80:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, position):
+    """
+    Read a signed integer written by write_varint. Returns (value, position after it).
+    """
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value >> 1) ^ -(value & 1), position
+        shift += 7
+
+
+def encode_block(readings):
+    """Pack a day of readings into a compressed block.
+
+    Args:
+        readings: non-empty iterable of objects or dicts with time_recorded, degrees_c and
+            valid_until. Temperatures are rounded as the database would round them.
+
+    Returns:
+        bytes of the block
+    """
+    readings = sorted((
+        (field(reading, 'time_recorded'), field(reading, 'degrees_c'),
+         field(reading, 'valid_until'))
+        for reading in readings
+    ), key=lambda reading: reading[0])
+    if not readings:
+        raise ValueError('Cannot encode an empty block')
+
+    first = microseconds(readings[0][0])
+    body = bytearray()
+    previous_time, previous_delta, previous_value = first, 0, 0
+    for time_recorded, degrees_c, valid_until in readings:
+        time = microseconds(time_recorded)
+        value = MILLIDEGREES.get_prep_value(degrees_c)
+        write_varint(body, time - previous_time - previous_delta)
+        write_varint(body, value - previous_value)
+        write_varint(body, 0 if valid_until is None else microseconds(valid_until) - time + 1)
+        previous_time, previous_delta, previous_value = time, time - previous_time, value
+    return HEADER.pack(MAGIC, VERSION, len(readings), first) + zlib.compress(bytes(body), 9)
+
+
+def decode_block(data):
+    """Unpack a block into TemperatureReading field values.
+
+    Args:
+        data: bytes of a block made by encode_block
+
+    Returns:
+        list of dicts of time_recorded, degrees_c and valid_until, oldest first
+
+    Raises:
+        ValueError: if the block is corrupt or of an unknown version
+    """
+    data = bytes(data)
+    if len(data) < HEADER.size:
+        raise ValueError('Block is shorter than its header')
+    magic, version, count, first = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'Unsupported block version {version}')
+    decompressor = zlib.decompressobj()
+    try:
+        body = decompressor.decompress(data[HEADER.size:])
+    except zlib.error as error:
+        raise ValueError(f'Block data is corrupt: {error}')
+    if not decompressor.eof or decompressor.unused_data:
+        raise ValueError('Block data is truncated or has trailing bytes')
+
+    readings = []
+    position = 0
+    time, delta, value = first, 0, 0
+    try:
+        for _ in range(count):
+            dod, position = read_varint(body, position)
+            change, position = read_varint(body, position)
+            valid_for, position = read_varint(body, position)
+            delta += dod
+            time += delta
+            value += change
+            time_recorded = EPOCH + datetime.timedelta(microseconds=time)
+            readings.append({
+                'time_recorded': time_recorded,
+                'degrees_c': MILLIDEGREES.from_db_value(value, None, None),
+                'valid_until': (time_recorded + (valid_for - 1) * MICROSECOND
+                                if valid_for else None),
+            })
+    except IndexError:
+        raise ValueError(f'Block ends before its count of {count} readings')
+    if position != len(body):
+        raise ValueError(f'Block has data after its count of {count} readings')
+    return readings
+
+
+def day_start(day):
+    """
+    Return the start of a UTC date as an aware datetime.
+    """
+    return datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+
+
+def utc_date(time):
+    """
+    Return the UTC date of an aware datetime.
+    """
+    return time.astimezone(datetime.timezone.utc).date()
+
+
+def compact_day(thermometer, day):
+    """Move a thermometer's raw readings from one UTC day into its block for that day.
+
+    Readings already in the block are kept, so readings that arrive after a day was compacted
+    are merged into its block the next time it is compacted. Run it in a transaction. The
+    thermometer's row is locked first, as store_readings locks it, so a reading stored for the
+    day while it is being compacted can't be deleted without having been read into the block.
+
+    Returns:
+        number of readings moved out of the reading table
+
+    Raises:
+        Thermometer.DoesNotExist: if the thermometer has been deleted
+    """
+    Thermometer.objects.select_for_update().only('id').get(pk=thermometer.pk)
+    rows = thermometer.temperatures.filter(
+        time_recorded__gte=day_start(day), time_recorded__lt=day_start(day) + DAY
+    ).order_by()
+    readings = list(rows.values('time_recorded', 'degrees_c', 'valid_until'))
+    if not readings:
+        return 0
+    block = (
+        ReadingBlock.objects.select_for_update().filter(thermometer=thermometer, day=day).first()
+    )
+    if block is None:
+        block = ReadingBlock(thermometer=thermometer, day=day)
+    else:
+        readings += decode_block(block.data)
+    block.count = len(readings)
+    block.data = encode_block(readings)
+    block.save()
+    return rows._raw_delete(rows.db)
+
+
+def compact(thermometer, before):
+    """Compact every whole UTC day of a thermometer's raw readings before `before`.
+
+    Days are found by following the (thermometer, time_recorded) index from the oldest raw
+    reading, and each is compacted in its own transaction.
+
+    Returns:
+        (readings moved, days compacted)
+    """
+    end = day_start(utc_date(before))
+    moved = days = 0
+    while True:
+        oldest = (
+            thermometer.temperatures.filter(time_recorded__lt=end)
+            .order_by('time_recorded').values_list('time_recorded', flat=True).first()
+        )
+        if oldest is None:
+            return moved, days
+        with transaction.atomic():
+            moved += compact_day(thermometer, utc_date(oldest))
+        days += 1
+
+
+def readings_between(thermometer, since, until):
+    """Return a thermometer's readings from `since` up to `until`, oldest first.
+
+    Readings still in the reading table are read through its index, and blocks for any
+    compacted days in the range are decoded.
+
+    Returns:
+        list of dicts of time_recorded, degrees_c and valid_until
+    """
+    readings = list(
+        thermometer.temperatures
+        .filter(time_recorded__gte=since, time_recorded__lt=until)
+        .order_by('time_recorded')
+        .values('time_recorded', 'degrees_c', 'valid_until')
+    )
+    blocks = thermometer.blocks.filter(day__gte=utc_date(since), day__lte=utc_date(until))
+    compacted = [
+        reading
+        for data in blocks.values_list('data', flat=True)
+        for reading in decode_block(data)
+        if since <= reading['time_recorded'] < until
+    ]
+    if compacted:
+        readings = sorted(readings + compacted, key=lambda reading: reading['time_recorded'])
+    return readings
+
+
+def field(reading, name):
+    """
+    Return a field of a reading given as a model instance or a dict.
+    """
+    if isinstance(reading, dict):
+        return reading.get(name)
+    return getattr(reading, name)
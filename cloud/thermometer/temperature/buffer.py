@@ -0,0 +1,194 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, connection, transaction
+
+from .exceptions import IngestBufferFull
+
+logger = logging.getLogger(__name__)
+
+# Errors that writing the same readings again would only repeat, such as the thermometer having
+# been deleted since they were submitted
+PERMANENT_ERRORS = (IntegrityError, ObjectDoesNotExist)
+
+
+class IngestBuffer:
+    """In-process write-behind buffer for uploaded readings.
+
+    Upload views hand validated readings to the buffer and return straight away. A background
+    thread writes everything waiting in one transaction, either every `flush_interval` seconds or
+    as soon as `flush_rows` readings are waiting, whichever comes first. This turns many small
+    uploads into a few bulk inserts.
+
+    Fields:
+        flush_interval: Longest time in seconds a reading waits before being written
+        flush_rows: Number of waiting readings that triggers an immediate flush
+        max_rows: Most readings that may wait at once. Submitting more raises IngestBufferFull.
+        writer: Callable taking (thermometer, readings) used to write each thermometer's readings
+
+    Methods:
+        submit: Queue readings for a thermometer, or raise IngestBufferFull
+        flush: Write everything waiting now, in the calling thread
+        close: Stop the background thread and write everything still waiting
+    """
+
+    def __init__(self, flush_interval, flush_rows, max_rows, writer, autostart=True):
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.max_rows = max_rows
+        self.writer = writer
+        self.autostart = autostart
+
+        self._pending = []
+        self._pending_rows = 0
+        self._oldest = None
+        self._closed = False
+        self._thread = None
+        self._flush_lock = threading.Lock()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return self._pending_rows
+
+    def submit(self, thermometer, readings):
+        """
+        Queue readings to be written for a thermometer. Raises IngestBufferFull rather than
+        blocking when the buffer is at capacity.
+        """
+        readings = list(readings)
+        if not readings:
+            return
+        with self._condition:
+            if self._closed:
+                raise IngestBufferFull('Ingestion buffer is shutting down')
+            if self._pending_rows + len(readings) > self.max_rows:
+                raise IngestBufferFull('Ingestion buffer is full')
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._pending.append((thermometer, readings))
+            self._pending_rows += len(readings)
+            if self._pending_rows >= self.flush_rows:
+                self._condition.notify()
+            if self.autostart and self._thread is None:
+                self._start()
+
+    def flush(self):
+        """
+        Write everything waiting in one transaction, each thermometer's readings in a savepoint
+        of their own. Readings that can never be written, such as those of a deleted
+        thermometer, are logged and dropped so they don't hold up everyone else's. If the
+        write fails otherwise, the readings are put back at the front of the buffer to be
+        retried on the next flush. Returns the number of readings written.
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch, self._pending = self._pending, []
+                rows, self._pending_rows = self._pending_rows, 0
+                self._oldest = None
+            if not batch:
+                return 0
+
+            by_thermometer = {}
+            for thermometer, readings in batch:
+                by_thermometer.setdefault(thermometer.pk, (thermometer, []))[1].extend(readings)
+
+            dropped = set()
+            try:
+                with transaction.atomic():
+                    for thermometer, readings in by_thermometer.values():
+                        try:
+                            with transaction.atomic():
+                                self.writer(thermometer, readings)
+                        except PERMANENT_ERRORS:
+                            logger.exception('Dropping %d buffered readings for thermometer %s',
+                                             len(readings), thermometer.pk)
+                            dropped.add(thermometer.pk)
+            except Exception:
+                batch = [(thermometer, readings) for thermometer, readings in batch
+                         if thermometer.pk not in dropped]
+                retried = sum(len(readings) for _, readings in batch)
+                logger.exception('Failed to flush %d buffered readings, will retry', retried)
+                with self._condition:
+                    self._pending = batch + self._pending
+                    self._pending_rows += retried
+                    self._oldest = time.monotonic()
+                raise
+            return rows - sum(len(by_thermometer[pk][1]) for pk in dropped)
+
+    def close(self):
+        """
+        Stop accepting readings, stop the background thread and write everything still waiting.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _due(self):
+        """
+        Return whether the waiting readings should be written now.
+        """
+        if not self._pending_rows:
+            return False
+        if self._pending_rows >= self.flush_rows:
+            return True
+        return time.monotonic() - self._oldest >= self.flush_interval
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='temperature-ingest-buffer', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    while not self._closed and not self._due():
+                        if self._oldest is None:
+                            timeout = self.flush_interval
+                        else:
+                            timeout = self.flush_interval - (time.monotonic() - self._oldest)
+                        self._condition.wait(max(timeout, 0))
+                    if self._closed:
+                        return
+                try:
+                    self.flush()
+                except Exception:
+                    # Already logged, back off before retrying
+                    time.sleep(self.flush_interval)
+        finally:
+            connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """
+    Return the process-wide ingestion buffer, or None if buffering is disabled. The buffer is
+    created on first use and drained when the process exits.
+    """
+    global _buffer
+    options = settings.TEMPERATURE_INGEST_BUFFER
+    if not options['ENABLED']:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            from .ingest import store_readings
+            _buffer = IngestBuffer(
+                flush_interval=options['FLUSH_INTERVAL_MS'] / 1000,
+                flush_rows=options['FLUSH_ROWS'],
+                max_rows=options['MAX_ROWS'],
+                writer=store_readings,
+            )
+            atexit.register(_buffer.close)
+        return _buffer
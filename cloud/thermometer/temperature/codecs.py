@@ -0,0 +1,122 @@
+"""Compact binary upload format for DS18B20 thermometers.
+
+DS18B20 sensors report temperature as a signed 16-bit count of 1/16 °C steps, so a reading can
+travel as the raw sensor value instead of a decimal string. A batch is a 12-byte header followed
+by one 4-byte record per reading, all little-endian:
+
+    header: magic b'DS18', version (uint8), padding byte, record count (uint16),
+            timestamp of the first reading in unix seconds (uint32)
+    record: seconds since the previous reading (uint16), raw sensor value (int16)
+
+The first record's delta is relative to the header timestamp, so it is normally 0.
+
+Version 2 batches add the sequence number of the first reading (uint32) to the end of the header.
+Readings in the batch are numbered consecutively from it, so retried uploads are deduplicated.
+"""
+import datetime
+from decimal import Decimal
+import struct
+
+from django.utils import timezone
+
+from .exceptions import ReadingUploadError
+from .models import MAX_SEQUENCE
+
+CONTENT_TYPE = 'application/vnd.smartaquarium.ds18b20'
+MAGIC = b'DS18'
+VERSION = 1
+SEQUENCED_VERSION = 2
+
+HEADER = struct.Struct('<4sBxHI')
+SEQUENCE = struct.Struct('<I')
+RECORD = struct.Struct('<Hh')
+
+# DS18B20 measuring range is -55 °C to +125 °C, in 1/16 °C steps
+RAW_MIN = -55 * 16
+RAW_MAX = 125 * 16
+RAW_STEP = Decimal(16)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_readings(readings, first_sequence=None):
+    """Pack readings into the binary upload format.
+
+    Used by device firmware simulators and tests; the server only ever decodes.
+
+    Args:
+        readings: list of (aware datetime, raw sensor value) tuples in time order
+        first_sequence: sequence number of the first reading. If given, a version 2 batch is
+            encoded.
+
+    Returns:
+        bytes of the encoded batch
+    """
+    if not readings:
+        raise ValueError('Cannot encode an empty batch')
+
+    start = int(readings[0][0].timestamp())
+    if first_sequence is None:
+        chunks = [HEADER.pack(MAGIC, VERSION, len(readings), start)]
+    else:
+        chunks = [
+            HEADER.pack(MAGIC, SEQUENCED_VERSION, len(readings), start),
+            SEQUENCE.pack(first_sequence),
+        ]
+    previous = start
+    for time_recorded, raw in readings:
+        seconds = int(time_recorded.timestamp())
+        chunks.append(RECORD.pack(seconds - previous, raw))
+        previous = seconds
+    return b''.join(chunks)
+
+
+def decode_readings(data):
+    """Decode a binary upload straight into TemperatureReading field values.
+
+    Args:
+        data: raw request body
+
+    Returns:
+        list of dicts of TemperatureReading field values, ready for store_readings
+
+    Raises:
+        ReadingUploadError: if the batch is truncated, has the wrong magic or version, or
+            contains values outside the sensor's range
+    """
+    if len(data) < HEADER.size:
+        raise ReadingUploadError('Batch is shorter than its header')
+
+    magic, version, count, start = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ReadingUploadError('Batch does not start with DS18B20 magic bytes')
+    if version == VERSION:
+        header_size = HEADER.size
+        sequence = None
+    elif version == SEQUENCED_VERSION and len(data) >= HEADER.size + SEQUENCE.size:
+        header_size = HEADER.size + SEQUENCE.size
+        sequence, = SEQUENCE.unpack_from(data, HEADER.size)
+        if sequence + count - 1 > MAX_SEQUENCE:
+            raise ReadingUploadError(f'Sequence numbers from {sequence} are out of range')
+    else:
+        raise ReadingUploadError(f'Unsupported batch version {version}')
+    if not count:
+        raise ReadingUploadError('Batch contains no readings')
+    if len(data) != header_size + count * RECORD.size:
+        raise ReadingUploadError(f'Batch length does not match its count of {count} readings')
+
+    readings = []
+    seconds = start
+    for delta, raw in RECORD.iter_unpack(memoryview(data)[header_size:]):
+        if not RAW_MIN <= raw <= RAW_MAX:
+            raise ReadingUploadError(f'Raw value {raw} is outside the DS18B20 range')
+        seconds += delta
+        reading = {
+            'degrees_c': raw / RAW_STEP,
+            'time_recorded': EPOCH + datetime.timedelta(seconds=seconds),
+        }
+        if sequence is not None:
+            reading['sequence'] = sequence
+            sequence += 1
+        readings.append(reading)
+    return readings
@@ -0,0 +1,58 @@
+"""Largest-Triangle-Three-Buckets downsampling of readings for charts.
+
+A chart is a few hundred pixels wide, so drawing tens of thousands of readings sends and renders
+data nobody can see. Keeping every nth reading or averaging buckets flattens the peaks and dips
+that matter on a temperature chart. LTTB instead keeps the first and last readings and, from
+each of max_points - 2 equal buckets in between, the reading forming the largest triangle with
+the reading kept from the bucket before and the mean of the bucket after. The chart keeps its
+shape with a bounded number of points, and every point kept is a real reading.
+
+See Sveinn Steinarsson, "Downsampling Time Series for Visual Representation" (2013).
+"""
+import numpy
+
+
+def lttb(times, degrees, max_points):
+    """Return the indices of the readings LTTB keeps, in order.
+
+    One pass over the buckets, each a vectorized NumPy step over its readings, so the cost is
+    linear in the number of readings.
+
+    Args:
+        times: Reading times as a NumPy array, in ascending order
+        degrees: Reading temperatures as a NumPy array of the same length
+        max_points: Number of readings to keep, at least 3
+
+    Returns:
+        int64 NumPy array of at most max_points indices into times and degrees
+    """
+    count = len(times)
+    if count <= max_points:
+        return numpy.arange(count)
+
+    # Relative float times keep microsecond timestamps from losing precision in the products
+    x = (times - times[0]).astype(numpy.float64)
+    y = degrees.astype(numpy.float64)
+
+    # Edges of the max_points - 2 buckets splitting every reading but the first and last
+    edges = numpy.linspace(1, count - 1, max_points - 1).astype(numpy.int64)
+    kept = numpy.empty(max_points, dtype=numpy.int64)
+    kept[0], kept[-1] = 0, count - 1
+
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            after = slice(end, edges[bucket + 2])
+        else:
+            after = slice(count - 1, count)
+        mean_x, mean_y = x[after].mean(), y[after].mean()
+
+        # Twice the area of each triangle; the factor doesn't change which is largest
+        areas = numpy.abs(
+            (x[previous] - mean_x) * (y[start:end] - y[previous]) -
+            (x[previous] - x[start:end]) * (mean_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        kept[bucket + 1] = previous
+    return kept
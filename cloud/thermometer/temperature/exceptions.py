@@ -15,3 +15,22 @@ class ThermometerCreationError(ValueError):
 
     Wrapper of ValueError with more verbose name
     """
+
+
+class ReadingUploadError(ValueError):
+    """Error for when an uploaded batch of readings can't be parsed.
+
+    Should be raised by the device ingestion path when a payload is malformed.
+
+    Wrapper of ValueError with more verbose name
+    """
+
+
+class IngestBufferFull(RuntimeError):
+    """Error for when the ingestion buffer can't accept more readings.
+
+    Should be raised when accepting a batch would grow the buffer past its limit, so callers
+    can tell devices to back off and retry.
+
+    Wrapper of RuntimeError with more verbose name
+    """
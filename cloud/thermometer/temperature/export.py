@@ -0,0 +1,227 @@
+"""Columnar export of readings for analysis.
+
+The exportreadings command writes each thermometer's readings under
+settings.TEMPERATURE_EXPORT_ROOT/<therm_id>/ as two flat little-endian arrays with no header, so
+they can be memory-mapped without copying or parsing:
+
+    time_recorded.i8: int64 microseconds since the unix epoch, oldest first
+    degrees_c.f4: float32 degrees Celsius
+
+and a manifest.json holding the dtypes and the number of readings in the arrays. For example:
+
+    count = json.load(open('manifest.json'))['count']
+    times = numpy.memmap('time_recorded.i8', dtype='<i8', mode='r', shape=(count,))
+    degrees = numpy.memmap('degrees_c.f4', dtype='<f4', mode='r', shape=(count,))
+
+Each export appends the readings recorded after the last exported reading, then rewrites the
+manifest. The manifest is written last and replaced atomically, so readers only ever see whole
+exports, and an export interrupted part way is trimmed back to the manifest's count and redone.
+Readings uploaded late with times before the last exported reading aren't picked up by an
+incremental export; re-export the thermometer from scratch to include them.
+"""
+import datetime
+import io
+import json
+import os
+
+import numpy
+
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+
+from .blocks import (
+    MICROSECOND, MILLIDEGREES, day_start, decode_block, microseconds, utc_date
+)
+from .codecs import EPOCH
+
+TIMES = 'time_recorded.i8'
+DEGREES = 'degrees_c.f4'
+MANIFEST = 'manifest.json'
+TIME_DTYPE = numpy.dtype('<i8')
+DEGREES_DTYPE = numpy.dtype('<f4')
+# Readings as read from the database: times, and temperatures exactly as stored
+READING_DTYPE = numpy.dtype([('time_recorded', TIME_DTYPE), ('millidegrees', '<i8')])
+
+# Readings are read this much time at a time, to bound memory use
+WINDOW = datetime.timedelta(days=7)
+
+
+def reading_array(thermometer, since, until):
+    """Return a thermometer's readings from `since` up to `until`, raw and compacted, oldest
+    first, as a READING_DTYPE array.
+
+    Rows are streamed a WINDOW at a time with iterator() straight into arrays, so no more than
+    a window's rows are held as Python objects, even where the database driver fetches a whole
+    result at once. Blocks are decoded one at a time.
+    """
+    parts = []
+    start = since
+    while start < until:
+        end = min(start + WINDOW, until)
+        rows = (
+            thermometer.temperatures
+            .filter(time_recorded__gte=start, time_recorded__lt=end)
+            .order_by('time_recorded')
+            .values_list('time_recorded', 'degrees_c')
+            .iterator()
+        )
+        parts.append(numpy.fromiter(
+            ((microseconds(time_recorded), MILLIDEGREES.get_prep_value(degrees_c))
+             for time_recorded, degrees_c in rows),
+            dtype=READING_DTYPE
+        ))
+        start = end
+
+    blocks = thermometer.blocks.filter(day__gte=utc_date(since), day__lte=utc_date(until))
+    compacted = False
+    for data in blocks.values_list('data', flat=True).iterator():
+        parts.append(numpy.fromiter(
+            ((microseconds(reading['time_recorded']),
+              MILLIDEGREES.get_prep_value(reading['degrees_c']))
+             for reading in decode_block(data) if since <= reading['time_recorded'] < until),
+            dtype=READING_DTYPE
+        ))
+        compacted = True
+
+    if not parts:
+        return numpy.empty(0, READING_DTYPE)
+    readings = numpy.concatenate(parts)
+    if compacted:
+        readings = readings[numpy.argsort(readings['time_recorded'], kind='stable')]
+    return readings
+
+
+def to_arrays(readings):
+    """
+    Return (int64 microseconds, float32 degrees) arrays for a READING_DTYPE array.
+    """
+    times = numpy.ascontiguousarray(readings['time_recorded'])
+    degrees = (readings['millidegrees'] / 1000).astype(DEGREES_DTYPE)
+    return times, degrees
+
+
+def export_dir(thermometer):
+    """
+    Return the directory a thermometer's arrays are exported to.
+    """
+    return os.path.join(settings.TEMPERATURE_EXPORT_ROOT, str(thermometer.therm_id))
+
+
+def read_manifest(directory):
+    """
+    Return a directory's manifest, or None if nothing has been exported to it.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(directory, count, last):
+    """
+    Atomically replace a directory's manifest.
+    """
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as manifest:
+        json.dump({
+            'count': count,
+            'last': last,
+            'columns': {
+                'time_recorded': {'file': TIMES, 'dtype': TIME_DTYPE.str,
+                                  'unit': 'microseconds since 1970-01-01T00:00:00Z'},
+                'degrees_c': {'file': DEGREES, 'dtype': DEGREES_DTYPE.str},
+            },
+        }, manifest, indent=2)
+        manifest.flush()
+        os.fsync(manifest.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def first_reading_time(thermometer):
+    """
+    Return the time of a thermometer's oldest reading, raw or compacted, to within a day, or
+    None if it has none.
+    """
+    times = [thermometer.temperatures.aggregate(first=Min('time_recorded'))['first']]
+    first_day = thermometer.blocks.aggregate(first=Min('day'))['first']
+    if first_day is not None:
+        times.append(day_start(first_day))
+    times = [time for time in times if time is not None]
+    return min(times) if times else None
+
+
+def export(thermometer, rebuild=False):
+    """Append a thermometer's readings since its last export to its exported arrays.
+
+    Args:
+        thermometer: Thermometer to export
+        rebuild: Discard the existing export and write every reading again
+
+    Returns:
+        (readings appended, readings in the export)
+    """
+    directory = export_dir(thermometer)
+    os.makedirs(directory, exist_ok=True)
+    manifest = None if rebuild else read_manifest(directory)
+    count, last = (0, None) if manifest is None else (manifest['count'], manifest['last'])
+    if last is None:
+        since = first_reading_time(thermometer)
+    else:
+        since = EPOCH + (last + 1) * MICROSECOND
+
+    # Newest readings may be timestamped a little ahead of the server clock
+    until = timezone.now() + settings.TEMPERATURE_CLOCK_SKEW
+    appended = 0
+    with open(os.path.join(directory, TIMES), 'ab') as times_file, \
+            open(os.path.join(directory, DEGREES), 'ab') as degrees_file:
+        # Drop anything an interrupted export wrote past the manifest
+        times_file.truncate(count * TIME_DTYPE.itemsize)
+        degrees_file.truncate(count * DEGREES_DTYPE.itemsize)
+        while since is not None and since < until:
+            window_end = min(since + WINDOW, until)
+            times, degrees = to_arrays(reading_array(thermometer, since, window_end))
+            times_file.write(times.tobytes())
+            degrees_file.write(degrees.tobytes())
+            appended += len(times)
+            if len(times):
+                last = int(times[-1])
+            since = window_end
+        times_file.flush()
+        degrees_file.flush()
+        os.fsync(times_file.fileno())
+        os.fsync(degrees_file.fileno())
+    write_manifest(directory, count + appended, last)
+    return appended, count + appended
+
+
+def load(directory):
+    """
+    Memory-map a thermometer's exported arrays read-only. Returns (times, degrees), or None if
+    nothing has been exported to the directory.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    count = manifest['count']
+    if not count:
+        return numpy.empty(0, TIME_DTYPE), numpy.empty(0, DEGREES_DTYPE)
+    return (
+        numpy.memmap(os.path.join(directory, TIMES), dtype=TIME_DTYPE, mode='r', shape=(count,)),
+        numpy.memmap(os.path.join(directory, DEGREES), dtype=DEGREES_DTYPE, mode='r',
+                     shape=(count,)),
+    )
+
+
+def export_npz(thermometer, since, until):
+    """
+    Return a thermometer's readings from `since` up to `until` as the bytes of an uncompressed
+    .npz archive of time_recorded and degrees_c arrays, laid out as in the exported files.
+    The readings are read a window at a time into arrays rather than as Python objects.
+    """
+    times, degrees = to_arrays(reading_array(thermometer, since, until))
+    archive = io.BytesIO()
+    numpy.savez(archive, time_recorded=times, degrees_c=degrees)
+    return archive.getvalue()
+
@@ -0,0 +1,61 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+
+class MillidegreesField(models.Field):
+    """Temperature in degrees Celsius, stored as an integer number of thousandths of a degree.
+
+    Python code and queries use Decimal degrees exactly as they would with a DecimalField, but
+    the column is a plain integer: smaller on disk and in indexes than a decimal, and summed or
+    averaged by the database without going through decimal arithmetic. Values are rounded to the
+    nearest thousandth of a degree when stored, halves away from zero as SQL ROUND does.
+
+    Aggregates keep working in degrees: Min, Max, Sum and Avg over the field are converted back
+    from thousandths on the way out of the database.
+    """
+    description = 'Temperature in degrees Celsius, stored as integer thousandths of a degree'
+    scale = 3
+
+    def get_internal_type(self):
+        return 'IntegerField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Decimal(value).scaleb(-self.scale)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            return Decimal(str(value))
+        except InvalidOperation:
+            raise exceptions.ValidationError(
+                '“%(value)s” value must be a decimal number.',
+                code='invalid',
+                params={'value': value},
+            )
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None:
+            return None
+        return int(self.to_python(value).scaleb(self.scale).to_integral_value(ROUND_HALF_UP))
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{
+            'form_class': forms.DecimalField,
+            'decimal_places': self.scale,
+            **kwargs,
+        })
+
+
+class BigMillidegreesField(MillidegreesField):
+    """MillidegreesField stored in a 64-bit integer, for sums of many temperatures."""
+    description = 'Temperature in degrees Celsius, stored as 64-bit integer thousandths of a degree'
+
+    def get_internal_type(self):
+        return 'BigIntegerField'
@@ -0,0 +1,380 @@
+import bisect
+import datetime
+from decimal import Decimal
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import codecs
+from .blocks import decode_block
+from .buffer import get_buffer
+from .exceptions import ReadingUploadError
+from .models import MAX_SEQUENCE, Thermometer, TemperatureReading
+from .rollups import update_rollups
+
+# Largest absolute value that fits TemperatureReading.degrees_c
+MAX_ABS_DEGREES_C = Decimal(10) ** 4
+
+# Thermometer columns needed to authenticate a device and store its readings
+INGEST_FIELDS = ('id', 'device_key_hash', 'deadband_c', 'deadband_seconds')
+
+# Thermometer field caching the newest reading's temperature, for converting it in updates
+LATEST_DEGREES_C = Thermometer._meta.get_field('latest_degrees_c')
+
+
+def authenticate_device(therm_id, key):
+    """Look up the thermometer a device upload is for and check the device's key.
+
+    Only the columns needed to authenticate and store readings are loaded.
+
+    Args:
+        therm_id: Thermometer.therm_id the device claims to be
+        key: raw device key presented by the device
+
+    Returns:
+        the Thermometer, or None if it doesn't exist or the key doesn't match
+    """
+    thermometer = (
+        Thermometer.objects
+        .only(*INGEST_FIELDS)
+        .filter(therm_id=therm_id)
+        .first()
+    )
+    if thermometer is None or not thermometer.check_device_key(key):
+        return None
+    return thermometer
+
+
+def parse_readings(content_type, body):
+    """Parse a device upload in whichever format the device sent it.
+
+    Args:
+        content_type: media type of the request body
+        body: raw request body
+
+    Returns:
+        list of dicts of TemperatureReading field values, ready for store_readings
+
+    Raises:
+        ReadingUploadError: if the payload is malformed, too big, or has timestamps outside the
+            accepted window
+    """
+    if content_type == codecs.CONTENT_TYPE:
+        readings = codecs.decode_readings(body)
+        if len(readings) > settings.TEMPERATURE_MAX_BATCH_SIZE:
+            raise ReadingUploadError(
+                f'Batches may contain at most {settings.TEMPERATURE_MAX_BATCH_SIZE} readings'
+            )
+    else:
+        readings = parse_json_readings(body)
+
+    now = timezone.now()
+    for reading in readings:
+        if 'time_recorded' in reading:
+            check_time_recorded(reading['time_recorded'], now)
+    return readings
+
+
+def check_time_recorded(time_recorded, now):
+    """Check a device-supplied timestamp against the server clock.
+
+    Devices buffer readings and upload them later, so timestamps may be in the past, but no
+    further back than settings.TEMPERATURE_MAX_READING_AGE. Timestamps may be ahead of the server
+    clock by at most settings.TEMPERATURE_CLOCK_SKEW.
+
+    Args:
+        time_recorded: aware datetime the device says the reading was taken
+        now: current server time
+
+    Raises:
+        ReadingUploadError: if the timestamp is outside the accepted window
+    """
+    if time_recorded > now + settings.TEMPERATURE_CLOCK_SKEW:
+        raise ReadingUploadError(f'Reading time {time_recorded.isoformat()} is in the future')
+    if time_recorded < now - settings.TEMPERATURE_MAX_READING_AGE:
+        raise ReadingUploadError(f'Reading time {time_recorded.isoformat()} is too old')
+
+
+def parse_json_time(value):
+    """
+    Parse a timestamp from a JSON payload, given either as an ISO 8601 string or as unix seconds.
+    Timestamps without a UTC offset are taken to be UTC.
+    """
+    if isinstance(value, str):
+        time_recorded = parse_datetime(value)
+        if time_recorded is None:
+            raise ReadingUploadError(f'Reading time {value} is not a valid ISO 8601 datetime')
+        if timezone.is_naive(time_recorded):
+            time_recorded = timezone.make_aware(time_recorded, timezone.utc)
+        return time_recorded
+    if isinstance(value, bool) or not isinstance(value, (int, Decimal)):
+        raise ReadingUploadError('Reading times must be ISO 8601 strings or unix timestamps')
+    try:
+        return codecs.EPOCH + datetime.timedelta(seconds=float(value))
+    except OverflowError:
+        raise ReadingUploadError(f'Reading time {value} is out of range')
+
+
+def parse_json_readings(body):
+    """Parse the minimal JSON payload devices upload.
+
+    The payload is a JSON array of temperatures in degrees Celsius, e.g. `[21.5, 21.5625]`.
+    Devices that number or timestamp their readings send objects instead, e.g.
+    `[{"degrees_c": 21.5, "sequence": 41, "time_recorded": "2020-03-01T12:00:00Z"}]`, where
+    time_recorded may also be given in unix seconds. Readings without a time are stamped by the
+    server when they are stored. Numbers are parsed straight to Decimal so no precision is lost on
+    the way in.
+
+    Args:
+        body: raw request body
+
+    Returns:
+        list of dicts of TemperatureReading field values, ready for store_readings
+
+    Raises:
+        ReadingUploadError: if the payload is malformed, empty, too big or out of range
+    """
+    try:
+        values = json.loads(body, parse_float=Decimal)
+    except ValueError:
+        raise ReadingUploadError('Payload is not valid JSON')
+
+    if not isinstance(values, list) or not values:
+        raise ReadingUploadError('Payload must be a non-empty list of temperatures')
+    if len(values) > settings.TEMPERATURE_MAX_BATCH_SIZE:
+        raise ReadingUploadError(
+            f'Batches may contain at most {settings.TEMPERATURE_MAX_BATCH_SIZE} readings'
+        )
+
+    readings = []
+    for value in values:
+        reading = {}
+        if isinstance(value, dict):
+            sequence = value.get('sequence')
+            if sequence is not None:
+                if (isinstance(sequence, bool) or not isinstance(sequence, int) or
+                        not 0 <= sequence <= MAX_SEQUENCE):
+                    raise ReadingUploadError(f'Sequence {sequence} is not a valid sequence number')
+                reading['sequence'] = sequence
+            time_recorded = value.get('time_recorded')
+            if time_recorded is not None:
+                reading['time_recorded'] = parse_json_time(time_recorded)
+            value = value.get('degrees_c')
+        if isinstance(value, bool) or not isinstance(value, (int, Decimal)):
+            raise ReadingUploadError('Temperatures must be numbers')
+        if abs(value) >= MAX_ABS_DEGREES_C:
+            raise ReadingUploadError(f'Temperature {value} is out of range')
+        reading['degrees_c'] = Decimal(value)
+        readings.append(reading)
+    return readings
+
+
+def apply_deadband(thermometer, readings):
+    """Drop readings that the thermometer's deadband merges into an earlier reading.
+
+    A reading is merged when it is within thermometer.deadband_c degrees of the last stored
+    reading and less than thermometer.deadband_seconds after it. Merged readings extend the
+    stored reading's valid_until instead of adding a row, and their sequence numbers are kept
+    in its merged_sequence, so retries of them are still recognized as stored. Readings older
+    than the last stored reading (late store-and-forward uploads) are always kept.
+
+    Args:
+        thermometer: Thermometer the readings belong to
+        readings: list of TemperatureReading objects, not yet saved
+
+    Returns:
+        list of the readings to insert
+    """
+    if thermometer.deadband_c is None or not readings:
+        return readings
+
+    deadband_c = thermometer.deadband_c
+    window = datetime.timedelta(seconds=thermometer.deadband_seconds)
+    stored = (
+        TemperatureReading.objects
+        .filter(thermometer=thermometer)
+        .only('id', 'degrees_c', 'time_recorded', 'valid_until', 'merged_sequence')
+        .order_by('-time_recorded')
+        .first()
+    )
+    anchor = stored
+    extended = False
+
+    kept = []
+    for reading in sorted(readings, key=lambda reading: reading.time_recorded):
+        if anchor is not None and reading.time_recorded >= anchor.time_recorded:
+            if (abs(reading.degrees_c - anchor.degrees_c) <= deadband_c and
+                    reading.time_recorded - anchor.time_recorded < window):
+                if anchor.valid_until is None or reading.time_recorded > anchor.valid_until:
+                    anchor.valid_until = reading.time_recorded
+                    extended = extended or anchor is stored
+                if reading.sequence is not None and (anchor.merged_sequence is None or
+                                                     reading.sequence > anchor.merged_sequence):
+                    anchor.merged_sequence = reading.sequence
+                    extended = extended or anchor is stored
+                continue
+        if anchor is None or reading.time_recorded >= anchor.time_recorded:
+            anchor = reading
+        kept.append(reading)
+
+    if extended:
+        # time_recorded lets a partitioned table prune the update to one partition
+        TemperatureReading.objects.filter(
+            pk=stored.pk, time_recorded=stored.time_recorded
+        ).update(valid_until=stored.valid_until, merged_sequence=stored.merged_sequence)
+    return kept
+
+
+def stored_sequence_ranges(thermometer, low, high):
+    """
+    Return the (first, last) sequence number ranges stored for the thermometer that overlap
+    `low` up to `high`, sorted. A reading with a merged_sequence stands for the range up to it.
+    Ranges don't overlap, so only the nearest reading numbered below `low` can reach into it,
+    and it is found with one step along the (thermometer, sequence) index.
+    """
+    readings = TemperatureReading.objects.filter(thermometer=thermometer)
+    rows = list(
+        readings.filter(sequence__gte=low, sequence__lte=high)
+        .values_list('sequence', 'merged_sequence')
+    )
+    before = (
+        readings.filter(sequence__lt=low).order_by('-sequence')
+        .values_list('sequence', 'merged_sequence').first()
+    )
+    if before is not None:
+        rows.append(before)
+    return sorted((first, last if last is not None else first) for first, last in rows)
+
+
+def skip_stored_sequences(thermometer, readings):
+    """
+    Return the readings whose sequence numbers aren't already stored for the thermometer,
+    whether as a reading of their own or merged into one by the deadband, or repeated earlier
+    in the batch. Readings without a sequence number are all kept. Stored sequences are looked
+    up with range queries rather than a list of every number.
+    """
+    sequences = [reading.sequence for reading in readings if reading.sequence is not None]
+    if not sequences:
+        return readings
+    ranges = stored_sequence_ranges(thermometer, min(sequences), max(sequences))
+    firsts = [first for first, last in ranges]
+    seen = set()
+    kept = []
+    for reading in readings:
+        if reading.sequence is not None:
+            index = bisect.bisect_right(firsts, reading.sequence) - 1
+            if reading.sequence in seen or (index >= 0 and
+                                            reading.sequence <= ranges[index][1]):
+                continue
+            seen.add(reading.sequence)
+        kept.append(reading)
+    return kept
+
+
+def update_latest_reading(thermometer, readings):
+    """
+    Add newly stored readings to their thermometer's reading count, and make the newest of them
+    its latest reading unless a newer one is already stored. Done in one UPDATE of the
+    thermometer row, which compares against the row's current values, so concurrent batches
+    can't overwrite a newer reading with an older one. Must run in the transaction that stored
+    the readings.
+    """
+    newest = max(readings, key=lambda reading: reading.time_recorded)
+    is_newer = (Q(latest_time_recorded__isnull=True) |
+                Q(latest_time_recorded__lte=newest.time_recorded))
+    Thermometer.objects.filter(pk=thermometer.pk).update(
+        reading_count=F('reading_count') + len(readings),
+        latest_degrees_c=Case(
+            When(is_newer, then=Value(newest.degrees_c, output_field=LATEST_DEGREES_C)),
+            default=F('latest_degrees_c'),
+        ),
+        latest_time_recorded=Case(
+            When(is_newer, then=Value(newest.time_recorded)),
+            default=F('latest_time_recorded'),
+        ),
+    )
+
+
+def refresh_latest_reading(thermometer):
+    """
+    Recompute a thermometer's latest reading and reading count from the readings it has kept,
+    raw and compacted. For readings written other than through store_readings, and for
+    thermometers whose readings predate the counts.
+    """
+    latest = thermometer.temperatures.values('degrees_c', 'time_recorded').first()
+    block = thermometer.blocks.only('data').first()
+    if block is not None:
+        compacted = decode_block(block.data)[-1]
+        if latest is None or compacted['time_recorded'] > latest['time_recorded']:
+            latest = compacted
+    compacted_count = thermometer.blocks.aggregate(count=Sum('count'))['count'] or 0
+    Thermometer.objects.filter(pk=thermometer.pk).update(
+        reading_count=thermometer.temperatures.count() + compacted_count,
+        latest_degrees_c=latest and latest['degrees_c'],
+        latest_time_recorded=latest and latest['time_recorded'],
+    )
+
+
+def store_readings(thermometer, readings):
+    """Write a batch of validated readings for a thermometer.
+
+    All readings are inserted with a single multi-row INSERT inside one transaction, instead of
+    one INSERT and one commit per reading. The thermometer's row is locked for the transaction,
+    so concurrent batches for the same thermometer are stored one after the other. Readings
+    whose sequence number is already stored for the thermometer are skipped, so retried uploads
+    are idempotent. If the thermometer has a
+    deadband, readings it merges are not stored at all. The stored readings are added to the
+    thermometer's rollups, reading count and latest reading in the same transaction.
+
+    Args:
+        thermometer: Thermometer the readings belong to
+        readings: iterable of dicts of validated TemperatureReading field values
+
+    Returns:
+        list of the TemperatureReading objects stored
+
+    Raises:
+        Thermometer.DoesNotExist: if the thermometer has been deleted
+    """
+    new_readings = [
+        TemperatureReading(thermometer=thermometer, **reading) for reading in readings
+    ]
+    if not new_readings:
+        return []
+
+    with transaction.atomic():
+        # Batches for the same thermometer are stored one at a time, so a retry sent while the
+        # first upload is still being written sees its sequences and isn't counted twice
+        Thermometer.objects.select_for_update().only('id').get(pk=thermometer.pk)
+        new_readings = apply_deadband(thermometer, skip_stored_sequences(thermometer, new_readings))
+        if not new_readings:
+            return []
+        TemperatureReading.objects.bulk_create(new_readings)
+        update_rollups(thermometer, new_readings)
+        update_latest_reading(thermometer, new_readings)
+        return new_readings
+
+
+def record_readings(thermometer, readings):
+    """Record a batch of validated readings, through the ingestion buffer if it is enabled.
+
+    Args:
+        thermometer: Thermometer the readings belong to
+        readings: list of dicts of validated TemperatureReading field values
+
+    Returns:
+        None if the readings were queued to be written later, otherwise the list of
+        TemperatureReading objects stored now, leaving out skipped and merged readings
+
+    Raises:
+        IngestBufferFull: if the buffer has no room for the readings
+    """
+    buffer = get_buffer()
+    if buffer is None:
+        return store_readings(thermometer, readings)
+    buffer.submit(thermometer, readings)
+    return None
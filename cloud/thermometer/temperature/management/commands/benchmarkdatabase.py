@@ -0,0 +1,152 @@
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from temperature.management.commands.loadtest import LatencyRecorder
+from temperature.models import Thermometer, TemperatureReading
+from thermometer.database import sqlite_profile
+
+# Databases compared: the settings this project used to have, and the sqlite profile
+PROFILES = {
+    'untuned': {'pragmas': {'journal_mode': 'DELETE'}, 'conn_max_age': 0},
+    'tuned': {},
+}
+
+
+class Command(BaseCommand):
+    """Compare SQLite database profiles under mixed ingest and read load.
+
+    For each profile, creates a fresh SQLite file with the project's tables, then runs writer
+    threads inserting batches of readings and reader threads querying recent readings, for a
+    fixed time. Each insert or query is treated as one request: with CONN_MAX_AGE 0 its
+    connection is closed afterwards, as Django closes it at the end of a request. Reports
+    throughput, p50/p95/p99 latency and errors such as "database is locked" per profile.
+
+    Example:
+        python manage.py benchmarkdatabase --writers 4 --readers 8 --duration 20
+    """
+    help = 'Compare SQLite database profiles under mixed ingest and read load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4,
+                            help='Threads inserting readings')
+        parser.add_argument('--readers', type=int, default=8,
+                            help='Threads reading recent readings')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Readings per insert')
+        parser.add_argument('--thermometers', type=int, default=10,
+                            help='Thermometers to spread readings across')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds to run each profile for')
+        parser.add_argument('--profile', action='append', dest='profiles', choices=PROFILES,
+                            help='Profile to run. May be given more than once. Defaults to all.')
+
+    def handle(self, *args, **options):
+        if options['writers'] < 1 and options['readers'] < 1:
+            raise CommandError('Need at least one writer or reader')
+        self.options = options
+        results = []
+        for name in options['profiles'] or PROFILES:
+            directory = tempfile.mkdtemp()
+            alias = f'benchmark_{name}'
+            try:
+                connections.databases[alias] = sqlite_profile(
+                    os.path.join(directory, 'benchmark.sqlite3'), **PROFILES[name]
+                )
+                self.stdout.write(f'Running {name} profile for {options["duration"]}s...')
+                results.append((name, self.run(alias)))
+            finally:
+                connections[alias].close()
+                del connections.databases[alias]
+                shutil.rmtree(directory)
+        self.report(results)
+
+    def run(self, alias):
+        """
+        Create the tables and thermometers in a fresh database, then run the load. Returns the
+        LatencyRecorder summary.
+        """
+        call_command('migrate', database=alias, run_syncdb=True, verbosity=0)
+        thermometer_ids = [
+            Thermometer.objects.using(alias).create(display_name=f'Benchmark {number}').pk
+            for number in range(self.options['thermometers'])
+        ]
+        connections[alias].close()
+
+        recorder = LatencyRecorder()
+        deadline = time.monotonic() + self.options['duration']
+        threads = [
+            threading.Thread(target=self.loop, args=(alias, self.write, thermometer_ids, recorder,
+                                                     deadline))
+            for _ in range(self.options['writers'])
+        ]
+        threads += [
+            threading.Thread(target=self.loop, args=(alias, self.read, thermometer_ids, recorder,
+                                                     deadline))
+            for _ in range(self.options['readers'])
+        ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return recorder.summary(time.monotonic() - start)
+
+    def loop(self, alias, operation, thermometer_ids, recorder, deadline):
+        """
+        Run one operation after another until the deadline, ending a request after each.
+        """
+        connection = connections[alias]
+        try:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    endpoint, readings = operation(alias, random.choice(thermometer_ids))
+                    ok = True
+                except DatabaseError:
+                    endpoint, readings, ok = operation.__name__, 0, False
+                recorder.record(endpoint, time.perf_counter() - start, ok, readings)
+                connection.close_if_unusable_or_obsolete()
+        finally:
+            connection.close()
+
+    def write(self, alias, thermometer_id):
+        now = timezone.now()
+        batch = [
+            TemperatureReading(
+                thermometer_id=thermometer_id,
+                degrees_c=round(random.uniform(22, 28), 3),
+                time_recorded=now - datetime.timedelta(seconds=i),
+            )
+            for i in range(self.options['batch_size'])
+        ]
+        with transaction.atomic(using=alias):
+            TemperatureReading.objects.using(alias).bulk_create(batch)
+        return 'write', len(batch)
+
+    def read(self, alias, thermometer_id):
+        list(TemperatureReading.objects.using(alias).filter(thermometer_id=thermometer_id)[:100])
+        return 'read', 0
+
+    def report(self, results):
+        header = (f"{'profile':<10}{'operation':<8}{'count':>8}{'errors':>8}{'ops/s':>10}"
+                  f"{'readings/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        self.stdout.write('')
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, rows in results:
+            for row in rows:
+                self.stdout.write(
+                    f"{name:<10}{row['endpoint']:<8}{row['requests']:>8}{row['errors']:>8}"
+                    f"{row['requests_per_second']:>10.1f}{row['readings_per_second']:>12.1f}"
+                    f"{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}"
+                )
@@ -0,0 +1,124 @@
+import datetime
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from temperature.management.commands.loadtest import percentile
+from temperature.models import Thermometer, TemperatureReading
+
+INDEX_NAME = TemperatureReading._meta.indexes[0].name
+
+
+def read_queries(user, thermometer, now):
+    """
+    Return (name, queryset, explained queryset) for each query the API runs to read readings.
+    The explained queryset differs where the interesting query is a prefetch.
+    """
+    readings = thermometer.temperatures.all()
+    queries = [
+        ('recent readings', readings[:100], None),
+        ('latest reading', readings[:1], None),
+        ('last hour', readings.filter(time_recorded__gte=now - datetime.timedelta(hours=1)), None),
+        ('reading list page',
+         TemperatureReading.objects.select_related('thermometer')
+         .filter(thermometer__owner=user)[:10], None),
+        ('thermometer detail',
+         Thermometer.objects.filter(pk=thermometer.pk).prefetch_related('temperatures'),
+         TemperatureReading.objects.filter(thermometer__in=[thermometer])),
+    ]
+    return [(name, queryset, explained or queryset) for name, queryset, explained in queries]
+
+
+class Command(BaseCommand):
+    """Time the queries the API uses to read temperature readings.
+
+    Generates a user with thermometers full of readings, runs each read query repeatedly, then
+    rolls everything back. Reports median and p95 time per query, and whether the database plan
+    uses the (thermometer, time_recorded) index.
+
+    Example:
+        python manage.py benchmarkreadings --thermometers 20 --readings 50000 --repeat 20
+    """
+    help = 'Time the temperature reading queries against generated data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--thermometers', type=int, default=10,
+                            help='Number of thermometers to generate')
+        parser.add_argument('--readings', type=int, default=10000,
+                            help='Readings per thermometer, one a minute')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Times to run each query')
+        parser.add_argument('--explain', action='store_true',
+                            help='Print the full query plans')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user, thermometer, now = self.generate(options['thermometers'], options['readings'])
+            rows = [self.measure(name, queryset, explained, options)
+                    for name, queryset, explained in read_queries(user, thermometer, now)]
+            transaction.set_rollback(True)
+        self.report(rows)
+
+    def generate(self, thermometers, readings):
+        """
+        Create a user and thermometers with a reading a minute up to now. Returns the user, one
+        of the thermometers and the time of the latest reading.
+        """
+        self.stdout.write(
+            f'Generating {thermometers} thermometers with {readings} readings each...'
+        )
+        user = get_user_model().objects.create_user(username=f'benchmark-{time.time_ns()}')
+        now = timezone.now().replace(second=0, microsecond=0)
+        therms = []
+        for number in range(thermometers):
+            therm = Thermometer.objects.create(display_name=f'Benchmark {number}')
+            therm.register(user)
+            degrees_c = random.uniform(22, 28)
+            batch = []
+            for minute in range(readings):
+                degrees_c += random.uniform(-0.05, 0.05)
+                batch.append(TemperatureReading(
+                    thermometer=therm,
+                    degrees_c=round(degrees_c, 3),
+                    time_recorded=now - datetime.timedelta(minutes=readings - minute - 1),
+                ))
+            TemperatureReading.objects.bulk_create(batch)
+            therms.append(therm)
+        return user, therms[len(therms) // 2], now
+
+    def measure(self, name, queryset, explained, options):
+        """
+        Run a query `repeat` times and return its timings in milliseconds and its plan.
+        """
+        timings = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            rows = len(list(queryset.all()))
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        plan = explained.explain()
+        if options['explain']:
+            self.stdout.write(f'\n{name}:\n{plan}')
+        return {
+            'query': name,
+            'rows': rows,
+            'median': statistics.median(timings),
+            'p95': percentile(timings, 95),
+            'index': INDEX_NAME in plan,
+        }
+
+    def report(self, rows):
+        header = f"{'query':<22}{'rows':>8}{'median ms':>12}{'p95 ms':>10}{'uses index':>12}"
+        self.stdout.write('')
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in rows:
+            self.stdout.write(
+                f"{row['query']:<22}{row['rows']:>8}{row['median']:>12.2f}{row['p95']:>10.2f}"
+                f"{'yes' if row['index'] else 'no':>12}"
+            )
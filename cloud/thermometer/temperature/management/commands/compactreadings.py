@@ -0,0 +1,56 @@
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from temperature.blocks import compact
+from temperature.models import ReadingBlock, Thermometer
+
+
+class Command(BaseCommand):
+    """Move old raw readings into compressed per-day blocks.
+
+    Every whole UTC day of raw readings older than --days days is packed into one ReadingBlock
+    per thermometer, and the readings are deleted from the reading table. Each day is compacted
+    in its own transaction, and days compacted earlier absorb any readings stored for them
+    since. See temperature.blocks for the format.
+
+    Example:
+        python manage.py compactreadings --days 30
+    """
+    help = 'Pack raw readings older than a number of days into compressed daily blocks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TEMPERATURE_COLD_STORAGE_DAYS,
+                            help='Compact readings older than this many days')
+        parser.add_argument('--thermometer', action='append', dest='therm_ids', metavar='THERM_ID',
+                            help='Compact only this thermometer. May be given more than once.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+
+        thermometers = Thermometer.objects.order_by('pk')
+        if options['therm_ids']:
+            try:
+                thermometers = thermometers.filter(therm_id__in=options['therm_ids'])
+            except ValidationError as error:
+                raise CommandError(f'Invalid thermometer id: {error.messages[0]}')
+
+        total = 0
+        for thermometer in thermometers:
+            moved, days = compact(thermometer, before)
+            if moved:
+                self.stdout.write(f'{thermometer.display_name}: {moved} readings in {days} days')
+            total += moved
+
+        blocks = ReadingBlock.objects.aggregate(readings=Sum('count'), size=Sum(Length('data')))
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {total} readings. Blocks hold {blocks["readings"] or 0} readings in '
+            f'{blocks["size"] or 0} bytes.'
+        ))
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from temperature import retention
+
+
+class Command(BaseCommand):
+    """Delete readings and rollups older than the retention policy keeps.
+
+    Applies settings.TEMPERATURE_RETENTION: raw readings, minute rollups and hourly rollups
+    older than their retention are deleted, and daily rollups are kept. Rows are deleted in
+    small chunks, each in its own transaction with a pause between them, so the command can run
+    alongside uploads, e.g. nightly from cron.
+
+    Example:
+        python manage.py expirereadings --chunk-size 2000 --pause-ms 100
+    """
+    help = 'Delete readings and rollups the retention policy has expired'
+
+    def add_arguments(self, parser):
+        policy = settings.TEMPERATURE_RETENTION
+        parser.add_argument('--chunk-size', type=int, default=policy['CHUNK_SIZE'],
+                            help='Most rows deleted per transaction')
+        parser.add_argument('--pause-ms', type=int, default=policy['CHUNK_PAUSE_MS'],
+                            help='Milliseconds to pause between chunks')
+        parser.add_argument('--tier', action='append', dest='tiers',
+                            choices=tuple(retention.cutoffs(timezone.now())),
+                            help='Expire only this tier. May be given more than once.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the cutoff for each tier without deleting anything')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['pause_ms'] < 0:
+            raise CommandError('--chunk-size must be positive and --pause-ms not negative')
+        now = timezone.now()
+        for tier, cutoff in retention.cutoffs(now).items():
+            if options['tiers'] is None or tier in options['tiers']:
+                self.stdout.write(f"{tier}: {'kept forever' if cutoff is None else cutoff}")
+        if options['dry_run']:
+            return
+
+        deleted, dropped = retention.expire(
+            now, options['chunk_size'], options['pause_ms'] / 1000, options['tiers']
+        )
+        for name in dropped:
+            self.stdout.write(f'Dropped partition {name}')
+        for tier, count in deleted.items():
+            self.stdout.write(f'Deleted {count} {tier} rows')
+        self.stdout.write(self.style.SUCCESS(f'Expired {sum(deleted.values())} rows'))
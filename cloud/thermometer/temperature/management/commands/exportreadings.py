@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from temperature.export import export, export_dir
+from temperature.models import Thermometer
+
+
+class Command(BaseCommand):
+    """Export readings as memory-mappable columnar arrays for analysis.
+
+    Writes each thermometer's readings, raw and compacted, to int64 time and float32 temperature
+    arrays under TEMPERATURE_EXPORT_ROOT. Each run appends only the readings recorded since the
+    last one, so it can run from cron. See temperature.export for the layout.
+
+    Example:
+        python manage.py exportreadings --thermometer 6c3b6a6e-0f0e-4bba-9d1c-3d1b8a3e1f21
+    """
+    help = 'Append readings to columnar arrays for analysis'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--thermometer', action='append', dest='therm_ids', metavar='THERM_ID',
+                            help='Export only this thermometer. May be given more than once.')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Discard existing exports and write every reading again')
+
+    def handle(self, *args, **options):
+        thermometers = Thermometer.objects.order_by('pk')
+        if options['therm_ids']:
+            try:
+                thermometers = thermometers.filter(therm_id__in=options['therm_ids'])
+            except ValidationError as error:
+                raise CommandError(f'Invalid thermometer id: {error.messages[0]}')
+
+        total = 0
+        for thermometer in thermometers:
+            appended, count = export(thermometer, rebuild=options['rebuild'])
+            self.stdout.write(f'{thermometer.display_name}: {appended} readings appended, '
+                              f'{count} in {export_dir(thermometer)}')
+            total += appended
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {total} readings to {settings.TEMPERATURE_EXPORT_ROOT}'
+        ))
@@ -0,0 +1,154 @@
+import csv
+from decimal import Decimal, InvalidOperation
+import json
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from temperature.exceptions import ReadingUploadError
+from temperature.ingest import (
+    INGEST_FIELDS, MAX_ABS_DEGREES_C, parse_json_time, store_readings
+)
+from temperature.models import MAX_SEQUENCE, ImportCheckpoint, Thermometer
+
+
+class Command(BaseCommand):
+    """Stream a historical archive of readings into the database.
+
+    Reads CSV (with a header row) or newline-delimited JSON with the fields therm_id,
+    time_recorded, degrees_c and optionally sequence. time_recorded is an ISO 8601 datetime or
+    unix seconds. The file is read one line at a time and written in chunks, each chunk in one
+    transaction with one bulk insert per thermometer, so memory use doesn't grow with the file.
+
+    The byte offset reached is saved to an ImportCheckpoint row in the same transaction as each
+    chunk, so it always matches what has been written. Running the command again on the same
+    file resumes from the checkpoint without writing any chunk twice, whether or not its readings
+    have sequence numbers. The checkpoint is removed once the import finishes. Importing a
+    finished file again, or with --restart, skips only readings whose sequence numbers are
+    already stored; readings without them are written again.
+
+    Example:
+        python manage.py importreadings tank-logs-2018.csv --chunk-size 10000
+    """
+    help = 'Import readings from a CSV or NDJSON archive in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file to import')
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='File format. Defaults to guessing from the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Readings written per transaction')
+        parser.add_argument('--checkpoint',
+                            help='Checkpoint name. Defaults to the absolute import path.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore any existing checkpoint and import from the beginning')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        self.checkpoint_name = options['checkpoint'] or os.path.abspath(path)
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        checkpoints = ImportCheckpoint.objects.filter(name=self.checkpoint_name)
+        if options['restart']:
+            checkpoints.delete()
+        checkpoint = checkpoints.first() or ImportCheckpoint(name=self.checkpoint_name)
+        if checkpoint.offset:
+            self.stdout.write(
+                f'Resuming from byte {checkpoint.offset} after {checkpoint.rows} readings'
+            )
+
+        self.thermometers = {}
+        total_size = os.path.getsize(path)
+        rows = checkpoint.rows
+        chunk = []
+
+        with open(path, 'rb') as archive:
+            columns = None
+            if file_format == 'csv':
+                columns = next(csv.reader([archive.readline().decode()]))
+            if checkpoint.offset:
+                archive.seek(checkpoint.offset)
+
+            while True:
+                line = archive.readline()
+                if line.strip():
+                    chunk.append(self.parse_line(line.decode(), columns, file_format))
+                if len(chunk) >= chunk_size or (not line and chunk):
+                    rows += len(chunk)
+                    offset = archive.tell()
+                    self.write_chunk(chunk, offset, rows)
+                    chunk = []
+                    self.stdout.write(
+                        f'Imported {rows} readings ({offset / max(total_size, 1):.0%})'
+                    )
+                if not line:
+                    break
+
+        checkpoints.delete()
+        self.stdout.write(self.style.SUCCESS(f'Finished importing {rows} readings'))
+
+    def parse_line(self, line, columns, file_format):
+        """
+        Turn one line of the archive into a (thermometer, reading) tuple.
+        """
+        try:
+            if file_format == 'csv':
+                record = dict(zip(columns, next(csv.reader([line]))))
+            else:
+                record = json.loads(line, parse_float=Decimal)
+            degrees_c = Decimal(str(record['degrees_c']))
+            if not degrees_c.is_finite() or abs(degrees_c) >= MAX_ABS_DEGREES_C:
+                raise ValueError(f'temperature {degrees_c} is out of range')
+
+            time_recorded = record['time_recorded']
+            if isinstance(time_recorded, str) and not time_recorded.count('-'):
+                time_recorded = Decimal(time_recorded)
+            reading = {
+                'degrees_c': degrees_c,
+                'time_recorded': parse_json_time(time_recorded),
+            }
+            if record.get('sequence') not in (None, ''):
+                sequence = int(record['sequence'])
+                if not 0 <= sequence <= MAX_SEQUENCE:
+                    raise ValueError(f'sequence {sequence} is out of range')
+                reading['sequence'] = sequence
+            return self.get_thermometer(record['therm_id']), reading
+        except (KeyError, ValueError, InvalidOperation, ReadingUploadError,
+                ValidationError) as error:
+            raise CommandError(f'Could not import line {line.strip()!r}: {error}')
+
+    def get_thermometer(self, therm_id):
+        """
+        Look up a thermometer by therm_id, remembering it for the rest of the import.
+        """
+        if therm_id not in self.thermometers:
+            thermometer = (
+                Thermometer.objects.only(*INGEST_FIELDS).filter(therm_id=therm_id).first()
+            )
+            if thermometer is None:
+                raise ValueError(f'no thermometer with therm_id {therm_id}')
+            self.thermometers[therm_id] = thermometer
+        return self.thermometers[therm_id]
+
+    def write_chunk(self, chunk, offset, rows):
+        """
+        Write a chunk in one transaction, with one bulk insert per thermometer in it, and save
+        the checkpoint it reaches in the same transaction.
+        """
+        by_thermometer = {}
+        for thermometer, reading in chunk:
+            by_thermometer.setdefault(thermometer.pk, (thermometer, []))[1].append(reading)
+        with transaction.atomic():
+            for thermometer, readings in by_thermometer.values():
+                store_readings(thermometer, readings)
+            self.save_checkpoint(offset, rows)
+
+    def save_checkpoint(self, offset, rows):
+        ImportCheckpoint.objects.update_or_create(
+            name=self.checkpoint_name, defaults={'offset': offset, 'rows': rows}
+        )
@@ -0,0 +1,296 @@
+import datetime
+import heapq
+import math
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+import requests
+
+from temperature import codecs
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of an already sorted list of values.
+    """
+    if not values:
+        return None
+    rank = math.ceil(percent / 100 * len(values))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class LatencyRecorder:
+    """Thread-safe collection of request timings, grouped by endpoint.
+
+    Methods:
+        record: Record one request's latency, status and number of readings sent
+        summary: Return per-endpoint counts, throughput and latency percentiles
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._errors = {}
+        self._readings = {}
+
+    def record(self, endpoint, seconds, ok, readings=0):
+        with self._lock:
+            self._latencies.setdefault(endpoint, []).append(seconds)
+            self._errors[endpoint] = self._errors.get(endpoint, 0) + (not ok)
+            self._readings[endpoint] = self._readings.get(endpoint, 0) + readings
+
+    def summary(self, elapsed):
+        """
+        Return a list of dicts, one per endpoint, with latencies in milliseconds.
+        """
+        rows = []
+        with self._lock:
+            for endpoint, latencies in sorted(self._latencies.items()):
+                latencies = sorted(latencies)
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': len(latencies),
+                    'errors': self._errors[endpoint],
+                    'requests_per_second': len(latencies) / elapsed,
+                    'readings_per_second': self._readings[endpoint] / elapsed,
+                    'p50': percentile(latencies, 50) * 1000,
+                    'p95': percentile(latencies, 95) * 1000,
+                    'p99': percentile(latencies, 99) * 1000,
+                })
+        return rows
+
+
+class SimulatedThermometer:
+    """A thermometer registered through the API, generating readings for upload.
+
+    Fields:
+        url: API url of the thermometer
+        ingest_url: Device upload url
+        device_key: Key the device authenticates its uploads with
+        sequence: Sequence number of the next reading
+        degrees_c: Current simulated temperature
+    """
+
+    def __init__(self, url, ingest_url, device_key):
+        self.url = url
+        self.ingest_url = ingest_url
+        self.device_key = device_key
+        self.sequence = 0
+        self.degrees_c = random.uniform(22, 28)
+
+    def take_readings(self, count):
+        """
+        Return `count` readings as (sequence, time, degrees) tuples, drifting slowly like a tank.
+        """
+        now = timezone.now()
+        readings = []
+        for i in range(count):
+            self.degrees_c += random.uniform(-0.05, 0.05)
+            readings.append((self.sequence, now - datetime.timedelta(seconds=count - i),
+                             round(self.degrees_c * 16) / 16))
+            self.sequence += 1
+        return readings
+
+
+class Command(BaseCommand):
+    """Simulate a fleet of thermometers against a running server.
+
+    Logs in as an existing user, registers thermometers through the API, gives each a device key,
+    then has every thermometer upload batches of readings at a fixed rate while reader threads
+    poll the list and detail endpoints. Reports throughput and p50/p95/p99 latency per endpoint.
+
+    Example:
+        python manage.py loadtest --username admin --password secret --thermometers 200 \\
+            --interval 5 --batch-size 10 --readers 4 --duration 60
+    """
+    help = 'Simulate a fleet of thermometers posting readings to a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000',
+                            help='Base url of the server under test')
+        parser.add_argument('--username', required=True, help='User to register thermometers to')
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--thermometers', type=int, default=10,
+                            help='Number of thermometers to simulate')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds between uploads from each thermometer')
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help='Readings per upload')
+        parser.add_argument('--format', choices=('json', 'binary', 'bulk'), default='json',
+                            help='Upload as device JSON, device binary batches, or through the '
+                                 'authenticated bulk readings endpoint')
+        parser.add_argument('--readers', type=int, default=1,
+                            help='Threads polling the read endpoints')
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help='Threads sending uploads')
+        parser.add_argument('--duration', type=float, default=30.0,
+                            help='Seconds to run for')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the simulated thermometers afterwards")
+
+    def handle(self, *args, **options):
+        self.base_url = options['url'].rstrip('/')
+        self.options = options
+        self.recorder = LatencyRecorder()
+        self.session_local = threading.local()
+        self.token = self.login(options['username'], options['password'])
+
+        self.stdout.write(f"Registering {options['thermometers']} thermometers...")
+        fleet = [self.register(i) for i in range(options['thermometers'])]
+
+        try:
+            elapsed = self.run(fleet)
+        finally:
+            if not options['keep']:
+                for thermometer in fleet:
+                    self.session().delete(thermometer.url, headers=self.auth_headers())
+
+        self.report(elapsed)
+
+    def session(self):
+        """
+        Return a requests session for the current thread, so connections are reused.
+        """
+        if not hasattr(self.session_local, 'session'):
+            self.session_local.session = requests.Session()
+        return self.session_local.session
+
+    def auth_headers(self):
+        return {'Authorization': f'Token {self.token}'}
+
+    def login(self, username, password):
+        response = self.session().post(
+            f'{self.base_url}/rest-auth/login/',
+            json={'username': username, 'password': password}
+        )
+        if response.status_code != 200:
+            raise CommandError(f'Login failed: {response.status_code} {response.text}')
+        return response.json()['key']
+
+    def register(self, number):
+        """
+        Create a thermometer through the viewset and generate its device key.
+        """
+        response = self.session().post(
+            f'{self.base_url}/thermometers/',
+            json={'display_name': f'Load test thermometer {number}'},
+            headers=self.auth_headers()
+        )
+        if response.status_code != 201:
+            raise CommandError(f'Registering thermometer failed: {response.text}')
+        therm = response.json()
+        response = self.session().post(f"{therm['url']}device_key/", headers=self.auth_headers())
+        if response.status_code != 201:
+            raise CommandError(f'Generating device key failed: {response.text}')
+        return SimulatedThermometer(
+            therm['url'],
+            f"{self.base_url}/ingest/{therm['therm_id']}/",
+            response.json()['device_key']
+        )
+
+    def run(self, fleet):
+        """
+        Run uploaders and readers until the duration is up. Returns the elapsed seconds.
+        """
+        options = self.options
+        start = time.monotonic()
+        self.deadline = start + options['duration']
+
+        # Spread first uploads across one interval so the fleet doesn't post in lockstep
+        self.schedule = [
+            (start + options['interval'] * i / len(fleet), i) for i in range(len(fleet))
+        ]
+        heapq.heapify(self.schedule)
+        self.schedule_lock = threading.Lock()
+
+        threads = [
+            threading.Thread(target=self.upload_loop, args=(fleet,))
+            for _ in range(options['concurrency'])
+        ]
+        threads += [
+            threading.Thread(target=self.read_loop, args=(fleet,))
+            for _ in range(options['readers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - start
+
+    def upload_loop(self, fleet):
+        """
+        Take the thermometer due to upload soonest, wait until it is due, upload and reschedule.
+        """
+        while True:
+            with self.schedule_lock:
+                due, index = heapq.heappop(self.schedule)
+                heapq.heappush(self.schedule, (due + self.options['interval'], index))
+            if due >= self.deadline:
+                return
+            time.sleep(max(due - time.monotonic(), 0))
+            self.upload(fleet[index])
+
+    def upload(self, thermometer):
+        readings = thermometer.take_readings(self.options['batch_size'])
+        upload_format = self.options['format']
+        if upload_format == 'binary':
+            kwargs = {
+                'data': codecs.encode_readings(
+                    [(taken, int(degrees * 16)) for _, taken, degrees in readings],
+                    first_sequence=readings[0][0]
+                ),
+                'headers': {'Authorization': f'Device {thermometer.device_key}',
+                            'Content-Type': codecs.CONTENT_TYPE},
+            }
+            url = thermometer.ingest_url
+        else:
+            payload = [
+                {'degrees_c': degrees, 'sequence': sequence, 'time_recorded': taken.isoformat()}
+                for sequence, taken, degrees in readings
+            ]
+            if upload_format == 'bulk':
+                url = f'{thermometer.url}readings/'
+                kwargs = {'json': {'readings': payload}, 'headers': self.auth_headers()}
+            else:
+                url = thermometer.ingest_url
+                kwargs = {'json': payload,
+                          'headers': {'Authorization': f'Device {thermometer.device_key}'}}
+
+        self.timed(f'upload ({upload_format})', 'post', url, readings=len(readings), **kwargs)
+
+    def read_loop(self, fleet):
+        """
+        Poll the thermometer list, a thermometer's detail, and the reading list.
+        """
+        while time.monotonic() < self.deadline:
+            self.timed('thermometer list', 'get', f'{self.base_url}/thermometers/',
+                       headers=self.auth_headers())
+            self.timed('thermometer detail', 'get', random.choice(fleet).url,
+                       headers=self.auth_headers())
+            self.timed('temperature list', 'get', f'{self.base_url}/temperatures/',
+                       headers=self.auth_headers())
+
+    def timed(self, endpoint, method, url, readings=0, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session().request(method, url, timeout=30, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        self.recorder.record(endpoint, time.perf_counter() - start, ok, readings if ok else 0)
+
+    def report(self, elapsed):
+        self.stdout.write(f'\nRan for {elapsed:.1f}s\n')
+        header = (f"{'endpoint':<22}{'requests':>10}{'errors':>8}{'req/s':>10}{'readings/s':>12}"
+                  f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in self.recorder.summary(elapsed):
+            self.stdout.write(
+                f"{row['endpoint']:<22}{row['requests']:>10}{row['errors']:>8}"
+                f"{row['requests_per_second']:>10.1f}{row['readings_per_second']:>12.1f}"
+                f"{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}"
+            )
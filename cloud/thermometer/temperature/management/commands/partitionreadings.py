@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from temperature import partitions
+
+
+class Command(BaseCommand):
+    """Create upcoming monthly partitions of the reading table and drop expired ones.
+
+    Needs PostgreSQL with the reading table partitioned by the PartitionReadingsByMonth migration
+    operation; see temperature.partitions. Run it at least monthly, e.g. from cron, so there is
+    always a partition ready for incoming readings. Readings outside every partition land in the
+    default partition and are moved out when their month's partition is created.
+
+    With --keep, partitions older than that many months before the current one are dropped,
+    deleting their readings in one metadata operation.
+
+    Example:
+        python manage.py partitionreadings --ahead 3 --keep 24
+    """
+    help = 'Create upcoming monthly reading partitions and drop expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3,
+                            help='Months after the current one to create partitions for')
+        parser.add_argument('--keep', type=int,
+                            help='Drop partitions older than this many months before the current '
+                                 'one. Nothing is dropped without it.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the statements instead of running them')
+
+    def handle(self, *args, **options):
+        if options['ahead'] < 0 or (options['keep'] is not None and options['keep'] < 0):
+            raise CommandError('--ahead and --keep must not be negative')
+        if not partitions.is_partitioned(connection):
+            raise CommandError(
+                'The reading table is not partitioned. Partitioning needs PostgreSQL and the '
+                'PartitionReadingsByMonth migration operation.'
+            )
+
+        create, drop = partitions.plan_partitions(
+            partitions.existing_partitions(connection), timezone.now(),
+            options['ahead'], options['keep']
+        )
+        actions = ([('Creating', start, partitions.create_partition_sql(start)) for start in create]
+                   + [('Dropping', start, partitions.drop_partition_sql(start)) for start in drop])
+        if not actions:
+            self.stdout.write('Partitions are up to date')
+
+        for verb, start, statements in actions:
+            self.stdout.write(f'{verb} {partitions.partition_name(start)}')
+            if options['dry_run']:
+                for statement in statements:
+                    self.stdout.write(f'  {statement};')
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
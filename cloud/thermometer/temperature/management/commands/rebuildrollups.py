@@ -0,0 +1,76 @@
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from temperature.exceptions import ReadingUploadError
+from temperature.ingest import parse_json_time, refresh_latest_reading
+from temperature.models import ReadingRollup, Thermometer
+from temperature.rollups import bucket_start, rebuild_rollups
+
+
+class Command(BaseCommand):
+    """Recompute minute, hour and day rollups from raw readings.
+
+    Rollups are kept up to date as readings are stored, so this is only needed after readings
+    are written or deleted some other way, or to backfill rollups for existing readings. Each
+    thermometer is rebuilt a window of days at a time, one transaction per window. By default
+    the whole range of each thermometer's readings is rebuilt. Days the retention policy has
+    expired raw readings from are skipped, keeping their rollups. Each thermometer's latest
+    reading and reading count are recomputed too.
+
+    Example:
+        python manage.py rebuildrollups --since 2020-01-01 --until 2020-02-01
+    """
+    help = 'Recompute reading rollups from raw readings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--thermometer', action='append', dest='therm_ids', metavar='THERM_ID',
+                            help='Rebuild only this thermometer. May be given more than once.')
+        parser.add_argument('--since', help='ISO 8601 start of the range to rebuild')
+        parser.add_argument('--until', help='ISO 8601 end of the range to rebuild')
+        parser.add_argument('--window-days', type=int, default=7,
+                            help='Days rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        if options['window_days'] < 1:
+            raise CommandError('--window-days must be at least 1')
+        window = datetime.timedelta(days=options['window_days'])
+        since, until = self.parse_time(options['since']), self.parse_time(options['until'])
+
+        thermometers = Thermometer.objects.order_by('pk')
+        if options['therm_ids']:
+            try:
+                thermometers = thermometers.filter(therm_id__in=options['therm_ids'])
+            except ValidationError as error:
+                raise CommandError(f'Invalid thermometer id: {error.messages[0]}')
+
+        total = 0
+        for thermometer in thermometers:
+            refresh_latest_reading(thermometer)
+            span = thermometer.temperatures.aggregate(
+                first=Min('time_recorded'), last=Max('time_recorded')
+            )
+            start = since or span['first']
+            end = until or (span['last'] and span['last'] + datetime.timedelta(microseconds=1))
+            if start is None or end is None:
+                continue
+            start = bucket_start(start, ReadingRollup.DAY)
+            created = 0
+            while start < end:
+                with transaction.atomic():
+                    created += rebuild_rollups(thermometer, start, min(start + window, end))
+                start += window
+            total += created
+            self.stdout.write(f'{thermometer.display_name}: {created} rollups')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} rollups'))
+
+    def parse_time(self, value):
+        if value is None:
+            return None
+        try:
+            return parse_json_time(value)
+        except ReadingUploadError as error:
+            raise CommandError(str(error))
@@ -1,12 +1,21 @@
 import datetime
+import hashlib
+import hmac
 from random import randint
+import secrets
 import uuid
 
 from django.contrib.auth import get_user_model
+from django.core.validators import MinValueValidator
 from django.db import models, transaction
 from django.utils import timezone
 
 from .exceptions import ThermometerRegistrationError
+from .fields import BigMillidegreesField, MillidegreesField
+
+
+# Largest sequence number a reading can have
+MAX_SEQUENCE = 2 ** 31 - 1
 
 
 def get_random_name():
@@ -22,12 +31,27 @@ class Thermometer(models.Model):
         display_name: Name user gives to thermometer
         created_date: Date object was created
         registration_date: Date user registered thermometer
+        device_key_hash: SHA-256 hex digest of the secret the device authenticates with. Only the
+            digest is stored; the key itself is shown once when it is generated.
+        deadband_c: Readings within this many degrees of the last stored reading are merged into
+            it instead of being stored. Null to store every reading.
+        deadband_seconds: Longest time a stored reading can absorb later readings for. Once it
+            has passed, the next reading is stored even if the temperature hasn't moved.
+        latest_degrees_c: Temperature of the newest stored reading, so the current temperature
+            can be read without touching the readings table. Null until a reading is stored.
+        latest_time_recorded: Time of the newest stored reading
+        reading_count: Number of readings kept, raw and compacted. Both it and the latest
+            reading are updated in the transaction that stores each batch, expiring readings
+            takes them off the count, and the rebuildrollups command recounts them from the
+            readings still kept.
 
     Methods:
         register: Register a thermometer with a given ID. You must have the models ID to register.
             At the time of registration, the registration_date will be set to the current date. If
             provided the wrong date, registration should fail and raise
             ThermometerRegistrationError.
+        set_device_key: Generate and store a new device key, returning the raw key
+        check_device_key: Return whether a raw key matches the stored device key
 
     References:
     """
@@ -44,21 +68,59 @@ class Thermometer(models.Model):
     created_date = models.DateField(default=datetime.date.today)
     registered = models.BooleanField(default=False)
     registration_date = models.DateField(blank=True, null=True)
+    device_key_hash = models.CharField(max_length=64, blank=True, editable=False)
+    deadband_c = models.DecimalField(
+        max_digits=6,
+        decimal_places=3,
+        blank=True,
+        null=True,
+        validators=[MinValueValidator(0)]
+    )
+    deadband_seconds = models.PositiveIntegerField(default=300)
+    latest_degrees_c = MillidegreesField(blank=True, null=True, editable=False)
+    latest_time_recorded = models.DateTimeField(blank=True, null=True, editable=False)
+    reading_count = models.PositiveIntegerField(default=0, editable=False)
 
     def register(self, owner):
         """
         Register thermometer to provided user. If this thermometer is already
-        registered, raise ThermometerRegistrationError.
+        registered, raise ThermometerRegistrationError. Only the registration fields are saved,
+        so readings stored since the thermometer was loaded are still counted.
         """
         if not self.registered:
             self.owner = owner
             self.registered = True
             self.registration_date = datetime.date.today()
             with transaction.atomic():
-                self.save()
+                if self.pk is None:
+                    self.save()
+                else:
+                    self.save(update_fields=['owner', 'registered', 'registration_date'])
         else:
             raise ThermometerRegistrationError("Thermometer Already Registered")
 
+    def set_device_key(self):
+        """
+        Generate a new random device key, store its digest and return the raw key. Any previous key
+        stops working.
+        """
+        key = secrets.token_urlsafe(32)
+        self.device_key_hash = hashlib.sha256(key.encode()).hexdigest()
+        with transaction.atomic():
+            self.save(update_fields=['device_key_hash'])
+        return key
+
+    def check_device_key(self, key):
+        """
+        Compare a raw device key against the stored digest in constant time. A plain digest is used
+        rather than a password hasher, because the key is random and devices authenticate on every
+        upload.
+        """
+        if not self.device_key_hash or not key:
+            return False
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return hmac.compare_digest(digest, self.device_key_hash)
+
 
 class TemperatureReading(models.Model):
     """Class for a single temperature reading.
@@ -66,21 +128,172 @@ class TemperatureReading(models.Model):
     Fields:
         thermometer: Thermometer related to this temperature record
         degrees_c: Degrees Celsius at time of reading. Stored as celsius for accuracy, because
-            DS18B20 digital thermometers return data in Celsius by default.
+            DS18B20 digital thermometers return data in Celsius by default. Stored in the database
+            as integer thousandths of a degree; see MillidegreesField and, for converting existing
+            databases, temperature.operations.
         time_recorded: Datetime temperature was recorded. Stored in UTC for later conversion to
             timezone of user's choice
+        sequence: Optional sequence number assigned by the device. Unique per thermometer, so a
+            retried upload can't store the same reading twice.
+        valid_until: Time of the last reading merged into this one by the thermometer's deadband,
+            or null if none were. The temperature stayed within the deadband from time_recorded
+            until valid_until.
+        merged_sequence: Highest sequence number of the readings merged into this one by the
+            deadband, or null if none had one. Devices number readings in the order they take
+            them, so this reading stands for every sequence from its own up to merged_sequence.
+
+    Metaclass Fields:
+        ordering: Newest readings first. Reads of one thermometer are served in this order by
+            the (thermometer, time_recorded, id) index instead of a sort.
+        indexes: The (thermometer, time_recorded, id) index. The id breaks ties between readings
+            recorded at the same time, so cursor pagination can seek straight to the reading
+            after a page on every database. It also serves plain lookups by thermometer, so the
+            foreign key doesn't get an index of its own. The (time_recorded, id) index serves
+            staff lists of every thermometer's readings in the same way, at the cost of a
+            second index to update on every insert.
 
     Methods:
         convert_to_farenheit: Convert this temperature reading to F
     """
-    
+
+    class Meta:
+        ordering = ('-time_recorded',)
+        indexes = (
+            models.Index(fields=('thermometer', 'time_recorded', 'id'),
+                         name='temperature_reading_time'),
+            models.Index(fields=('time_recorded', 'id'), name='temperature_reading_recent'),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('thermometer', 'sequence'),
+                name='temperature_reading_unique_sequence'
+            ),
+        )
+
     thermometer = models.ForeignKey(
         Thermometer,
         on_delete=models.CASCADE,
         related_name='temperatures',
+        db_index=False,
     )
-    degrees_c = models.DecimalField(
-        decimal_places=6,
-        max_digits=10
-    )
+    degrees_c = MillidegreesField()
     time_recorded = models.DateTimeField(default=timezone.now)
+    sequence = models.PositiveIntegerField(blank=True, null=True)
+    valid_until = models.DateTimeField(blank=True, null=True)
+    merged_sequence = models.PositiveIntegerField(blank=True, null=True)
+
+
+class ReadingRollup(models.Model):
+    """Summary of a thermometer's readings over one minute, hour or day.
+
+    Rollups are kept up to date as readings are stored (see temperature.rollups), so reading a
+    long range costs one row per bucket however many raw readings it covers. The rebuildrollups
+    command recomputes them from the raw readings.
+
+    Fields:
+        thermometer: Thermometer the readings were taken by
+        period: Length of the bucket: minute, hour or day
+        bucket_start: Start of the bucket, in UTC
+        count: Number of readings in the bucket
+        degrees_sum: Sum of the readings, in degrees Celsius
+        degrees_min: Lowest reading
+        degrees_max: Highest reading
+
+    Metaclass Fields:
+        ordering: Newest buckets first
+        constraints: One rollup per thermometer, period and bucket. Its index also serves range
+            queries for a thermometer and period.
+
+    Methods:
+        degrees_mean: Mean of the readings in the bucket
+    """
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = (
+        (MINUTE, 'Minute'),
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+    PERIODS = {
+        MINUTE: datetime.timedelta(minutes=1),
+        HOUR: datetime.timedelta(hours=1),
+        DAY: datetime.timedelta(days=1),
+    }
+
+    class Meta:
+        ordering = ('-bucket_start',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('thermometer', 'period', 'bucket_start'),
+                name='reading_rollup_unique_bucket'
+            ),
+        )
+
+    thermometer = models.ForeignKey(
+        Thermometer,
+        on_delete=models.CASCADE,
+        related_name='rollups',
+        db_index=False,
+    )
+    period = models.CharField(max_length=6, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    degrees_sum = BigMillidegreesField()
+    degrees_min = MillidegreesField()
+    degrees_max = MillidegreesField()
+
+    @property
+    def degrees_mean(self):
+        return self.degrees_sum / self.count
+
+
+class ReadingBlock(models.Model):
+    """A thermometer-day of readings, compressed into one row for cold storage.
+
+    Readings older than settings.TEMPERATURE_COLD_STORAGE_DAYS are moved into blocks by the
+    compactreadings command, and decoded again by the read paths that need them. See
+    temperature.blocks for the format.
+
+    Fields:
+        thermometer: Thermometer the readings were taken by
+        day: UTC date the readings were taken on
+        count: Number of readings in the block
+        data: The compressed readings
+
+    Metaclass Fields:
+        ordering: Newest days first
+        constraints: One block per thermometer and day. Its index also serves range queries.
+    """
+
+    class Meta:
+        ordering = ('-day',)
+        constraints = (
+            models.UniqueConstraint(fields=('thermometer', 'day'), name='reading_block_unique_day'),
+        )
+
+    thermometer = models.ForeignKey(
+        Thermometer,
+        on_delete=models.CASCADE,
+        related_name='blocks',
+        db_index=False,
+    )
+    day = models.DateField()
+    count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+
+class ImportCheckpoint(models.Model):
+    """Progress of an importreadings run through an archive.
+
+    Saved in the same transaction as each chunk of readings imported, so the offset always
+    matches what has been written, and a resumed import never writes a chunk twice.
+
+    Fields:
+        name: Name of the import, by default the absolute path of the archive
+        offset: Byte offset in the archive up to which readings have been written
+        rows: Number of readings written so far
+    """
+    name = models.TextField(unique=True)
+    offset = models.BigIntegerField(default=0)
+    rows = models.BigIntegerField(default=0)
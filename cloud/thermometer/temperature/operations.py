@@ -0,0 +1,93 @@
+"""Migration operations for converting the existing reading table.
+
+Migrations aren't kept in the repository, so a database created before degrees_c became a
+MillidegreesField needs its generated migration edited by hand: replace the
+`migrations.AlterField(model_name='temperaturereading', name='degrees_c', ...)` operation with
+`ConvertToMillidegrees(...)`, keeping the same arguments. A plain AlterField would copy degree
+values into the integer column unscaled, or on PostgreSQL round away their fractions.
+PartitionReadingsByMonth is added to a migration the same way, as a new operation.
+"""
+from django.db import migrations
+from django.utils import timezone
+
+from . import partitions
+
+
+class ConvertToMillidegrees(migrations.AlterField):
+    """AlterField from a DecimalField of degrees to a MillidegreesField that rescales the data.
+
+    On PostgreSQL the column type and values are converted in one ALTER TABLE. Elsewhere the
+    column is altered first, which keeps the old values, and then multiplied up in one UPDATE.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        table, column = self.quoted_names(app_label, schema_editor, to_state)
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(
+                f'ALTER TABLE {table} ALTER COLUMN {column} TYPE integer '
+                f'USING ROUND({column} * 1000)::integer'
+            )
+        else:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+            schema_editor.execute(
+                f'UPDATE {table} SET {column} = CAST(ROUND({column} * 1000) AS INTEGER)'
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        table, column = self.quoted_names(app_label, schema_editor, to_state)
+        if schema_editor.connection.vendor == 'postgresql':
+            field = to_state.apps.get_model(app_label, self.model_name)._meta.get_field(self.name)
+            schema_editor.execute(
+                f'ALTER TABLE {table} ALTER COLUMN {column} TYPE '
+                f'{field.db_type(schema_editor.connection)} USING {column} / 1000.0'
+            )
+        else:
+            # AlterField.database_backwards calls self.database_forwards, which would rescale
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+            schema_editor.execute(f'UPDATE {table} SET {column} = {column} / 1000.0')
+
+    def quoted_names(self, app_label, schema_editor, state):
+        model = state.apps.get_model(app_label, self.model_name)
+        column = model._meta.get_field(self.name).column
+        return (schema_editor.quote_name(model._meta.db_table),
+                schema_editor.quote_name(column))
+
+    def describe(self):
+        return f'Convert {self.name} on {self.model_name} to integer thousandths of a degree'
+
+
+class PartitionReadingsByMonth(migrations.operations.base.Operation):
+    """Convert the reading table to one partitioned by month of time_recorded, on PostgreSQL.
+
+    Add it to a temperature migration after TemperatureReading is created. A partition is made
+    for every month from the oldest reading to `months_ahead` months after the current one, and
+    the readings are copied into them; see temperature.partitions. On other databases readings
+    stay in a single table and the operation does nothing.
+    """
+    reversible = False
+
+    def __init__(self, months_ahead=3):
+        self.months_ahead = months_ahead
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT MIN(time_recorded), pg_get_serial_sequence(%s, %s) '
+                f'FROM {partitions.quote(partitions.TABLE)}',
+                [partitions.TABLE, 'id']
+            )
+            oldest, sequence = cursor.fetchone()
+        now = timezone.now()
+        months = partitions.months_between(
+            oldest or now, partitions.add_months(partitions.month_start(now), self.months_ahead)
+        )
+        for statement in partitions.partition_table_sql(months, sequence):
+            schema_editor.execute(statement)
+
+    def describe(self):
+        return 'Partition temperature readings by month'
@@ -0,0 +1,174 @@
+"""Keyset pagination for temperature readings.
+
+Page number pagination counts every matching reading for each page and skips OFFSET rows to
+reach it, so pages get slower the further back they are. Readings are instead paged by their
+position in (time_recorded, id) order: each page starts just after the last reading of the page
+before, which an index on that order finds directly.
+
+How much a page costs depends on which index serves it:
+
+- Readings of one thermometer seek the (thermometer, time_recorded, id) index, so every page
+  costs the same as the first.
+- Readings of several thermometers, such as an owner's list without ?thermometer=, would have
+  to be sorted whole for every page, since no index holds just those thermometers in time
+  order. When the view names the thermometers with get_page_thermometers, each one's readings
+  are read from its own index instead, and merged. Only the time and id of each are read, a
+  chunk at a time, until the page is full; then the readings kept are loaded by id. A page
+  then costs one seek per thermometer, however far back it is, and loads no more readings than
+  it returns.
+- Everyone's readings, for staff, walk the (time_recorded, id) index.
+
+Cursors are opaque to clients. They hold the time and id of the reading a page continues from,
+and whether it continues towards older readings (next) or newer ones (previous).
+"""
+import base64
+import heapq
+import itertools
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.encoding import force_str
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .blocks import MICROSECOND, microseconds
+from .codecs import EPOCH
+
+Cursor = namedtuple('Cursor', ('time_recorded', 'pk', 'reverse'))
+
+# Keys read at a time from each thermometer while merging. Most of an owner's thermometers
+# contribute only a few readings to a page.
+MERGE_CHUNK_SIZE = 20
+
+
+class ReadingCursorPagination(BasePagination):
+    """Paginate readings newest first, keyed on (time_recorded, id).
+
+    Fields:
+        cursor_query_param: Query parameter holding the cursor
+        page_size_query_param: Query parameter clients can set the page size with, up to
+            settings.TEMPERATURE_MAX_PAGE_SIZE
+        invalid_cursor_message: Error for cursors that can't be decoded
+
+    Methods:
+        paginate_queryset: Return the page of readings after the request's cursor
+        fetch: Read a page and one more reading, merging per-thermometer pages if the view names
+            its thermometers
+        seek: Filter and order readings to start just after a cursor
+        get_paginated_response: Wrap a page with links to the next and previous pages
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        # One extra reading tells whether there is another page in the same direction
+        get_thermometers = getattr(view, 'get_page_thermometers', None)
+        thermometers = get_thermometers() if get_thermometers is not None else None
+        results = self.fetch(queryset, cursor, thermometers, self.page_size + 1)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if cursor is not None and cursor.reverse:
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, cursor is not None
+
+        self.next_cursor = self.previous_cursor = None
+        if results and has_next:
+            self.next_cursor = Cursor(results[-1].time_recorded, results[-1].pk, False)
+        if results and has_previous:
+            self.previous_cursor = Cursor(results[0].time_recorded, results[0].pk, True)
+        return results
+
+    def fetch(self, queryset, cursor, thermometers, count):
+        """
+        Return the first `count` readings in `queryset` after `cursor`, in the order the page is
+        read in. If `thermometers` lists the ids of the thermometers the readings belong to,
+        merge the keys of each one's readings as they are read, then load the readings kept.
+        """
+        if thermometers is None:
+            return list(self.seek(queryset, cursor)[:count])
+        keys = [
+            self.seek(queryset.filter(thermometer_id=pk), cursor)[:count]
+            .values_list('time_recorded', 'pk').iterator(chunk_size=MERGE_CHUNK_SIZE)
+            for pk in thermometers
+        ]
+        newest_first = cursor is None or not cursor.reverse
+        kept = list(itertools.islice(heapq.merge(*keys, reverse=newest_first), count))
+        if not kept:
+            return []
+        # The time range lets a partitioned table look in only the partitions holding the page
+        times = [time_recorded for time_recorded, pk in kept]
+        readings = queryset.filter(
+            pk__in=[pk for time_recorded, pk in kept],
+            time_recorded__gte=min(times), time_recorded__lte=max(times)
+        ).in_bulk()
+        return [readings[pk] for time_recorded, pk in kept]
+
+    def seek(self, queryset, cursor):
+        """
+        Return the readings in `queryset` after `cursor`, in the order the page is read in. The
+        bound on time_recorded alone lets the index seek to the cursor rather than scan to it.
+        """
+        if cursor is None:
+            return queryset.order_by('-time_recorded', '-pk')
+        if not cursor.reverse:
+            return queryset.filter(time_recorded__lte=cursor.time_recorded).filter(
+                Q(time_recorded__lt=cursor.time_recorded) | Q(pk__lt=cursor.pk)
+            ).order_by('-time_recorded', '-pk')
+        return queryset.filter(time_recorded__gte=cursor.time_recorded).filter(
+            Q(time_recorded__gt=cursor.time_recorded) | Q(pk__gt=cursor.pk)
+        ).order_by('time_recorded', 'pk')
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=settings.TEMPERATURE_MAX_PAGE_SIZE
+            )
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+
+    def decode_cursor(self, request):
+        """
+        Return the Cursor in the request, or None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            time_recorded, pk, reverse = force_str(
+                base64.urlsafe_b64decode(encoded.encode('ascii'))
+            ).split(':')
+            return Cursor(EPOCH + int(time_recorded) * MICROSECOND, int(pk), reverse == '1')
+        except (TypeError, ValueError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, cursor):
+        """
+        Return the url of the page a Cursor points to.
+        """
+        if cursor is None:
+            return None
+        encoded = base64.urlsafe_b64encode(
+            f'{microseconds(cursor.time_recorded)}:{cursor.pk}:{int(cursor.reverse)}'.encode()
+        ).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.encode_cursor(self.next_cursor),
+            'previous': self.encode_cursor(self.previous_cursor),
+            'results': data,
+        })
@@ -0,0 +1,208 @@
+"""Monthly partitioning of the temperature reading table on PostgreSQL.
+
+Once temperature.operations.PartitionReadingsByMonth has run, the reading table is a
+PostgreSQL table partitioned by range of time_recorded, with one partition per calendar month
+(UTC) and a default partition for readings outside them. The database does the routing itself:
+inserts go to the partition covering their time_recorded, and queries filtering on
+time_recorded only scan the partitions the range overlaps. Nothing in the ORM changes.
+
+Partitions are created ahead of time and old ones dropped by the partitionreadings command.
+Dropping a partition removes a whole month of readings without a DELETE.
+
+PostgreSQL requires unique constraints on a partitioned table to include the partition key, so
+the reading sequence constraint becomes unique on (thermometer, sequence, time_recorded). A
+retried upload is still ignored as long as it carries the readings' own timestamps, which the
+binary format always does.
+"""
+import datetime
+import re
+
+from django.db import connection
+
+from .models import TemperatureReading
+
+TABLE = TemperatureReading._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_y(?P<year>\d{{4}})m(?P<month>\d{{2}})$')
+
+
+def quote(name):
+    """
+    Quote a table, column or constraint name for PostgreSQL.
+    """
+    return '"%s"' % name
+
+
+def month_start(value):
+    """
+    Return the start of the UTC calendar month containing a datetime.
+    """
+    value = value.astimezone(datetime.timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start, months):
+    """
+    Return the start of the month `months` after (or before, if negative) a month start.
+    """
+    index = start.year * 12 + start.month - 1 + months
+    return start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start):
+    """
+    Return the table name of the partition for the month starting at `start`.
+    """
+    return f'{TABLE}_y{start.year}m{start.month:02d}'
+
+
+def partition_month(name):
+    """
+    Return the start of the month a partition table holds, or None if `name` isn't a monthly
+    partition of the reading table.
+    """
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    return datetime.datetime(int(match['year']), int(match['month']), 1,
+                             tzinfo=datetime.timezone.utc)
+
+
+def months_between(since, until):
+    """
+    Return the start of each month from the one containing `since` to the one containing
+    `until`, inclusive. These are the partitions a query for that range reads.
+    """
+    months = []
+    start = month_start(since)
+    while start <= until:
+        months.append(start)
+        start = add_months(start, 1)
+    return months
+
+
+def create_partition_sql(start):
+    """
+    Return the statements creating the partition for the month starting at `start`.
+
+    Readings already in the default partition for that month are moved into the new one. The
+    default partition is detached while that happens, because PostgreSQL refuses to create a
+    partition while the default partition holds rows belonging in it.
+    """
+    table, default = quote(TABLE), quote(DEFAULT_PARTITION)
+    partition = quote(partition_name(start))
+    since, until = start.isoformat(), add_months(start, 1).isoformat()
+    in_month = f"time_recorded >= '{since}' AND time_recorded < '{until}'"
+    return [
+        f'ALTER TABLE {table} DETACH PARTITION {default}',
+        f"CREATE TABLE {partition} PARTITION OF {table} FOR VALUES FROM ('{since}') TO ('{until}')",
+        f'INSERT INTO {table} SELECT * FROM {default} WHERE {in_month}',
+        f'DELETE FROM {default} WHERE {in_month}',
+        f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT',
+    ]
+
+
+def drop_partition_sql(start):
+    """
+    Return the statements dropping the partition for the month starting at `start`, and with it
+    every reading from that month.
+    """
+    partition = quote(partition_name(start))
+    return [
+        f'ALTER TABLE {quote(TABLE)} DETACH PARTITION {partition}',
+        f'DROP TABLE {partition}',
+    ]
+
+
+def partition_table_sql(months, sequence):
+    """
+    Return the statements converting the plain reading table into one partitioned by month, with
+    a partition for each month start in `months` and a default partition. Existing readings are
+    copied across. `sequence` is the id column's sequence, which is moved to the new table.
+
+    Keys, constraints and indexes are added after the copy, on the parent table, so PostgreSQL
+    builds them once per partition and every partition created later gets them too.
+    """
+    meta = TemperatureReading._meta
+    thermometer = meta.get_field('thermometer')
+    columns = {name: quote(meta.get_field(name).column)
+               for name in ('id', 'thermometer', 'sequence', 'time_recorded')}
+    table, old = quote(TABLE), quote(f'{TABLE}_unpartitioned')
+    statements = [
+        f'ALTER TABLE {table} RENAME TO {old}',
+        f'ALTER SEQUENCE {sequence} OWNED BY NONE',
+        f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) '
+        f'PARTITION BY RANGE ({columns["time_recorded"]})',
+        f'CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {table} DEFAULT',
+    ]
+    for start in months:
+        statements.append(
+            f'CREATE TABLE {quote(partition_name(start))} PARTITION OF {table} '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+        )
+    statements += [
+        f'INSERT INTO {table} SELECT * FROM {old}',
+        f'DROP TABLE {old}',
+        f'ALTER SEQUENCE {sequence} OWNED BY {table}.{columns["id"]}',
+        f'ALTER TABLE {table} ADD PRIMARY KEY ({columns["id"]}, {columns["time_recorded"]})',
+        f'ALTER TABLE {table} ADD CONSTRAINT {quote(meta.constraints[0].name)} UNIQUE '
+        f'({columns["thermometer"]}, {columns["sequence"]}, {columns["time_recorded"]})',
+    ]
+    statements += [
+        f'CREATE INDEX {quote(index.name)} ON {table} '
+        f'({", ".join(quote(meta.get_field(name).column) for name in index.fields)})'
+        for index in meta.indexes
+    ]
+    statements.append(
+        f'ALTER TABLE {table} ADD CONSTRAINT {quote(f"{TABLE}_thermometer_fk")} '
+        f'FOREIGN KEY ({columns["thermometer"]}) '
+        f'REFERENCES {quote(thermometer.related_model._meta.db_table)} '
+        f'({quote(thermometer.target_field.column)}) DEFERRABLE INITIALLY DEFERRED'
+    )
+    return statements
+
+
+def plan_partitions(existing, now, ahead, keep=None):
+    """
+    Return (months to create, months to drop) for keeping partitions from the current month to
+    `ahead` months after it. If `keep` is given, partitions older than the `keep` months before
+    the current one are dropped.
+    """
+    current = month_start(now)
+    existing = set(existing)
+    create = [start for start in months_between(current, add_months(current, ahead))
+              if start not in existing]
+    drop = []
+    if keep is not None:
+        cutoff = add_months(current, -keep)
+        drop = sorted(start for start in existing if start < cutoff)
+    return create, drop
+
+
+def is_partitioned(using=connection):
+    """
+    Return whether the reading table is partitioned on this database connection.
+    """
+    if using.vendor != 'postgresql':
+        return False
+    with using.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s', [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def existing_partitions(using=connection):
+    """
+    Return the month starts of the reading table's monthly partitions, oldest first.
+    """
+    with using.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits i '
+            'JOIN pg_class parent ON parent.oid = i.inhparent '
+            'JOIN pg_class child ON child.oid = i.inhrelid '
+            'WHERE parent.relname = %s', [TABLE]
+        )
+        months = (partition_month(name) for name, in cursor.fetchall())
+        return sorted(month for month in months if month is not None)
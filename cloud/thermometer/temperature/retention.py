@@ -0,0 +1,210 @@
+"""Tiered retention of readings and rollups.
+
+Raw readings, minute rollups and hourly rollups are each kept for as long as
+settings.TEMPERATURE_RETENTION says; daily rollups are kept forever. Readings are rolled up as
+they are stored, so expiring raw readings leaves their history readable from the rollups.
+The expirereadings command applies the policy.
+
+Expired rows are deleted a thermometer and a chunk at a time, each chunk a single DELETE in its
+own short transaction, walking the (thermometer, time) indexes. The deletes go straight to the
+database instead of through Django's deletion collector, which would load every row first;
+nothing references readings or rollups, so there is nothing for it to cascade to.
+"""
+import calendar
+import datetime
+import functools
+import time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Subquery, Sum
+
+from . import partitions
+from .models import ReadingBlock, ReadingRollup, TemperatureReading, Thermometer
+
+RAW = 'raw'
+
+
+def months_ago(now, months):
+    """
+    Return the same time of day `months` calendar months before `now`, on the last day of the
+    month if it is shorter.
+    """
+    index = now.year * 12 + now.month - 1 - months
+    year, month = index // 12, index % 12 + 1
+    return now.replace(year=year, month=month,
+                       day=min(now.day, calendar.monthrange(year, month)[1]))
+
+
+def cutoffs(now):
+    """
+    Return {tier: time} for 'raw' and each rollup period. Rows in a tier older than its time
+    have expired. A time of None means the tier is kept forever.
+    """
+    retention = settings.TEMPERATURE_RETENTION
+    days, months = retention['RAW_DAYS'], retention['HOUR_MONTHS']
+    minute_days = retention['MINUTE_DAYS']
+    return {
+        RAW: None if days is None else now - datetime.timedelta(days=days),
+        ReadingRollup.MINUTE: (None if minute_days is None
+                               else now - datetime.timedelta(days=minute_days)),
+        ReadingRollup.HOUR: None if months is None else months_ago(now, months),
+        ReadingRollup.DAY: None,
+    }
+
+
+def is_retained(tier, since, now):
+    """
+    Return whether rows of a tier from `since` onwards haven't expired.
+    """
+    cutoff = cutoffs(now)[tier]
+    return cutoff is None or since >= cutoff
+
+
+def delete_in_chunks(queryset, chunk_size, pause=0, on_delete=None):
+    """Delete the rows of a queryset, at most `chunk_size` at a time.
+
+    Each chunk is one DELETE ... WHERE id IN (SELECT id ... LIMIT n) statement in its own
+    transaction, so locks are held, and the SQLite write-ahead log grows, for one chunk at a
+    time. Sleeps `pause` seconds between chunks to leave room for other writers. If given,
+    `on_delete` is called with the number of rows each chunk deleted, in its transaction.
+
+    Returns:
+        number of rows deleted
+    """
+    using = router.db_for_write(queryset.model)
+    deleted = 0
+    while True:
+        chunk = queryset.model.objects.filter(
+            pk__in=Subquery(queryset.order_by().values('pk')[:chunk_size])
+        )
+        with transaction.atomic(using=using):
+            count = chunk._raw_delete(using)
+            if on_delete is not None:
+                on_delete(count)
+        deleted += count
+        if count < chunk_size:
+            return deleted
+        time.sleep(pause)
+
+
+def subtract_readings(thermometer_id, count):
+    """
+    Take `count` deleted readings off a thermometer's reading count, which counts the readings
+    kept.
+    """
+    if count:
+        Thermometer.objects.filter(pk=thermometer_id).update(
+            reading_count=F('reading_count') - count
+        )
+
+
+def expired(tier, thermometer_id, cutoff):
+    """
+    Return the queryset of a thermometer's rows in a tier older than `cutoff`.
+    """
+    if tier == RAW:
+        return TemperatureReading.objects.filter(thermometer_id=thermometer_id,
+                                                 time_recorded__lt=cutoff)
+    return ReadingRollup.objects.filter(thermometer_id=thermometer_id, period=tier,
+                                        bucket_start__lt=cutoff)
+
+
+def expire_blocks(thermometer_id, day):
+    """
+    Delete a thermometer's blocks of compacted readings from before `day`, and take their
+    readings off its reading count. There is one block per day, so they are deleted at once,
+    under the thermometer row lock compaction holds while it writes blocks.
+
+    Returns:
+        number of blocks deleted
+    """
+    blocks = ReadingBlock.objects.filter(thermometer_id=thermometer_id, day__lt=day)
+    using = router.db_for_write(ReadingBlock)
+    with transaction.atomic(using=using):
+        list(Thermometer.objects.select_for_update().filter(pk=thermometer_id).values_list('pk'))
+        readings = blocks.aggregate(count=Sum('count'))['count'] or 0
+        deleted = blocks._raw_delete(using)
+        subtract_readings(thermometer_id, readings)
+    return deleted
+
+
+def drop_expired_partitions(cutoff):
+    """
+    If readings are partitioned, drop every monthly partition wholly older than `cutoff`, and
+    take the readings in it off their thermometers' reading counts. Each partition is counted
+    once it is detached, when nothing more can be written to it. Returns the names of the
+    partitions dropped.
+    """
+    using = connections[router.db_for_write(TemperatureReading)]
+    if not partitions.is_partitioned(using):
+        return []
+    column = partitions.quote(TemperatureReading._meta.get_field('thermometer').column)
+    dropped = []
+    for start in partitions.existing_partitions(using):
+        if partitions.add_months(start, 1) <= cutoff:
+            name = partitions.partition_name(start)
+            detach, *drop = partitions.drop_partition_sql(start)
+            with transaction.atomic(using=using.alias), using.cursor() as cursor:
+                cursor.execute(detach)
+                cursor.execute(f'SELECT {column}, COUNT(*) FROM {partitions.quote(name)} '
+                               f'GROUP BY {column}')
+                for thermometer_id, count in cursor.fetchall():
+                    subtract_readings(thermometer_id, count)
+                for statement in drop:
+                    cursor.execute(statement)
+            dropped.append(name)
+    return dropped
+
+
+def checkpoint():
+    """
+    Fold the SQLite write-ahead log back into the database, so it doesn't keep the space
+    deleted rows used. Does nothing on other databases, inside a transaction, or when the log
+    is not in use.
+    """
+    using = connections[router.db_for_write(TemperatureReading)]
+    if using.vendor == 'sqlite' and not using.in_atomic_block:
+        with using.cursor() as cursor:
+            cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def expire(now, chunk_size, pause=0, tiers=None):
+    """Delete every reading and rollup the retention policy has expired.
+
+    If readings are partitioned, whole months of expired readings are dropped as partitions
+    first, and only the rest are deleted. Blocks of compacted readings expire with the raw
+    readings. Expired readings, raw and compacted, are taken off their thermometers' reading
+    counts as they are deleted.
+
+    Args:
+        now: Time to measure retention from
+        chunk_size: Most rows deleted per statement
+        pause: Seconds to sleep between chunks
+        tiers: Tiers to expire. Defaults to all of them.
+
+    Returns:
+        ({tier: rows deleted}, names of partitions dropped). A block counts as one row.
+    """
+    thermometer_ids = list(Thermometer.objects.values_list('pk', flat=True))
+    deleted, dropped = {}, []
+    for tier, cutoff in cutoffs(now).items():
+        if cutoff is None or (tiers is not None and tier not in tiers):
+            continue
+        if tier == RAW:
+            dropped = drop_expired_partitions(cutoff)
+        deleted[tier] = sum(
+            delete_in_chunks(
+                expired(tier, thermometer_id, cutoff), chunk_size, pause,
+                on_delete=(functools.partial(subtract_readings, thermometer_id)
+                           if tier == RAW else None)
+            )
+            for thermometer_id in thermometer_ids
+        )
+        if tier == RAW:
+            # A compacted day expires once all of it is older than the cutoff
+            day = cutoff.astimezone(datetime.timezone.utc).date()
+            deleted[tier] += sum(expire_blocks(thermometer_id, day)
+                                 for thermometer_id in thermometer_ids)
+        checkpoint()
+    return deleted, dropped
@@ -0,0 +1,221 @@
+"""Minute, hour and day rollups of temperature readings.
+
+store_readings adds every batch it stores to the thermometer's rollups in the same transaction,
+so they stay in step with the raw readings. Readings written some other way, such as one at a
+time through the admin, aren't rolled up until the rebuildrollups command is run over them.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Count, DateTimeField, Max, Min, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .blocks import decode_block, readings_between
+from .models import ReadingRollup, TemperatureReading
+from .retention import RAW, cutoffs, is_retained
+
+# Rollup periods, finest first
+PERIODS = tuple(ReadingRollup.PERIODS)
+
+# Reading temperature field, for converting to and from integer thousandths of a degree
+MILLIDEGREES = TemperatureReading._meta.get_field('degrees_c')
+
+
+def bucket_start(time, period):
+    """
+    Return the start of the UTC minute, hour or day containing `time`.
+    """
+    time = time.astimezone(datetime.timezone.utc).replace(second=0, microsecond=0)
+    if period in (ReadingRollup.HOUR, ReadingRollup.DAY):
+        time = time.replace(minute=0)
+    if period == ReadingRollup.DAY:
+        time = time.replace(hour=0)
+    return time
+
+
+def from_millidegrees(value):
+    """
+    Convert integer thousandths of a degree to Decimal degrees.
+    """
+    return MILLIDEGREES.from_db_value(value, None, None)
+
+
+def summarize(readings, period):
+    """
+    Return {bucket start: [count, sum, min, max]} for a list of readings, with temperatures in
+    integer thousandths of a degree, rounded exactly as they are stored.
+    """
+    buckets = {}
+    for reading in readings:
+        millidegrees = MILLIDEGREES.get_prep_value(reading.degrees_c)
+        start = bucket_start(reading.time_recorded, period)
+        bucket = buckets.get(start)
+        if bucket is None:
+            buckets[start] = [1, millidegrees, millidegrees, millidegrees]
+        else:
+            bucket[0] += 1
+            bucket[1] += millidegrees
+            bucket[2] = min(bucket[2], millidegrees)
+            bucket[3] = max(bucket[3], millidegrees)
+    return buckets
+
+
+def update_rollups(thermometer, readings):
+    """Add newly stored readings to their thermometer's rollups.
+
+    Must run in the transaction that stored the readings, holding the lock store_readings takes
+    on the thermometer row. The lock keeps concurrent batches for the thermometer from both
+    creating the same new bucket, which select_for_update can't prevent for rows that don't
+    exist yet. For each period the rollups in the batch's time range are read in one query,
+    then updated and created with one bulk query each, so the cost depends on the number of
+    buckets rather than readings.
+
+    Args:
+        thermometer: Thermometer the readings belong to
+        readings: non-empty list of TemperatureReading objects just stored
+    """
+    for period in PERIODS:
+        buckets = summarize(readings, period)
+        existing = (
+            ReadingRollup.objects
+            .filter(thermometer=thermometer, period=period,
+                    bucket_start__gte=min(buckets), bucket_start__lte=max(buckets))
+        )
+        updated = []
+        for rollup in existing:
+            if rollup.bucket_start not in buckets:
+                continue
+            count, total, low, high = buckets.pop(rollup.bucket_start)
+            rollup.count += count
+            rollup.degrees_sum += from_millidegrees(total)
+            rollup.degrees_min = min(rollup.degrees_min, from_millidegrees(low))
+            rollup.degrees_max = max(rollup.degrees_max, from_millidegrees(high))
+            updated.append(rollup)
+        ReadingRollup.objects.bulk_update(
+            updated, ('count', 'degrees_sum', 'degrees_min', 'degrees_max')
+        )
+        ReadingRollup.objects.bulk_create(
+            ReadingRollup(
+                thermometer=thermometer,
+                period=period,
+                bucket_start=start,
+                count=count,
+                degrees_sum=from_millidegrees(total),
+                degrees_min=from_millidegrees(low),
+                degrees_max=from_millidegrees(high),
+            )
+            for start, (count, total, low, high) in buckets.items()
+        )
+
+
+def rebuild_rollups(thermometer, since, until):
+    """Recompute a thermometer's rollups from its raw readings.
+
+    The range is widened to whole UTC days so every period is rebuilt over the same readings.
+    Days the retention policy has expired any raw readings or blocks of are left out, since
+    their rollups are all that is left of them. Existing rollups in the range are deleted, then
+    each period is recomputed with one GROUP BY query over the reading table, plus the readings
+    of any compacted blocks. Run it in a transaction.
+
+    Args:
+        thermometer: Thermometer to rebuild rollups for
+        since: Start of the range to rebuild
+        until: End of the range to rebuild
+
+    Returns:
+        number of rollups created
+    """
+    day = ReadingRollup.PERIODS[ReadingRollup.DAY]
+    since = bucket_start(since, ReadingRollup.DAY)
+    end = bucket_start(until, ReadingRollup.DAY)
+    until = end if end == until else end + day
+    cutoff = cutoffs(timezone.now())[RAW]
+    if cutoff is not None and since < cutoff:
+        # Start from the first day that is still whole
+        since = bucket_start(cutoff, ReadingRollup.DAY)
+        if since < cutoff:
+            since += day
+    if since >= until:
+        return 0
+    thermometer.rollups.filter(bucket_start__gte=since, bucket_start__lt=until).delete()
+
+    readings = thermometer.temperatures.filter(time_recorded__gte=since, time_recorded__lt=until)
+    compacted = [
+        TemperatureReading(thermometer=thermometer, **reading)
+        for data in thermometer.blocks.filter(day__gte=since.date(), day__lt=until.date())
+        .values_list('data', flat=True)
+        for reading in decode_block(data)
+    ]
+    rollups = []
+    for period in PERIODS:
+        buckets = summarize(compacted, period)
+        grouped = (
+            readings
+            .order_by()
+            .annotate(bucket=Trunc('time_recorded', period, output_field=DateTimeField(),
+                                   tzinfo=datetime.timezone.utc))
+            .values('bucket')
+            .annotate(count=Count('id'), degrees_sum=Sum('degrees_c'),
+                      degrees_min=Min('degrees_c'), degrees_max=Max('degrees_c'))
+        )
+        for row in grouped.iterator():
+            count, total, low, high = (
+                row['count'], MILLIDEGREES.get_prep_value(row['degrees_sum']),
+                MILLIDEGREES.get_prep_value(row['degrees_min']),
+                MILLIDEGREES.get_prep_value(row['degrees_max']),
+            )
+            if row['bucket'] in buckets:
+                other = buckets[row['bucket']]
+                count, total = count + other[0], total + other[1]
+                low, high = min(low, other[2]), max(high, other[3])
+            buckets[row['bucket']] = [count, total, low, high]
+        rollups += [
+            ReadingRollup(
+                thermometer=thermometer,
+                period=period,
+                bucket_start=start,
+                count=count,
+                degrees_sum=from_millidegrees(total),
+                degrees_min=from_millidegrees(low),
+                degrees_max=from_millidegrees(high),
+            )
+            for start, (count, total, low, high) in buckets.items()
+        ]
+    return len(ReadingRollup.objects.bulk_create(rollups))
+
+
+def history(thermometer, since, until):
+    """Return a thermometer's readings from `since` up to `until`, summarized for charting.
+
+    Ranges up to TEMPERATURE_ROLLUP_RAW_RANGE long are read from the raw readings, one point per
+    reading, including readings compacted into blocks. Longer ranges are read from the finest
+    rollups that give no more than TEMPERATURE_HISTORY_MAX_POINTS points, falling back to daily
+    rollups, so the cost of a query doesn't depend on how many raw readings the range covers.
+    Tiers the retention policy has already expired for the start of the range are skipped.
+
+    Returns:
+        (resolution, points): resolution is 'raw' or the rollup period. Each point is a dict of
+            time, count, degrees_min, degrees_max and degrees_mean, oldest first.
+    """
+    span = until - since
+    now = timezone.now()
+    if span <= settings.TEMPERATURE_ROLLUP_RAW_RANGE and is_retained(RAW, since, now):
+        return 'raw', [
+            {'time': reading['time_recorded'], 'count': 1, 'degrees_min': reading['degrees_c'],
+             'degrees_max': reading['degrees_c'], 'degrees_mean': reading['degrees_c']}
+            for reading in readings_between(thermometer, since, until)
+        ]
+
+    for period in PERIODS:
+        if (span / ReadingRollup.PERIODS[period] <= settings.TEMPERATURE_HISTORY_MAX_POINTS and
+                is_retained(period, since, now)):
+            break
+    rollups = thermometer.rollups.filter(
+        period=period, bucket_start__gte=bucket_start(since, period), bucket_start__lt=until
+    ).order_by('bucket_start')
+    return period, [
+        {'time': rollup.bucket_start, 'count': rollup.count, 'degrees_min': rollup.degrees_min,
+         'degrees_max': rollup.degrees_max, 'degrees_mean': rollup.degrees_mean}
+        for rollup in rollups
+    ]
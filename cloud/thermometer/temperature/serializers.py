@@ -1,9 +1,15 @@
+import datetime
+
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 
 from rest_framework import serializers
 
-from .exceptions import ThermometerCreationError
-from .models import Thermometer, TemperatureReading
+from .exceptions import ReadingUploadError, ThermometerCreationError
+from .ingest import check_time_recorded, store_readings
+from .models import MAX_SEQUENCE, Thermometer, TemperatureReading
+from .stats import BUCKETS
 
 
 class TemperatureReadingSerializer(serializers.HyperlinkedModelSerializer):
@@ -11,6 +17,8 @@ class TemperatureReadingSerializer(serializers.HyperlinkedModelSerializer):
 
     Fields:
         thermometer: Thermometer associated with this temperature reading
+        degrees_c: Degrees Celsius of the reading, in the same format as before readings were
+            stored as integers
     
     Metaclass Fields:
         model: Model to be serialized
@@ -19,11 +27,12 @@ class TemperatureReadingSerializer(serializers.HyperlinkedModelSerializer):
 
     """
     thermometer = serializers.ReadOnlyField(source='thermometer.display_name')
+    degrees_c = serializers.DecimalField(max_digits=10, decimal_places=6)
 
     class Meta:
         model = TemperatureReading
-        fields = ('url', 'id', 'thermometer', 'degrees_c', 'time_recorded')
-        read_only_fields = ('id', 'thermometer', 'time_recorded')
+        fields = ('url', 'id', 'thermometer', 'degrees_c', 'time_recorded', 'valid_until')
+        read_only_fields = ('id', 'thermometer', 'time_recorded', 'valid_until')
 
     def update(self, instance, validated_data):
         """
@@ -34,12 +43,30 @@ class TemperatureReadingSerializer(serializers.HyperlinkedModelSerializer):
         raise TypeError(msg)
 
 
+def expansions(request):
+    """
+    Return the set of nested fields a request asks to have expanded, e.g. {'temperatures'} for
+    `?expand=temperatures`.
+    """
+    if request is None:
+        return set()
+    params = getattr(request, 'query_params', request.GET)
+    return {name for name in params.get('expand', '').split(',') if name}
+
+
 class ThermometerSerializer(serializers.HyperlinkedModelSerializer):
     """Serializer to convert Thermometers to JSON.
 
+    Thermometers are summarized by their latest reading, reading count and a link to their
+    paginated readings. Every reading is only nested in the response when the request asks for
+    it with `?expand=temperatures`.
+
     Fields:
-        temperatures: Temperature readings associated with this thermometer
+        temperatures: Temperature readings associated with this thermometer. Always accepted on
+            update, only shown when expanded.
         owner: User who owns this thermometer
+        latest_degrees_c: Temperature of the newest reading, kept on the thermometer itself
+        readings: Link to the thermometer's paginated readings
         allowed_on_post: Fields that can be set via the API in new object creation
     
     Metaclass Fields:
@@ -52,19 +79,35 @@ class ThermometerSerializer(serializers.HyperlinkedModelSerializer):
             any associated temperature readings, so if temperature readings are included throw an
             error.
         update: Update an existing thermometer record.
+        get_fields: Hide temperatures unless the request expands them
     """
     temperatures = TemperatureReadingSerializer(
         many=True, read_only=False, required=False, allow_null=True)
     owner = serializers.HyperlinkedRelatedField(
         many=False, view_name='user-detail', read_only=True)
-    allowed_on_post = set(('therm_id', 'display_name'))
+    latest_degrees_c = serializers.DecimalField(max_digits=10, decimal_places=3, read_only=True)
+    readings = serializers.HyperlinkedIdentityField(view_name='thermometer-readings')
+    allowed_on_post = set(('therm_id', 'display_name', 'deadband_c', 'deadband_seconds'))
 
     class Meta:
         model = Thermometer
         fields = ('url', 'owner', 'temperatures', 'therm_id',
-                  'display_name', 'created_date', 'registered', 'registration_date')
-        read_only_fields = ('owner', 'created_date', 'registration_date', 'registered')
+                  'display_name', 'created_date', 'registered', 'registration_date',
+                  'deadband_c', 'deadband_seconds', 'latest_degrees_c', 'latest_time_recorded',
+                  'reading_count', 'readings')
+        read_only_fields = ('owner', 'created_date', 'registration_date', 'registered',
+                            'latest_time_recorded', 'reading_count')
     
+    def get_fields(self):
+        """
+        Make temperatures write-only unless the request expands them, so summaries don't
+        serialize every reading.
+        """
+        fields = super().get_fields()
+        if 'temperatures' not in expansions(self.context.get('request')):
+            fields['temperatures'].write_only = True
+        return fields
+
     def create(self, validated_data):
         """
         Create new thermometer record. When thermometers are created, they should not have
@@ -91,6 +134,7 @@ class ThermometerSerializer(serializers.HyperlinkedModelSerializer):
             temps = validated_data['temperatures']
         
         # Update instance fields
+        changed = []
         for key, value in validated_data.items():
             if (
                 key in dir(instance) and
@@ -98,17 +142,17 @@ class ThermometerSerializer(serializers.HyperlinkedModelSerializer):
                 key != 'temperatures'
             ):
                 setattr(instance, key, value)
+                changed.append(key)
 
-        for temp in temps:
-            new_reading = TemperatureReading.objects.create(
-                degrees_c=temp['degrees_c'],
-                thermometer=instance
-            )
-            with transaction.atomic():
-                new_reading.save()
-                     
+        # Save only the changed fields, so the counts and latest reading loaded with the
+        # instance don't overwrite those updated by batches stored since
         with transaction.atomic():
-            instance.save()
+            if changed:
+                instance.save(update_fields=changed)
+            store_readings(instance, ({'degrees_c': temp['degrees_c']} for temp in temps))
+        instance.refresh_from_db(
+            fields=('latest_degrees_c', 'latest_time_recorded', 'reading_count')
+        )
         return instance
 
     def validate_temperatures(self, value):
@@ -117,3 +161,190 @@ class ThermometerSerializer(serializers.HyperlinkedModelSerializer):
                 'New Thermometers cannot be created with temperature readings'
             )
         return value
+
+
+class ReadingSerializer(serializers.Serializer):
+    """Lightweight serializer used to validate uploaded temperature readings.
+
+    Does not build hyperlinks or touch the database, so validating a batch of thousands of
+    readings stays cheap.
+
+    Fields:
+        degrees_c: Degrees Celsius of the reading
+        sequence: Optional sequence number the device gave the reading
+        time_recorded: Optional time the device took the reading. Readings uploaded without one
+            are stamped with the time they are stored.
+    """
+    degrees_c = serializers.DecimalField(max_digits=10, decimal_places=6)
+    sequence = serializers.IntegerField(min_value=0, max_value=MAX_SEQUENCE, required=False)
+    time_recorded = serializers.DateTimeField(required=False)
+
+    def validate_time_recorded(self, value):
+        try:
+            check_time_recorded(value, timezone.now())
+        except ReadingUploadError as error:
+            raise serializers.ValidationError(str(error))
+        return value
+
+
+class TemperatureReadingBatchSerializer(serializers.Serializer):
+    """Serializer to validate a batch of readings uploaded for a single thermometer.
+
+    Fields:
+        readings: List of readings to be recorded. Must contain at least one reading and no more
+            than settings.TEMPERATURE_MAX_BATCH_SIZE readings.
+    """
+    readings = ReadingSerializer(many=True, allow_empty=False)
+
+    def to_internal_value(self, data):
+        """
+        Reject oversized batches before validating each reading in them.
+        """
+        readings = data.get('readings') if hasattr(data, 'get') else None
+        if isinstance(readings, list) and len(readings) > settings.TEMPERATURE_MAX_BATCH_SIZE:
+            raise serializers.ValidationError({
+                'readings': [
+                    f'Batches may contain at most {settings.TEMPERATURE_MAX_BATCH_SIZE} readings'
+                ]
+            })
+        return super().to_internal_value(data)
+
+
+class ReadingPointSerializer(serializers.Serializer):
+    """Serializer for one reading of a downsampled chart.
+
+    Fields:
+        time_recorded: Time of the reading
+        degrees_c: Degrees Celsius of the reading, formatted as in TemperatureReadingSerializer
+    """
+    time_recorded = serializers.DateTimeField()
+    degrees_c = serializers.DecimalField(max_digits=10, decimal_places=6)
+
+
+class HistoryQuerySerializer(serializers.Serializer):
+    """Serializer to validate the time range of a reading history request.
+
+    Fields:
+        since: Start of the range. Defaults to a day before `until`.
+        until: End of the range, exclusive. Defaults to now.
+    """
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        data.setdefault('until', timezone.now())
+        data.setdefault('since', data['until'] - datetime.timedelta(days=1))
+        if data['since'] >= data['until']:
+            raise serializers.ValidationError('since must be before until')
+        return data
+
+
+class ReadingFilterSerializer(serializers.Serializer):
+    """Serializer to validate the filters of a reading list request.
+
+    Fields:
+        thermometer: Only list readings from the thermometer with this id
+        since: Only list readings recorded at or after this time
+        until: Only list readings recorded before this time
+        max_points: Downsample the thermometer's readings to this many for a chart. Needs a
+            thermometer, and defaults the range to the day before `until` like a history
+            request. Limited to TEMPERATURE_HISTORY_MAX_POINTS points and ranges of
+            TEMPERATURE_EXPORT_MAX_RANGE, since the whole range is read into memory.
+    """
+    thermometer = serializers.IntegerField(required=False, min_value=1)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    max_points = serializers.IntegerField(required=False, min_value=3)
+
+    def validate_max_points(self, value):
+        if value > settings.TEMPERATURE_HISTORY_MAX_POINTS:
+            raise serializers.ValidationError(
+                f'Ensure this value is less than or equal to '
+                f'{settings.TEMPERATURE_HISTORY_MAX_POINTS}.'
+            )
+        return value
+
+    def validate(self, data):
+        if 'max_points' in data:
+            if 'thermometer' not in data:
+                raise serializers.ValidationError('max_points needs a thermometer')
+            data.setdefault('until', timezone.now())
+            data.setdefault('since', data['until'] - datetime.timedelta(days=1))
+            if data['until'] - data['since'] > settings.TEMPERATURE_EXPORT_MAX_RANGE:
+                raise serializers.ValidationError(
+                    f'Ranges longer than {settings.TEMPERATURE_EXPORT_MAX_RANGE.days} days cannot '
+                    'be downsampled in one request'
+                )
+        if 'since' in data and 'until' in data and data['since'] >= data['until']:
+            raise serializers.ValidationError('since must be before until')
+        return data
+
+    def filter(self, queryset):
+        """
+        Return `queryset` narrowed by the validated filters. Thermometer and time filters are both
+        on the (thermometer, time_recorded, id) index, so together they read only the range asked
+        for.
+        """
+        filters = {
+            'thermometer_id': self.validated_data.get('thermometer'),
+            'time_recorded__gte': self.validated_data.get('since'),
+            'time_recorded__lt': self.validated_data.get('until'),
+        }
+        return queryset.filter(**{
+            lookup: value for lookup, value in filters.items() if value is not None
+        })
+
+
+class ExportQuerySerializer(HistoryQuerySerializer):
+    """Serializer to validate the time range of a columnar export request.
+
+    Ranges are limited to TEMPERATURE_EXPORT_MAX_RANGE, since the whole range is read into
+    memory. Longer histories are exported to files by the exportreadings command.
+    """
+
+    def validate(self, data):
+        data = super().validate(data)
+        if data['until'] - data['since'] > settings.TEMPERATURE_EXPORT_MAX_RANGE:
+            raise serializers.ValidationError(
+                f'Ranges longer than {settings.TEMPERATURE_EXPORT_MAX_RANGE.days} days cannot be '
+                'exported in one request'
+            )
+        return data
+
+
+class StatsQuerySerializer(HistoryQuerySerializer):
+    """Serializer to validate a bucketed statistics request.
+
+    Fields:
+        bucket: Bucket length, one of temperature.stats.BUCKETS. Defaults to an hour.
+
+    Ranges are limited to TEMPERATURE_HISTORY_MAX_POINTS buckets.
+    """
+    bucket = serializers.ChoiceField(choices=tuple(BUCKETS), default='1h')
+
+    def validate(self, data):
+        data = super().validate(data)
+        buckets = (data['until'] - data['since']) / BUCKETS[data['bucket']]
+        if buckets > settings.TEMPERATURE_HISTORY_MAX_POINTS:
+            raise serializers.ValidationError(
+                f'Ranges longer than {settings.TEMPERATURE_HISTORY_MAX_POINTS} buckets of '
+                f'{data["bucket"]} cannot be summarized in one request'
+            )
+        return data
+
+
+class HistoryPointSerializer(serializers.Serializer):
+    """Serializer for one point of a thermometer's reading history.
+
+    Fields:
+        time: Time of the reading, or start of the rollup bucket
+        count: Number of readings the point summarizes
+        degrees_min: Lowest reading
+        degrees_max: Highest reading
+        degrees_mean: Mean of the readings
+    """
+    time = serializers.DateTimeField()
+    count = serializers.IntegerField()
+    degrees_min = serializers.DecimalField(max_digits=10, decimal_places=3)
+    degrees_max = serializers.DecimalField(max_digits=10, decimal_places=3)
+    degrees_mean = serializers.DecimalField(max_digits=10, decimal_places=3)
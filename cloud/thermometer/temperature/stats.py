@@ -0,0 +1,184 @@
+"""Time-bucketed statistics of a thermometer's readings.
+
+Buckets are lengths of wall-clock time in the thermometer owner's time zone, so daily buckets
+run from local midnight to midnight and six hour buckets start at 00:00, 06:00, 12:00 and 18:00
+local time, through daylight saving changes. Every bucket length divides a day.
+
+Statistics are served from the coarsest retained rollups whose UTC buckets each fall inside one
+local bucket: minute rollups in practically every time zone, hourly rollups in zones a whole
+number of hours from UTC, and daily rollups only where local midnight is UTC midnight. Failing
+that, the database groups the readings themselves by their time truncated in the owner's time
+zone, and compacted readings are added from their blocks.
+
+Where the readings have expired as well, say hourly buckets in India once minute rollups and
+raw readings are gone, the finest retained rollups are used anyway. Each rollup is counted
+whole in the local bucket its start falls in, so bucket edges are off by up to one rollup
+length (half an hour in India) and the source says which rollups were used.
+"""
+import datetime
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Count, DateTimeField, Max, Min, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .blocks import decode_block
+from .codecs import EPOCH
+from .models import ReadingRollup
+from .retention import RAW, is_retained
+from .rollups import MILLIDEGREES, PERIODS, from_millidegrees
+
+BUCKETS = {
+    '1m': datetime.timedelta(minutes=1),
+    '5m': datetime.timedelta(minutes=5),
+    '15m': datetime.timedelta(minutes=15),
+    '30m': datetime.timedelta(minutes=30),
+    '1h': datetime.timedelta(hours=1),
+    '3h': datetime.timedelta(hours=3),
+    '6h': datetime.timedelta(hours=6),
+    '12h': datetime.timedelta(hours=12),
+    '1d': datetime.timedelta(days=1),
+}
+
+
+def owner_time_zone(thermometer):
+    """
+    Return the time zone of the thermometer's owner, or UTC if it has none.
+    """
+    try:
+        return thermometer.owner.profile.time_zone
+    except (AttributeError, ObjectDoesNotExist):
+        return timezone.utc
+
+
+def local_bucket_start(time, bucket, tz):
+    """
+    Return the start of the local bucket containing `time`. In the hour repeated when clocks go
+    back, both occurrences of the hour share a bucket.
+    """
+    local = timezone.localtime(time, tz).replace(tzinfo=None)
+    midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timezone.make_aware(midnight + (local - midnight) // bucket * bucket, tz, is_dst=False)
+
+
+def bucket_starts(since, until, bucket, tz):
+    """
+    Return the starts of the local buckets overlapping `since` up to `until`, followed by the
+    end of the last one.
+    """
+    starts = [local_bucket_start(since, bucket, tz)]
+    while starts[-1] < until:
+        local = timezone.localtime(starts[-1], tz).replace(tzinfo=None)
+        starts.append(timezone.make_aware(local + bucket, tz, is_dst=False))
+    return starts
+
+
+def rollup_period(starts, bucket, now):
+    """
+    Return the coarsest retained rollup period that fits evenly into every bucket in `starts`,
+    or None if there isn't one.
+    """
+    for period in reversed(PERIODS):
+        length = ReadingRollup.PERIODS[period]
+        if (bucket % length == datetime.timedelta(0) and is_retained(period, starts[0], now) and
+                all((start - EPOCH) % length == datetime.timedelta(0) for start in starts)):
+            return period
+    return None
+
+
+def finest_retained_period(starts, now):
+    """
+    Return the finest rollup period retained for every bucket in `starts`. Daily rollups are
+    kept forever, so there always is one.
+    """
+    for period in PERIODS:
+        if is_retained(period, starts[0], now):
+            return period
+
+
+def add(buckets, start, count, total, low, high):
+    """
+    Add `count` readings summing to `total`, with temperatures in integer thousandths of a
+    degree, to the bucket at `start`.
+    """
+    bucket = buckets.get(start)
+    if bucket is None:
+        buckets[start] = [count, total, low, high]
+    else:
+        bucket[0] += count
+        bucket[1] += total
+        bucket[2] = min(bucket[2], low)
+        bucket[3] = max(bucket[3], high)
+
+
+def stats(thermometer, since, until, bucket, tz):
+    """Return per-bucket statistics of a thermometer's readings from `since` up to `until`.
+
+    Buckets partly inside the range are returned whole. Buckets without readings are left out.
+    If neither aligned rollups nor raw readings are retained for the range, buckets are
+    approximated from the finest retained rollups.
+
+    Args:
+        thermometer: Thermometer to summarize
+        since: Start of the range
+        until: End of the range
+        bucket: Bucket length, one of BUCKETS
+        tz: Time zone bucket boundaries are local to
+
+    Returns:
+        (source, points): source is the rollup period the points were computed from, or 'raw'.
+            Each point is a dict of time, count, degrees_min, degrees_max and degrees_mean,
+            oldest first.
+    """
+    now = timezone.now()
+    starts = bucket_starts(since, until, bucket, tz)
+    period = rollup_period(starts, bucket, now)
+    if period is None and not is_retained(RAW, starts[0], now):
+        period = finest_retained_period(starts, now)
+    buckets = {}
+
+    if period is not None:
+        rollups = thermometer.rollups.filter(
+            period=period, bucket_start__gte=starts[0], bucket_start__lt=starts[-1]
+        ).values_list('bucket_start', 'count', 'degrees_sum', 'degrees_min', 'degrees_max')
+        for start, count, total, low, high in rollups.iterator():
+            add(buckets, local_bucket_start(start, bucket, tz), count,
+                *(MILLIDEGREES.get_prep_value(value) for value in (total, low, high)))
+    else:
+        if bucket % ReadingRollup.PERIODS[ReadingRollup.DAY] == datetime.timedelta(0):
+            unit = ReadingRollup.DAY
+        elif bucket % ReadingRollup.PERIODS[ReadingRollup.HOUR] == datetime.timedelta(0):
+            unit = ReadingRollup.HOUR
+        else:
+            unit = ReadingRollup.MINUTE
+        grouped = (
+            thermometer.temperatures
+            .filter(time_recorded__gte=starts[0], time_recorded__lt=starts[-1])
+            .order_by()
+            .annotate(unit=Trunc('time_recorded', unit, output_field=DateTimeField(),
+                                 tzinfo=tz, is_dst=False))
+            .values('unit')
+            .annotate(count=Count('id'), degrees_sum=Sum('degrees_c'),
+                      degrees_min=Min('degrees_c'), degrees_max=Max('degrees_c'))
+        )
+        for row in grouped.iterator():
+            add(buckets, local_bucket_start(row['unit'], bucket, tz), row['count'],
+                *(MILLIDEGREES.get_prep_value(row[name])
+                  for name in ('degrees_sum', 'degrees_min', 'degrees_max')))
+
+        days = thermometer.blocks.filter(
+            day__gte=starts[0].astimezone(datetime.timezone.utc).date(),
+            day__lte=starts[-1].astimezone(datetime.timezone.utc).date()
+        ).values_list('data', flat=True)
+        for data in days:
+            for reading in decode_block(data):
+                if starts[0] <= reading['time_recorded'] < starts[-1]:
+                    millidegrees = MILLIDEGREES.get_prep_value(reading['degrees_c'])
+                    add(buckets, local_bucket_start(reading['time_recorded'], bucket, tz), 1,
+                        millidegrees, millidegrees, millidegrees)
+
+    return period or RAW, [
+        {'time': start, 'count': count, 'degrees_min': from_millidegrees(low),
+         'degrees_max': from_millidegrees(high), 'degrees_mean': from_millidegrees(total) / count}
+        for start, (count, total, low, high) in sorted(buckets.items())
+    ]
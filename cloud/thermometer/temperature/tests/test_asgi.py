@@ -0,0 +1,118 @@
+import json
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+
+from temperature.asgi import DeviceIngestApplication
+from temperature.models import Thermometer
+
+
+class DeviceIngestApplicationTests(TransactionTestCase):
+    """Tests for the ASGI device ingest application
+
+    Methods:
+        setUp: Create a thermometer with a device key and an application to test
+        test_upload: Device uploads should be stored without going through Django
+        test_status: Devices should be able to read back their highest stored sequence
+        test_rejected_requests: Bad credentials, payloads and methods should be refused
+        test_other_paths: Requests for other paths should go to the wrapped application
+    """
+
+    def setUp(self):
+        """
+        Create test data
+        """
+        self.user = get_user_model().objects.create_user(username='owner', password='pass')
+        self.therm = Thermometer.objects.create()
+        self.therm.register(self.user)
+        self.key = self.therm.set_device_key()
+        self.path = f'/ingest/{self.therm.therm_id}/'
+        self.passed_on = []
+        self.application = DeviceIngestApplication(self.fallback)
+
+    async def fallback(self, scope, receive, send):
+        self.passed_on.append(scope['path'])
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'django'})
+
+    def request(self, method, path, body=b'', key=None, content_type='application/json'):
+        """
+        Send one request through the application, returning (status, headers, body)
+        """
+        async def run():
+            headers = [(b'content-type', content_type.encode())]
+            if key is not None:
+                headers.append((b'authorization', f'Device {key}'.encode()))
+            scope = {
+                'type': 'http', 'method': method, 'path': path, 'headers': headers,
+                'query_string': b'',
+            }
+            communicator = ApplicationCommunicator(self.application, scope)
+            await communicator.send_input({
+                'type': 'http.request', 'body': body[:5], 'more_body': True
+            })
+            await communicator.send_input({'type': 'http.request', 'body': body[5:]})
+            start = await communicator.receive_output(timeout=5)
+            message = await communicator.receive_output(timeout=5)
+            return start['status'], dict(start['headers']), message['body']
+        return async_to_sync(run)()
+
+    def test_upload(self):
+        """
+        Valid uploads should return 204 and be stored
+        """
+        body = json.dumps([{'degrees_c': 21.5, 'sequence': 1}, 22]).encode()
+        status, headers, content = self.request('POST', self.path, body, key=self.key)
+        self.assertEquals(status, 204)
+        self.assertEquals(content, b'')
+        self.assertEquals(self.therm.temperatures.count(), 2)
+        self.assertEquals(self.passed_on, [])
+
+    def test_status(self):
+        """
+        GET should return the highest stored sequence number
+        """
+        body = json.dumps([{'degrees_c': 21.5, 'sequence': 12}]).encode()
+        self.request('POST', self.path, body, key=self.key)
+        status, headers, content = self.request('GET', self.path, key=self.key)
+        self.assertEquals(status, 200)
+        self.assertEquals(headers[b'content-type'], b'application/json')
+        self.assertEquals(json.loads(content), {'sequence': 12})
+
+    def test_rejected_requests(self):
+        """
+        Requests that can't be authenticated or parsed should be refused
+        """
+        status, _, _ = self.request('POST', self.path, b'[21]', key='wrong')
+        self.assertEquals(status, 401)
+        status, _, _ = self.request('POST', self.path, b'[21]')
+        self.assertEquals(status, 401)
+        status, _, _ = self.request('POST', self.path, b'warmish', key=self.key)
+        self.assertEquals(status, 400)
+        status, headers, _ = self.request('DELETE', self.path, key=self.key)
+        self.assertEquals(status, 405)
+        self.assertEquals(headers[b'allow'], b'GET, POST')
+
+        with self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10):
+            application = DeviceIngestApplication(self.fallback)
+        self.application = application
+        status, _, _ = self.request('POST', self.path, b'[21, 22, 23, 24]', key=self.key)
+        self.assertEquals(status, 413)
+
+        self.assertEquals(self.therm.temperatures.count(), 0)
+
+    def test_other_paths(self):
+        """
+        Anything other than a device upload should be passed to the wrapped application
+        """
+        paths = ['/thermometers/', '/ingest/', '/ingest/not-a-uuid/', f'{self.path}extra/']
+        for path in paths:
+            status, _, content = self.request('GET', path)
+            self.assertEquals(status, 200)
+            self.assertEquals(content, b'django')
+        self.assertEquals(self.passed_on, paths)
+
+        status, _, _ = self.request('GET', '/ingest/abc/')
+        self.assertEquals(status, 404)
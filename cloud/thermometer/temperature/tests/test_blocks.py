@@ -0,0 +1,179 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+import math
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from temperature import blocks, retention
+from temperature.ingest import store_readings
+from temperature.models import ReadingBlock, ReadingRollup, Thermometer
+from temperature.rollups import history, rebuild_rollups
+
+START = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def tank(count, start=START, step=60):
+    """
+    Return `count` readings `step` seconds apart of a tank warming and cooling slowly, rounded to
+    the DS18B20's 1/16 degree steps
+    """
+    return [
+        {'time_recorded': start + datetime.timedelta(seconds=step * i),
+         'degrees_c': Decimal(round((25 + 1.5 * math.sin(i / 200)) * 16)) / 16,
+         'valid_until': None}
+        for i in range(count)
+    ]
+
+
+class BlockCodecTests(SimpleTestCase):
+    """Tests for the cold storage block format
+
+    Methods:
+        test_round_trip: Decoded blocks should match the readings encoded, to storage precision
+        test_compression: A day of readings should pack at least ten times smaller than its
+            values alone
+        test_corrupt_blocks: Corrupt blocks should raise ValueError
+    """
+
+    def test_round_trip(self):
+        """
+        Irregular times, negative temperatures and valid_until should survive a round trip
+        """
+        readings = [
+            {'time_recorded': START + datetime.timedelta(seconds=30), 'degrees_c': Decimal('-3.5'),
+             'valid_until': START + datetime.timedelta(minutes=5)},
+            {'time_recorded': START, 'degrees_c': Decimal('21.5625'), 'valid_until': None},
+            {'time_recorded': START + datetime.timedelta(hours=3, microseconds=7),
+             'degrees_c': Decimal('100'), 'valid_until': None},
+        ]
+        decoded = blocks.decode_block(blocks.encode_block(readings))
+        self.assertEquals([r['time_recorded'] for r in decoded],
+                          sorted(r['time_recorded'] for r in readings))
+        self.assertEquals([r['degrees_c'] for r in decoded],
+                          [Decimal('21.563'), Decimal('-3.5'), Decimal('100')])
+        self.assertEquals(decoded[1]['valid_until'], readings[0]['valid_until'])
+        self.assertIsNone(decoded[0]['valid_until'])
+
+    def test_compression(self):
+        """
+        A day of readings a minute should pack at least ten times smaller than even the 16 bytes
+        of id, time and value each reading takes as a row
+        """
+        readings = tank(1440)
+        data = blocks.encode_block(readings)
+        self.assertLess(len(data) * 10, len(readings) * 16)
+        self.assertEquals(len(blocks.decode_block(data)), 1440)
+
+    def test_corrupt_blocks(self):
+        """
+        Truncated, foreign or damaged blocks should raise ValueError
+        """
+        data = blocks.encode_block(tank(10))
+        for corrupt in (data[:5], b'XX' + data[2:], data[:-4], data + b'\0'):
+            with self.assertRaises(ValueError):
+                blocks.decode_block(corrupt)
+        with self.assertRaises(ValueError):
+            blocks.encode_block([])
+
+
+@override_settings(TEMPERATURE_ROLLUP_RAW_RANGE=datetime.timedelta(days=3))
+class CompactionTests(TestCase):
+    """Tests for compacting readings into blocks
+
+    Methods:
+        setUp: Store three days of readings, 20 days ago
+        test_compact: Whole days before the cutoff should move into blocks
+        test_reads_after_compaction: History and rollup rebuilds should read compacted readings
+        test_late_readings: Readings stored for a compacted day should join its block
+        test_deleted_thermometer: Compacting a deleted thermometer's day should fail without
+            writing a block
+        test_expire_blocks: Blocks should expire with raw readings
+        test_command: The command should compact readings and report block sizes
+    """
+
+    def setUp(self):
+        self.therm = Thermometer.objects.create(display_name='tank')
+        self.start = (timezone.now() - datetime.timedelta(days=20)).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        self.readings = tank(3 * 288, start=self.start, step=300)
+        store_readings(self.therm, self.readings)
+
+    def test_compact(self):
+        """
+        Whole days before the cutoff should move into blocks, and later readings stay put
+        """
+        before = self.start + datetime.timedelta(days=2, hours=12)
+        self.assertEquals(blocks.compact(self.therm, before), (2 * 288, 2))
+        self.assertEquals(self.therm.temperatures.count(), 288)
+        self.assertEquals(list(self.therm.blocks.values_list('count', flat=True)), [288, 288])
+        self.assertEquals(blocks.compact(self.therm, before), (0, 0))
+
+    def test_reads_after_compaction(self):
+        """
+        Compacted readings should still be read by history and by rollup rebuilds
+        """
+        since = self.start + datetime.timedelta(hours=20)
+        until = self.start + datetime.timedelta(days=2)
+        expected = history(self.therm, since, until)
+        rollups = sorted(ReadingRollup.objects.values_list(
+            'period', 'bucket_start', 'count', 'degrees_sum', 'degrees_min', 'degrees_max'))
+
+        blocks.compact(self.therm, self.start + datetime.timedelta(days=3))
+        self.assertFalse(self.therm.temperatures.exists())
+        self.assertEquals(history(self.therm, since, until), expected)
+
+        rebuild_rollups(self.therm, self.start, self.start + datetime.timedelta(days=3))
+        self.assertEquals(sorted(ReadingRollup.objects.values_list(
+            'period', 'bucket_start', 'count', 'degrees_sum', 'degrees_min', 'degrees_max')),
+            rollups)
+
+    def test_late_readings(self):
+        """
+        Readings stored for a day after it was compacted should be merged into its block
+        """
+        before = self.start + datetime.timedelta(days=1)
+        blocks.compact(self.therm, before)
+        late = {'degrees_c': Decimal('30'), 'valid_until': None,
+                'time_recorded': self.start + datetime.timedelta(seconds=1)}
+        store_readings(self.therm, [late])
+        self.assertEquals(blocks.compact(self.therm, before), (1, 1))
+        block = self.therm.blocks.get()
+        self.assertEquals(block.count, 289)
+        self.assertIn(late, blocks.decode_block(block.data))
+
+    def test_deleted_thermometer(self):
+        """
+        Compaction locks the thermometer's row first, so a thermometer deleted since it was
+        loaded raises DoesNotExist rather than getting a block
+        """
+        Thermometer.objects.filter(pk=self.therm.pk).delete()
+        with self.assertRaises(Thermometer.DoesNotExist):
+            with transaction.atomic():
+                blocks.compact_day(self.therm, self.start.date())
+        self.assertFalse(ReadingBlock.objects.exists())
+
+    def test_expire_blocks(self):
+        """
+        Blocks should expire with raw readings, once their whole day is past the cutoff
+        """
+        blocks.compact(self.therm, self.start + datetime.timedelta(days=3))
+        policy = {'RAW_DAYS': 19, 'MINUTE_DAYS': None, 'HOUR_MONTHS': None, 'CHUNK_SIZE': 10,
+                  'CHUNK_PAUSE_MS': 0}
+        with self.settings(TEMPERATURE_RETENTION=policy):
+            deleted, _ = retention.expire(timezone.now(), chunk_size=10)
+        self.assertEquals(deleted['raw'], 1)
+        self.assertEquals(self.therm.blocks.count(), 2)
+
+    def test_command(self):
+        """
+        The command should compact readings older than --days and report the block sizes
+        """
+        out = StringIO()
+        call_command('compactreadings', days=10, stdout=out)
+        self.assertIn('Compacted 864 readings', out.getvalue())
+        self.assertEquals(ReadingBlock.objects.count(), 3)
+        self.assertFalse(self.therm.temperatures.exists())
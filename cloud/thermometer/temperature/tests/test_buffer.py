@@ -0,0 +1,175 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from temperature import buffer as buffer_module
+from temperature.buffer import IngestBuffer
+from temperature.exceptions import IngestBufferFull
+from temperature.ingest import store_readings
+from temperature.models import Thermometer
+
+
+class IngestBufferTests(TestCase):
+    """Tests for the write-behind ingestion buffer
+
+    Methods:
+        setUp: Create test data and a buffer with no background thread
+        test_flush_writes_everything: Flushing should write all waiting readings for all
+            thermometers
+        test_flush_due: Buffers should be due for a flush after enough rows or enough time
+        test_backpressure: Submitting past max_rows should raise IngestBufferFull
+        test_failed_flush_requeues: Readings should be kept if writing them fails
+        test_deleted_thermometer: Readings for a deleted thermometer should be dropped without
+            holding up other thermometers' readings
+        test_close_drains: Closing should write everything waiting and refuse new readings
+    """
+
+    def setUp(self):
+        """
+        Create two thermometers and a buffer that is only flushed by hand
+        """
+        self.therms = [Thermometer.objects.create(), Thermometer.objects.create()]
+        self.buffer = IngestBuffer(
+            flush_interval=0.05, flush_rows=10, max_rows=25,
+            writer=store_readings, autostart=False
+        )
+
+    def readings(self, count):
+        return [{'degrees_c': 20 + i} for i in range(count)]
+
+    def test_flush_writes_everything(self):
+        """
+        One flush should write every waiting batch
+        """
+        self.buffer.submit(self.therms[0], self.readings(3))
+        self.buffer.submit(self.therms[1], self.readings(2))
+        self.buffer.submit(self.therms[0], self.readings(4))
+        self.assertEquals(len(self.buffer), 9)
+        self.assertEquals(self.therms[0].temperatures.count(), 0)
+
+        self.assertEquals(self.buffer.flush(), 9)
+        self.assertEquals(len(self.buffer), 0)
+        self.assertEquals(self.therms[0].temperatures.count(), 7)
+        self.assertEquals(self.therms[1].temperatures.count(), 2)
+        self.assertEquals(self.buffer.flush(), 0)
+
+    def test_flush_due(self):
+        """
+        Buffers should flush at flush_rows readings or after flush_interval, whichever is first
+        """
+        self.assertFalse(self.buffer._due())
+        self.buffer.submit(self.therms[0], self.readings(2))
+        self.assertFalse(self.buffer._due())
+        time.sleep(0.06)
+        self.assertTrue(self.buffer._due())
+        self.buffer.flush()
+
+        self.buffer.submit(self.therms[0], self.readings(10))
+        self.assertTrue(self.buffer._due())
+
+    def test_backpressure(self):
+        """
+        Buffers should refuse batches that would take them past max_rows
+        """
+        self.buffer.submit(self.therms[0], self.readings(20))
+        with self.assertRaises(IngestBufferFull):
+            self.buffer.submit(self.therms[1], self.readings(6))
+        self.buffer.submit(self.therms[1], self.readings(5))
+        self.assertEquals(len(self.buffer), 25)
+
+    def test_failed_flush_requeues(self):
+        """
+        A failed flush should leave the readings waiting for the next one
+        """
+        def failing_writer(thermometer, readings):
+            raise RuntimeError('database is down')
+
+        self.buffer.writer = failing_writer
+        self.buffer.submit(self.therms[0], self.readings(3))
+        with self.assertLogs('temperature.buffer', 'ERROR'):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush()
+        self.assertEquals(len(self.buffer), 3)
+
+        self.buffer.writer = store_readings
+        self.buffer.flush()
+        self.assertEquals(self.therms[0].temperatures.count(), 3)
+
+    def test_deleted_thermometer(self):
+        """
+        Readings for a thermometer deleted before they were flushed should be dropped, and
+        every other thermometer's readings written
+        """
+        self.buffer.submit(self.therms[0], self.readings(3))
+        Thermometer.objects.filter(pk=self.therms[0].pk).delete()
+        self.buffer.submit(self.therms[1], self.readings(2))
+        with self.assertLogs('temperature.buffer', 'ERROR'):
+            self.assertEquals(self.buffer.flush(), 2)
+        self.assertEquals(len(self.buffer), 0)
+        self.assertEquals(self.therms[1].temperatures.count(), 2)
+
+        self.buffer.submit(self.therms[1], self.readings(1))
+        self.assertEquals(self.buffer.flush(), 1)
+
+    def test_close_drains(self):
+        """
+        Closing should write everything still waiting
+        """
+        self.buffer.submit(self.therms[0], self.readings(3))
+        self.buffer.close()
+        self.assertEquals(self.therms[0].temperatures.count(), 3)
+        with self.assertRaises(IngestBufferFull):
+            self.buffer.submit(self.therms[0], self.readings(1))
+
+
+class BufferedIngestTests(TestCase):
+    """Tests for upload endpoints with buffering enabled
+
+    Methods:
+        setUp: Enable buffering with a buffer that is only flushed by hand
+        tearDown: Restore the process-wide buffer
+        test_device_upload_buffered: Device uploads should be queued, and refused with 503 once
+            the buffer is full
+    """
+
+    def setUp(self):
+        """
+        Swap in a buffer without a background thread
+        """
+        self.user = get_user_model().objects.create_user(username='owner', password='pass')
+        self.therm = Thermometer.objects.create()
+        self.therm.register(self.user)
+        self.key = self.therm.set_device_key()
+        self.buffer = IngestBuffer(
+            flush_interval=1, flush_rows=100, max_rows=4,
+            writer=store_readings, autostart=False
+        )
+        self.saved_buffer = buffer_module._buffer
+        buffer_module._buffer = self.buffer
+
+    def tearDown(self):
+        buffer_module._buffer = self.saved_buffer
+
+    def test_device_upload_buffered(self):
+        """
+        Uploads should be accepted into the buffer until it is full
+        """
+        url = reverse('device-ingest', args=[self.therm.therm_id])
+        options = {
+            'ENABLED': True, 'FLUSH_INTERVAL_MS': 1000, 'FLUSH_ROWS': 100, 'MAX_ROWS': 4
+        }
+        with self.settings(TEMPERATURE_INGEST_BUFFER=options):
+            response = self.client.post(url, data='[21, 22, 23]', content_type='application/json',
+                                        HTTP_AUTHORIZATION=f'Device {self.key}')
+            self.assertEquals(response.status_code, 204)
+            self.assertEquals(self.therm.temperatures.count(), 0)
+
+            response = self.client.post(url, data='[21, 22]', content_type='application/json',
+                                        HTTP_AUTHORIZATION=f'Device {self.key}')
+            self.assertEquals(response.status_code, 503)
+            self.assertEquals(response['Retry-After'], '1')
+
+        self.buffer.flush()
+        self.assertEquals(self.therm.temperatures.count(), 3)
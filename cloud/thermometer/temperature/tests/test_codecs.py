@@ -0,0 +1,80 @@
+import datetime
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from temperature import codecs
+from temperature.exceptions import ReadingUploadError
+
+
+class DS18B20CodecTests(SimpleTestCase):
+    """Tests for the binary DS18B20 upload format
+
+    Methods:
+        test_round_trip: Encoded batches should decode to the same times and exact temperatures
+        test_record_size: Each reading should take four bytes
+        test_sequenced_batch: Version 2 batches should number readings from the header sequence
+        test_invalid_batches: Truncated, corrupt or out of range batches should be rejected
+    """
+
+    def setUp(self):
+        self.start = datetime.datetime(2020, 3, 1, 12, 0, 0, tzinfo=timezone.utc)
+        self.readings = [
+            (self.start + datetime.timedelta(seconds=10 * i), raw)
+            for i, raw in enumerate([400, 401, -880, 2000, 0, -1])
+        ]
+
+    def test_round_trip(self):
+        """
+        Decoding should recover timestamps and temperatures exactly
+        """
+        decoded = codecs.decode_readings(codecs.encode_readings(self.readings))
+        self.assertEquals(len(decoded), len(self.readings))
+        for reading, (time_recorded, raw) in zip(decoded, self.readings):
+            self.assertEquals(reading['time_recorded'], time_recorded)
+            self.assertEquals(reading['degrees_c'], Decimal(raw) / 16)
+        self.assertEquals(decoded[0]['degrees_c'], Decimal('25'))
+        self.assertEquals(decoded[1]['degrees_c'], Decimal('25.0625'))
+        self.assertEquals(decoded[2]['degrees_c'], Decimal('-55'))
+
+    def test_record_size(self):
+        """
+        Batches should be a 12 byte header plus 4 bytes per reading
+        """
+        data = codecs.encode_readings(self.readings)
+        self.assertEquals(len(data), 12 + 4 * len(self.readings))
+
+    def test_sequenced_batch(self):
+        """
+        Sequence numbers should count up from the header
+        """
+        data = codecs.encode_readings(self.readings, first_sequence=100)
+        self.assertEquals(len(data), 16 + 4 * len(self.readings))
+        decoded = codecs.decode_readings(data)
+        self.assertEquals([r['sequence'] for r in decoded], list(range(100, 106)))
+        self.assertNotIn('sequence', codecs.decode_readings(codecs.encode_readings(self.readings))[0])
+
+        with self.assertRaises(ReadingUploadError):
+            codecs.decode_readings(codecs.encode_readings(self.readings, first_sequence=2 ** 31 - 2))
+
+    def test_invalid_batches(self):
+        """
+        Anything that isn't a well formed batch should raise ReadingUploadError
+        """
+        data = codecs.encode_readings(self.readings)
+        out_of_range = codecs.encode_readings([(self.start, 2001)])
+        batches = [
+            b'',
+            data[:8],
+            data[:-1],
+            data + b'\x00\x00\x00\x00',
+            b'JSON' + data[4:],
+            data[:4] + b'\x03' + data[5:],
+            data[:4] + b'\x02' + data[5:12],
+            codecs.HEADER.pack(codecs.MAGIC, codecs.VERSION, 0, 0),
+            out_of_range,
+        ]
+        for batch in batches:
+            with self.assertRaises(ReadingUploadError):
+                codecs.decode_readings(batch)
@@ -0,0 +1,217 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from temperature.management.commands.importreadings import Command
+from temperature.management.commands.loadtest import LatencyRecorder, percentile
+from temperature.models import ImportCheckpoint, Thermometer
+
+
+class LoadTestReportTests(SimpleTestCase):
+    """Tests for the load test command's reporting
+
+    Methods:
+        test_percentile: Percentiles should use the nearest rank
+        test_summary: Summaries should report per-endpoint counts, rates and latencies
+    """
+
+    def test_percentile(self):
+        """
+        Nearest-rank percentiles of a sorted list
+        """
+        values = list(range(1, 101))
+        self.assertEquals(percentile(values, 50), 50)
+        self.assertEquals(percentile(values, 95), 95)
+        self.assertEquals(percentile(values, 99), 99)
+        self.assertEquals(percentile(values, 100), 100)
+        self.assertEquals(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summary(self):
+        """
+        Summary rows should be grouped by endpoint with latencies in milliseconds
+        """
+        recorder = LatencyRecorder()
+        for i in range(1, 11):
+            recorder.record('upload', i / 1000, ok=i != 10, readings=5)
+        recorder.record('list', 0.5, ok=True)
+
+        rows = {row['endpoint']: row for row in recorder.summary(elapsed=2)}
+        self.assertEquals(rows['upload']['requests'], 10)
+        self.assertEquals(rows['upload']['errors'], 1)
+        self.assertEquals(rows['upload']['requests_per_second'], 5)
+        self.assertEquals(rows['upload']['readings_per_second'], 25)
+        self.assertAlmostEqual(rows['upload']['p50'], 5)
+        self.assertAlmostEqual(rows['upload']['p99'], 10)
+        self.assertAlmostEqual(rows['list']['p95'], 500)
+
+
+class BenchmarkReadingsCommandTests(TestCase):
+    """Tests for the benchmarkreadings command
+
+    Methods:
+        test_benchmark: Every read query should be timed and the generated data rolled back
+    """
+
+    def test_benchmark(self):
+        """
+        Every read query should be timed, and the generated data rolled back
+        """
+        out = StringIO()
+        call_command('benchmarkreadings', thermometers=2, readings=50, repeat=2, stdout=out)
+        lines = {line.split('  ')[0]: line for line in out.getvalue().splitlines()}
+        self.assertTrue(lines['recent readings'].endswith('yes'))
+        self.assertTrue(lines['last hour'].endswith('yes'))
+        self.assertIn('thermometer detail', lines)
+        self.assertFalse(Thermometer.objects.exists())
+        self.assertFalse(get_user_model().objects.exists())
+
+
+class BenchmarkDatabaseCommandTests(TestCase):
+    """Tests for the benchmarkdatabase command
+
+    Methods:
+        test_benchmark: Both profiles should be run against their own scratch databases
+    """
+
+    def test_benchmark(self):
+        """
+        Writes and reads should be timed for both profiles, in databases removed afterwards
+        """
+        out = StringIO()
+        call_command('benchmarkdatabase', writers=1, readers=1, batch_size=5, thermometers=2,
+                     duration=0.2, stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines() if line]
+        self.assertEquals(sorted(row[:2] for row in rows if row[0] in ('tuned', 'untuned')),
+                          [['tuned', 'read'], ['tuned', 'write'],
+                           ['untuned', 'read'], ['untuned', 'write']])
+        self.assertFalse(Thermometer.objects.exists())
+
+
+class ImportReadingsCommandTests(TestCase):
+    """Tests for the importreadings command
+
+    Methods:
+        setUp: Create thermometers and a scratch directory
+        tearDown: Remove the scratch directory
+        test_import_csv: CSV archives should be imported in chunks
+        test_import_ndjson: NDJSON archives should be imported
+        test_resume_from_checkpoint: A failed import should resume after the last written chunk
+        test_checkpoint_with_chunk: A chunk whose checkpoint isn't saved shouldn't be written
+    """
+
+    def setUp(self):
+        self.therms = [Thermometer.objects.create(), Thermometer.objects.create()]
+        self.directory = tempfile.TemporaryDirectory()
+        self.start = datetime.datetime(2018, 1, 1, tzinfo=timezone.utc)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as archive:
+            archive.write('\n'.join(lines) + '\n')
+        return path
+
+    def csv_lines(self, count):
+        lines = ['therm_id,time_recorded,degrees_c,sequence']
+        for i in range(count):
+            therm = self.therms[i % 2]
+            time_recorded = (self.start + datetime.timedelta(minutes=i)).isoformat()
+            lines.append(f'{therm.therm_id},{time_recorded},{20 + i / 100},{i}')
+        return lines
+
+    def test_import_csv(self):
+        """
+        Every row should be imported with its original time
+        """
+        path = self.write('archive.csv', self.csv_lines(25))
+        out = StringIO()
+        call_command('importreadings', path, chunk_size=10, stdout=out)
+        self.assertIn('Finished importing 25 readings', out.getvalue())
+        self.assertEquals(out.getvalue().count('Imported'), 3)
+        self.assertEquals(self.therms[0].temperatures.count(), 13)
+        self.assertEquals(self.therms[1].temperatures.count(), 12)
+        first = self.therms[0].temperatures.order_by('time_recorded').first()
+        self.assertEquals(first.time_recorded, self.start)
+        self.assertEquals(first.degrees_c, Decimal(20))
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_import_ndjson(self):
+        """
+        NDJSON lines should accept ISO or unix times and optional sequence numbers
+        """
+        therm_id = str(self.therms[0].therm_id)
+        path = self.write('archive.ndjson', [
+            json.dumps({'therm_id': therm_id, 'time_recorded': '2018-01-01T00:00:00Z',
+                        'degrees_c': 21.5}),
+            '',
+            json.dumps({'therm_id': therm_id, 'time_recorded': self.start.timestamp() + 60,
+                        'degrees_c': 21.625, 'sequence': 4}),
+        ])
+        call_command('importreadings', path, stdout=StringIO())
+        temps = list(self.therms[0].temperatures.order_by('time_recorded'))
+        self.assertEquals([t.degrees_c for t in temps], [Decimal('21.5'), Decimal('21.625')])
+        self.assertEquals(temps[1].time_recorded, self.start + datetime.timedelta(minutes=1))
+        self.assertEquals(temps[1].sequence, 4)
+
+    def test_resume_from_checkpoint(self):
+        """
+        Imports should stop on a bad row and resume after the last chunk written
+        """
+        lines = self.csv_lines(10)
+        good_line = lines[8]
+        lines[8] = lines[8].replace(str(self.therms[1].therm_id), 'not-a-thermometer')
+        path = self.write('archive.csv', lines)
+
+        with self.assertRaises(CommandError):
+            call_command('importreadings', path, chunk_size=3, stdout=StringIO())
+        self.assertEquals(self.therms[0].temperatures.count() +
+                          self.therms[1].temperatures.count(), 6)
+        self.assertEquals(ImportCheckpoint.objects.get(name=path).rows, 6)
+
+        lines[8] = good_line
+        path = self.write('archive.csv', lines)
+        out = StringIO()
+        call_command('importreadings', path, chunk_size=3, stdout=out)
+        self.assertIn('Resuming from byte', out.getvalue())
+        self.assertEquals(self.therms[0].temperatures.count() +
+                          self.therms[1].temperatures.count(), 10)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_checkpoint_with_chunk(self):
+        """
+        A crash saving a chunk's checkpoint should roll the chunk back too, so resuming doesn't
+        write readings without sequence numbers twice
+        """
+        lines = [line.rsplit(',', 1)[0] for line in self.csv_lines(10)]
+        path = self.write('archive.csv', lines)
+        save_checkpoint = Command.save_checkpoint
+        calls = []
+
+        def crash_second_checkpoint(command, offset, rows):
+            calls.append(offset)
+            if len(calls) == 2:
+                raise RuntimeError('killed')
+            save_checkpoint(command, offset, rows)
+
+        with mock.patch.object(Command, 'save_checkpoint', crash_second_checkpoint):
+            with self.assertRaises(RuntimeError):
+                call_command('importreadings', path, chunk_size=3, stdout=StringIO())
+        self.assertEquals(self.therms[0].temperatures.count() +
+                          self.therms[1].temperatures.count(), 3)
+
+        call_command('importreadings', path, chunk_size=3, stdout=StringIO())
+        self.assertEquals(self.therms[0].temperatures.count() +
+                          self.therms[1].temperatures.count(), 10)
@@ -0,0 +1,51 @@
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from thermometer.database import SQLITE_PRAGMAS, database_profile
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    """Tests for choosing a database profile
+
+    Methods:
+        test_sqlite_profile: The sqlite profile should keep connections and set pragmas
+        test_postgres_profile: The postgres profile should come from the environment
+        test_unknown_profile: Unknown profiles should be rejected
+    """
+
+    def test_sqlite_profile(self):
+        profile = database_profile('sqlite', '/srv', {})
+        self.assertEquals(profile['NAME'], '/srv/db.sqlite3')
+        self.assertEquals(profile['PRAGMAS']['journal_mode'], 'WAL')
+        self.assertGreater(profile['CONN_MAX_AGE'], 0)
+
+    def test_postgres_profile(self):
+        profile = database_profile('postgres', '/srv', {
+            'POSTGRES_DB': 'tanks', 'POSTGRES_HOST': 'db', 'THERMOMETER_PGBOUNCER': '1'
+        })
+        self.assertEquals((profile['NAME'], profile['HOST']), ('tanks', 'db'))
+        self.assertTrue(profile['HEALTH_CHECKS'])
+        self.assertTrue(profile['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            database_profile('mysql', '/srv', {})
+
+
+class PragmaTests(TestCase):
+    """Tests for per-connection SQLite pragmas
+
+    Methods:
+        test_pragmas: New connections should have the profile's pragmas set
+    """
+
+    def test_pragmas(self):
+        """
+        Pragmas that apply to an in-memory test database should be set on its connection
+        """
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            for name in ('cache_size', 'busy_timeout'):
+                cursor.execute(f'PRAGMA {name}')
+                self.assertEquals(cursor.fetchone()[0], SQLITE_PRAGMAS[name])
@@ -0,0 +1,76 @@
+import numpy
+
+from django.test import SimpleTestCase
+
+from temperature.downsample import lttb
+
+
+class LttbTests(SimpleTestCase):
+    """Tests for Largest-Triangle-Three-Buckets downsampling
+
+    Methods:
+        test_short_series: Series no longer than max_points should be kept whole
+        test_points_kept: Downsampling should keep max_points readings in order, including the
+            first and last
+        test_spikes_kept: Brief spikes and dips should survive downsampling
+        test_reference: Results should match a straightforward implementation of the algorithm
+    """
+
+    def test_short_series(self):
+        """
+        Series no longer than max_points should be kept whole
+        """
+        times = numpy.arange(5, dtype=numpy.int64)
+        self.assertEquals(list(lttb(times, times.astype(numpy.float32), 5)), [0, 1, 2, 3, 4])
+        self.assertEquals(list(lttb(times[:0], times[:0].astype(numpy.float32), 5)), [])
+
+    def test_points_kept(self):
+        """
+        Downsampling should keep exactly max_points readings, in order, including the first and
+        last
+        """
+        times = numpy.arange(10000, dtype=numpy.int64) * 10 ** 7
+        degrees = (25 + numpy.sin(numpy.arange(10000) / 300)).astype(numpy.float32)
+        for max_points in (3, 100, 1000, 9999):
+            kept = lttb(times, degrees, max_points)
+            self.assertEquals(len(kept), max_points)
+            self.assertEquals((kept[0], kept[-1]), (0, 9999))
+            self.assertTrue(numpy.all(numpy.diff(kept) > 0))
+
+    def test_spikes_kept(self):
+        """
+        A heater sticking on for one reading, or a sensor dropping out for one, should survive
+        downsampling that keeps one reading in a hundred
+        """
+        times = numpy.arange(10000, dtype=numpy.int64) * 10 ** 7
+        degrees = numpy.full(10000, 25, dtype=numpy.float32)
+        degrees[3141], degrees[7777] = 31, 0
+        kept = lttb(times, degrees, 100)
+        self.assertIn(3141, kept)
+        self.assertIn(7777, kept)
+
+    def test_reference(self):
+        """
+        Results should match a plain Python implementation of the algorithm
+        """
+        random = numpy.random.RandomState(0)
+        times = numpy.cumsum(random.randint(1, 10 ** 8, 2000)).astype(numpy.int64)
+        degrees = (25 + random.standard_normal(2000).cumsum() / 10).astype(numpy.float32)
+        x, y = [float(t - times[0]) for t in times], [float(d) for d in degrees]
+
+        max_points = 150
+        edges = [int(edge) for edge in numpy.linspace(1, len(x) - 1, max_points - 1)]
+        expected, previous = [0], 0
+        for bucket in range(max_points - 2):
+            start, end = edges[bucket], edges[bucket + 1]
+            after = range(end, edges[bucket + 2]) if bucket + 2 < len(edges) else [len(x) - 1]
+            mean_x = sum(x[i] for i in after) / len(after)
+            mean_y = sum(y[i] for i in after) / len(after)
+            previous = max(range(start, end), key=lambda i: abs(
+                (x[previous] - mean_x) * (y[i] - y[previous]) -
+                (x[previous] - x[i]) * (mean_y - y[previous])
+            ))
+            expected.append(previous)
+        expected.append(len(x) - 1)
+
+        self.assertEquals(list(lttb(times, degrees, max_points)), expected)
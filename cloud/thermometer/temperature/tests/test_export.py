@@ -0,0 +1,124 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+import json
+import os
+import tempfile
+from unittest import mock
+
+import numpy
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from temperature import blocks, export
+from temperature.ingest import store_readings
+from temperature.models import Thermometer
+
+
+class ExportTests(TestCase):
+    """Tests for columnar exports of readings
+
+    Methods:
+        setUp: Store a day of readings, half of them compacted, and an export directory
+        test_export: Exports should hold every reading, raw and compacted, as flat arrays
+        test_reading_array: Ranges of readings should be read into arrays a window at a time,
+            raw and compacted, with temperatures exactly as stored
+        test_incremental_export: Later exports should append only new readings
+        test_interrupted_export: Data written past the manifest should be discarded
+        test_command: The command should export every thermometer
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = self.settings(TEMPERATURE_EXPORT_ROOT=self.directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.therm = Thermometer.objects.create(display_name='tank')
+        self.start = (timezone.now() - datetime.timedelta(days=3)).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        store_readings(self.therm, [
+            {'time_recorded': self.start + datetime.timedelta(hours=i),
+             'degrees_c': Decimal('24.5') + i, 'valid_until': None}
+            for i in range(48)
+        ])
+        blocks.compact(self.therm, self.start + datetime.timedelta(days=1))
+
+    def test_export(self):
+        """
+        Exports should hold every reading, raw and compacted, oldest first, as flat arrays that
+        can be memory-mapped straight from the manifest
+        """
+        self.assertEquals(export.export(self.therm), (48, 48))
+        directory = export.export_dir(self.therm)
+        with open(os.path.join(directory, export.MANIFEST)) as manifest:
+            columns = json.load(manifest)['columns']
+        degrees = numpy.memmap(os.path.join(directory, columns['degrees_c']['file']),
+                               dtype=columns['degrees_c']['dtype'], mode='r')
+        self.assertEquals(degrees.tolist(), [24.5 + i for i in range(48)])
+
+        times, _ = export.load(directory)
+        self.assertEquals(times[0], blocks.microseconds(self.start))
+        self.assertTrue((numpy.diff(times) == 3600 * 10 ** 6).all())
+
+    def test_reading_array(self):
+        """
+        A range's readings, raw and compacted, should come back oldest first with their stored
+        temperatures, the raw ones read in one streamed query per window
+        """
+        since = self.start + datetime.timedelta(hours=20)
+        until = self.start + datetime.timedelta(hours=30)
+        with CaptureQueriesContext(connection) as queries:
+            with mock.patch.object(export, 'WINDOW', datetime.timedelta(hours=4)):
+                readings = export.reading_array(self.therm, since, until)
+        self.assertEquals(readings.dtype, export.READING_DTYPE)
+        self.assertEquals(readings['millidegrees'].tolist(),
+                          [(Decimal('24.5') + i) * 1000 for i in range(20, 30)])
+        self.assertEquals(readings['time_recorded'][0], blocks.microseconds(since))
+        readings_queries = [query for query in queries
+                            if 'FROM "temperature_temperaturereading"' in query['sql']]
+        self.assertEquals(len(readings_queries), 3)
+
+        self.assertEquals(len(export.reading_array(self.therm, until, until)), 0)
+
+    def test_incremental_export(self):
+        """
+        Exports after the first should append only readings recorded after the last one
+        """
+        export.export(self.therm)
+        self.assertEquals(export.export(self.therm), (0, 48))
+        store_readings(self.therm, [
+            {'time_recorded': self.start + datetime.timedelta(days=2), 'degrees_c': Decimal('30'),
+             'valid_until': None}
+        ])
+        self.assertEquals(export.export(self.therm), (1, 49))
+        times, degrees = export.load(export.export_dir(self.therm))
+        self.assertEquals(degrees[-1], 30)
+        self.assertEquals(times[-1], blocks.microseconds(self.start + datetime.timedelta(days=2)))
+        self.assertEquals(export.export(self.therm, rebuild=True), (49, 49))
+
+    def test_interrupted_export(self):
+        """
+        Anything written past the manifest's count by an interrupted export should be discarded
+        """
+        export.export(self.therm)
+        directory = export.export_dir(self.therm)
+        with open(os.path.join(directory, export.TIMES), 'ab') as times:
+            times.write(b'\xff' * 12)
+        self.assertEquals(export.export(self.therm), (0, 48))
+        self.assertEquals(os.path.getsize(os.path.join(directory, export.TIMES)), 48 * 8)
+
+    def test_command(self):
+        """
+        The command should export every thermometer, including ones with no readings
+        """
+        empty = Thermometer.objects.create(display_name='empty')
+        out = StringIO()
+        call_command('exportreadings', stdout=out)
+        self.assertIn('Exported 48 readings', out.getvalue())
+        self.assertEquals(len(export.load(export.export_dir(empty))[0]), 0)
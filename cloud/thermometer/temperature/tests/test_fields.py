@@ -0,0 +1,115 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection, models
+from django.db.migrations.state import ModelState, ProjectState
+from django.db.models import Avg, Max, Min, Sum
+from django.test import TestCase, TransactionTestCase
+
+from temperature.models import Thermometer, TemperatureReading
+from temperature.operations import ConvertToMillidegrees
+from temperature.fields import MillidegreesField
+
+
+class MillidegreesFieldTests(TestCase):
+    """Tests for MillidegreesField
+
+    Methods:
+        setUp: create a thermometer to record readings against
+        test_stored_as_integer: Readings should be stored as integer thousandths of a degree and
+            loaded as Decimal degrees
+        test_lookups_and_aggregates: Filters and aggregates should work in degrees
+    """
+
+    def setUp(self):
+        """
+        Create test data
+        """
+        user = get_user_model().objects.create_user(username='test', password='pass')
+        self.therm = Thermometer.objects.create(display_name='therm')
+        self.therm.register(user)
+
+    def test_stored_as_integer(self):
+        """
+        Readings should be stored as integer thousandths of a degree and loaded as Decimal degrees
+        """
+        reading = TemperatureReading.objects.create(thermometer=self.therm, degrees_c=21.5625)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT degrees_c FROM {TemperatureReading._meta.db_table} WHERE id = %s',
+                [reading.id]
+            )
+            self.assertEquals(cursor.fetchone()[0], 21563)
+        reading.refresh_from_db()
+        self.assertEquals(reading.degrees_c, Decimal('21.563'))
+
+        reading = TemperatureReading.objects.create(thermometer=self.therm, degrees_c=-0.0625)
+        reading.refresh_from_db()
+        self.assertEquals(reading.degrees_c, Decimal('-0.063'))
+
+    def test_lookups_and_aggregates(self):
+        """
+        Filters and aggregates should work in degrees
+        """
+        for degrees_c in ('20.5', '21', '22.25'):
+            TemperatureReading.objects.create(thermometer=self.therm, degrees_c=Decimal(degrees_c))
+        readings = TemperatureReading.objects.all()
+        self.assertEquals(readings.filter(degrees_c__gte=20.6).count(), 2)
+        self.assertEquals(readings.filter(degrees_c=21).count(), 1)
+        self.assertEquals(readings.filter(degrees_c__lt=Decimal('20.501')).count(), 1)
+
+        stats = readings.aggregate(
+            min=Min('degrees_c'), max=Max('degrees_c'), sum=Sum('degrees_c'), avg=Avg('degrees_c')
+        )
+        self.assertEquals(stats['min'], Decimal('20.5'))
+        self.assertEquals(stats['max'], Decimal('22.25'))
+        self.assertEquals(stats['sum'], Decimal('63.75'))
+        self.assertEquals(stats['avg'], Decimal('21.25'))
+
+
+class ConvertToMillidegreesTests(TransactionTestCase):
+    """Tests for the ConvertToMillidegrees migration operation
+
+    Methods:
+        test_convert_existing_data: Existing degree values should be rescaled to thousandths, and
+            back again when the operation is reversed
+    """
+
+    def test_convert_existing_data(self):
+        """
+        Existing degree values should be rescaled to thousandths, and back again when the
+        operation is reversed
+        """
+        from_state = ProjectState()
+        from_state.add_model(ModelState('temperature', 'LegacyReading', [
+            ('id', models.AutoField(primary_key=True)),
+            ('degrees_c', models.DecimalField(max_digits=10, decimal_places=6)),
+        ]))
+        operation = ConvertToMillidegrees('legacyreading', 'degrees_c', MillidegreesField())
+        to_state = from_state.clone()
+        operation.state_forwards('temperature', to_state)
+
+        old_model = from_state.apps.get_model('temperature', 'LegacyReading')
+        with connection.schema_editor() as editor:
+            editor.create_model(old_model)
+        try:
+            old_model.objects.bulk_create(
+                old_model(degrees_c=Decimal(value)) for value in ('21.5625', '-3.25', '0')
+            )
+            with connection.schema_editor() as editor:
+                operation.database_forwards('temperature', editor, from_state, to_state)
+            new_model = to_state.apps.get_model('temperature', 'LegacyReading')
+            self.assertEquals(
+                list(new_model.objects.order_by('id').values_list('degrees_c', flat=True)),
+                [Decimal('21.563'), Decimal('-3.25'), Decimal('0')]
+            )
+
+            with connection.schema_editor() as editor:
+                operation.database_backwards('temperature', editor, to_state, from_state)
+            self.assertEquals(
+                list(old_model.objects.order_by('id').values_list('degrees_c', flat=True)),
+                [Decimal('21.563'), Decimal('-3.25'), Decimal('0')]
+            )
+        finally:
+            with connection.schema_editor() as editor:
+                editor.delete_model(old_model)
@@ -0,0 +1,177 @@
+import datetime
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from temperature.blocks import compact
+from temperature.ingest import refresh_latest_reading, store_readings
+from temperature.models import TemperatureReading, Thermometer
+
+
+class DeadbandTests(TestCase):
+    """Tests for deadband compression of stored readings
+
+    Methods:
+        setUp: Create a thermometer with a 0.1 degree, 60 second deadband
+        test_no_deadband: Thermometers without a deadband should store every reading
+        test_merge_within_deadband: Readings near the last stored reading should extend it
+        test_interval_forces_store: A reading should be stored once the interval has passed
+        test_merge_into_stored_reading: Later batches should extend readings already stored
+        test_late_readings_kept: Readings older than the last stored reading should be stored
+        test_retry_merged_reading: Retries of merged readings should be recognized as stored
+    """
+
+    def setUp(self):
+        self.therm = Thermometer.objects.create(deadband_c=Decimal('0.1'), deadband_seconds=60)
+        self.start = timezone.now().replace(microsecond=0) - datetime.timedelta(hours=1)
+
+    def readings(self, *values, step=10, offset=0):
+        """
+        Return readings `step` seconds apart, starting `offset` seconds after self.start
+        """
+        return [
+            {'degrees_c': Decimal(str(value)),
+             'time_recorded': self.start + datetime.timedelta(seconds=offset + step * i)}
+            for i, value in enumerate(values)
+        ]
+
+    def stored(self):
+        return [
+            (float(t.degrees_c), (t.time_recorded - self.start).seconds,
+             t.valid_until and (t.valid_until - self.start).seconds)
+            for t in self.therm.temperatures.order_by('time_recorded')
+        ]
+
+    def test_no_deadband(self):
+        """
+        Every reading is stored when deadband_c is null
+        """
+        self.therm.deadband_c = None
+        store_readings(self.therm, self.readings(21, 21, 21, 21))
+        self.assertEquals(self.therm.temperatures.count(), 4)
+
+    def test_merge_within_deadband(self):
+        """
+        Readings within 0.1 degrees of the last stored reading are merged into it
+        """
+        store_readings(self.therm, self.readings(21, 21.05, 20.9, 21.2, 21.25, 21.1))
+        self.assertEquals(self.stored(), [(21, 0, 20), (21.2, 30, 50)])
+
+    def test_interval_forces_store(self):
+        """
+        Unchanged readings are stored again once deadband_seconds has passed
+        """
+        store_readings(self.therm, self.readings(21, 21, 21, 21, 21, 21, 21, 21))
+        self.assertEquals(self.stored(), [(21, 0, 50), (21, 60, 70)])
+
+    def test_merge_into_stored_reading(self):
+        """
+        A new batch should extend the last reading stored by an earlier batch
+        """
+        store_readings(self.therm, self.readings(21))
+        store_readings(self.therm, self.readings(21.05, 21, offset=10))
+        self.assertEquals(self.stored(), [(21, 0, 20)])
+
+    def test_late_readings_kept(self):
+        """
+        Store-and-forward readings from before the last stored reading are never merged
+        """
+        store_readings(self.therm, self.readings(21, offset=100))
+        store_readings(self.therm, self.readings(21, 21, offset=0))
+        self.assertEquals(self.stored(), [(21, 0, None), (21, 10, None), (21, 100, None)])
+
+    def test_retry_merged_reading(self):
+        """
+        A merged reading retried after a later reading was stored should be skipped, not stored
+        as a late reading
+        """
+        readings = self.readings(21, 21, 25)
+        for sequence, reading in enumerate(readings, 1):
+            reading['sequence'] = sequence
+            store_readings(self.therm, [reading])
+        self.assertEquals(self.therm.temperatures.get(sequence=1).merged_sequence, 2)
+
+        self.assertEquals(store_readings(self.therm, [readings[1]]), [])
+        self.assertEquals(store_readings(self.therm, readings), [])
+        self.assertEquals(self.stored(), [(21, 0, 10), (25, 20, None)])
+        self.assertEquals(Thermometer.objects.get(pk=self.therm.pk).reading_count, 2)
+
+
+class LatestReadingTests(TestCase):
+    """Tests for the latest reading and reading count kept on thermometers
+
+    Methods:
+        setUp: Create a thermometer
+        test_store_updates_latest: Storing readings should update the latest reading and count
+        test_late_readings: Late readings should be counted but not become the latest
+        test_retried_batch: Readings skipped as already stored shouldn't be counted
+        test_deleted_thermometer: Storing for a deleted thermometer should fail without writing
+        test_refresh: Refreshing should recount readings in the table and in blocks
+    """
+
+    def setUp(self):
+        self.therm = Thermometer.objects.create()
+        self.start = timezone.now().replace(microsecond=0) - datetime.timedelta(days=2)
+
+    def reading(self, degrees_c, minutes, **fields):
+        return {'degrees_c': Decimal(degrees_c),
+                'time_recorded': self.start + datetime.timedelta(minutes=minutes), **fields}
+
+    def latest(self):
+        therm = Thermometer.objects.get(pk=self.therm.pk)
+        return therm.latest_degrees_c, therm.latest_time_recorded, therm.reading_count
+
+    def test_store_updates_latest(self):
+        """
+        The newest reading in a batch should become the thermometer's latest, whatever its
+        position in the batch
+        """
+        self.assertEquals(self.latest(), (None, None, 0))
+        store_readings(self.therm, [self.reading('21.5', 2), self.reading('21.0625', 3),
+                                    self.reading('20', 1)])
+        self.assertEquals(self.latest(),
+                          (Decimal('21.063'), self.start + datetime.timedelta(minutes=3), 3))
+
+    def test_late_readings(self):
+        """
+        Readings older than the latest should be counted without replacing it
+        """
+        store_readings(self.therm, [self.reading('21', 10)])
+        store_readings(self.therm, [self.reading('19', 5), self.reading('18', 6)])
+        self.assertEquals(self.latest(),
+                          (Decimal('21'), self.start + datetime.timedelta(minutes=10), 3))
+
+    def test_retried_batch(self):
+        """
+        A retried batch should not be counted twice
+        """
+        batch = [self.reading('21', i, sequence=i) for i in range(3)]
+        store_readings(self.therm, batch)
+        store_readings(self.therm, batch)
+        self.assertEquals(self.latest()[2], 3)
+
+    def test_deleted_thermometer(self):
+        """
+        Storing readings for a thermometer deleted since it was loaded should fail before
+        anything is written
+        """
+        Thermometer.objects.filter(pk=self.therm.pk).delete()
+        with self.assertRaises(Thermometer.DoesNotExist):
+            store_readings(self.therm, [self.reading('21', 0)])
+        self.assertFalse(TemperatureReading.objects.exists())
+
+    def test_refresh(self):
+        """
+        Refreshing should find the latest reading and count readings, raw and compacted
+        """
+        store_readings(self.therm, [self.reading('21', 0), self.reading('22', 60 * 24)])
+        TemperatureReading.objects.create(
+            thermometer=self.therm, degrees_c=Decimal('23'),
+            time_recorded=self.start + datetime.timedelta(minutes=5)
+        )
+        compact(self.therm, self.start + datetime.timedelta(days=2))
+        self.assertFalse(self.therm.temperatures.exists())
+        refresh_latest_reading(self.therm)
+        self.assertEquals(self.latest(),
+                          (Decimal('22'), self.start + datetime.timedelta(days=1), 3))
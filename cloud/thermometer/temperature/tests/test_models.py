@@ -1,8 +1,9 @@
 import datetime
 
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.utils import timezone
 
 from temperature.models import Thermometer, TemperatureReading
 from temperature.exceptions import ThermometerRegistrationError
@@ -19,6 +20,7 @@ class ThermometerModelTests(TestCase):
         test_register thermometer: Registering a thermometer should associated a user with it.
             Attempting to register an already registered thermometer should fail.
         test_single_user_multiple_therms: One user should be able to own many thermometers
+        test_device_key: Generated device keys should be checked against their stored digest
 
     References:
     """
@@ -121,6 +123,24 @@ class ThermometerModelTests(TestCase):
         
         self.assertEqual(len(self.user.thermometers.all()), 20)
 
+    def test_device_key(self):
+        """
+        Thermometers should accept only their most recently generated device key
+        """
+        therm = Thermometer.objects.create(display_name="keyed")
+        self.assertFalse(therm.check_device_key(''))
+        self.assertFalse(therm.check_device_key('anything'))
+
+        key = therm.set_device_key()
+        therm = Thermometer.objects.get(pk=therm.pk)
+        self.assertNotEqual(key, therm.device_key_hash)
+        self.assertTrue(therm.check_device_key(key))
+        self.assertFalse(therm.check_device_key(key + 'x'))
+
+        new_key = therm.set_device_key()
+        self.assertFalse(therm.check_device_key(key))
+        self.assertTrue(therm.check_device_key(new_key))
+
 
 class TemperatureReadingModelTests(TestCase):
     """Tests for TemperatureReading class
@@ -130,6 +150,8 @@ class TemperatureReadingModelTests(TestCase):
             saved as expected, and that deleting the user associated with the thermometer cascades
             into deleting the temperatures as well
         temperature_conversion: Test conversion of C to F temperatures
+        test_recent_readings_use_index: A thermometer's readings should come newest first,
+            straight from the (thermometer, time_recorded) index
 
     """
 
@@ -168,3 +190,28 @@ class TemperatureReadingModelTests(TestCase):
             )
             temp.save()
         self.assertEquals(len(self.thermometer.temperatures.all()), 1000)
+
+    def test_recent_readings_use_index(self):
+        """
+        A thermometer's readings should come newest first, straight from the
+        (thermometer, time_recorded) index
+        """
+        start = timezone.now()
+        TemperatureReading.objects.bulk_create(
+            TemperatureReading(
+                thermometer=self.thermometer,
+                degrees_c=20,
+                time_recorded=start - datetime.timedelta(minutes=i)
+            )
+            for i in (3, 1, 2)
+        )
+        recent = self.thermometer.temperatures.all()
+        self.assertEquals(
+            [reading.time_recorded for reading in recent],
+            [start - datetime.timedelta(minutes=i) for i in (1, 2, 3)]
+        )
+
+        plan = self.thermometer.temperatures.all()[:10].explain()
+        self.assertIn('temperature_reading_time', plan)
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('TEMP B-TREE', plan)
@@ -0,0 +1,156 @@
+import datetime
+import re
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from temperature.models import TemperatureReading, Thermometer
+from temperature.pagination import Cursor, ReadingCursorPagination
+
+
+class ReadingCursorPaginationTests(TestCase):
+    """Tests for cursor pagination of readings
+
+    Methods:
+        setUp: Create a thermometer with readings, some recorded at the same time
+        test_walk_forward: Following next links should return every reading once, newest first
+        test_walk_back: Following previous links should return the same pages in reverse
+        test_page_size: Clients should be able to ask for pages up to TEMPERATURE_MAX_PAGE_SIZE
+        test_invalid_cursor: Cursors that can't be decoded should 404
+        test_index_used: Pages after a cursor should seek the (thermometer, time_recorded, id)
+            index rather than sort or skip readings
+        test_merge_thermometers: Pages of several thermometers' readings should be merged from
+            each thermometer's own index, loading only the readings kept
+    """
+
+    def setUp(self):
+        """
+        Create 25 readings, recorded in pairs at the same time, and another thermometer's
+        readings that should never appear
+        """
+        self.thermometer = Thermometer.objects.create(display_name='tank')
+        other = Thermometer.objects.create(display_name='other tank')
+        now = timezone.now()
+        TemperatureReading.objects.bulk_create(
+            TemperatureReading(thermometer=thermometer, degrees_c=20 + i / 10,
+                               time_recorded=now - datetime.timedelta(minutes=i // 2))
+            for thermometer in (self.thermometer, other)
+            for i in range(25)
+        )
+        self.expected = list(
+            self.thermometer.temperatures.order_by('-time_recorded', '-pk')
+            .values_list('pk', flat=True)
+        )
+        self.factory = APIRequestFactory()
+
+    def page(self, url='/temperatures/', queryset=None, view=None, **params):
+        paginator = ReadingCursorPagination()
+        request = Request(self.factory.get(url, params))
+        if queryset is None:
+            queryset = self.thermometer.temperatures.all()
+        results = paginator.paginate_queryset(queryset, request, view)
+        return [reading.pk for reading in results], paginator.get_paginated_response([]).data
+
+    def test_walk_forward(self):
+        """
+        Following next links should return every reading once, newest first, even where pages
+        end between readings recorded at the same time
+        """
+        seen, url, pages = [], '/temperatures/', 0
+        while url:
+            results, data = self.page(url)
+            seen += results
+            url = data['next']
+            pages += 1
+        self.assertEquals(pages, 3)
+        self.assertEquals(seen, self.expected)
+
+    def test_walk_back(self):
+        """
+        Following previous links from the last page should return the same pages in reverse
+        """
+        forward, url = [], '/temperatures/'
+        while url:
+            results, data = self.page(url)
+            forward.append(results)
+            last, url = data, data['next']
+        self.assertIsNone(self.page()[1]['previous'])
+
+        backward, url = [], last['previous']
+        while url:
+            results, data = self.page(url)
+            backward.append(results)
+            url = data['previous']
+        self.assertEquals(backward, forward[-2::-1])
+        self.assertIsNotNone(data['next'])
+
+    @override_settings(TEMPERATURE_MAX_PAGE_SIZE=20)
+    def test_page_size(self):
+        """
+        Clients should be able to ask for larger pages, up to TEMPERATURE_MAX_PAGE_SIZE
+        """
+        self.assertEquals(self.page(page_size=15)[0], self.expected[:15])
+        self.assertEquals(self.page(page_size=1000)[0], self.expected[:20])
+        self.assertEquals(self.page(page_size='lots')[0], self.expected[:10])
+
+    def test_invalid_cursor(self):
+        """
+        Cursors that can't be decoded should 404
+        """
+        for cursor in ('nonsense', 'MTox', ''):
+            with self.assertRaises(NotFound):
+                self.page(cursor=cursor)
+
+    def test_index_used(self):
+        """
+        Pages after a cursor should seek the (thermometer, time_recorded, id) index rather than
+        sort or skip readings
+        """
+        reading = self.thermometer.temperatures.order_by('-time_recorded', '-pk')[9]
+        paginator = ReadingCursorPagination()
+        for reverse in (False, True):
+            cursor = Cursor(reading.time_recorded, reading.pk, reverse)
+            plan = paginator.seek(self.thermometer.temperatures.all(), cursor)[:11].explain()
+            self.assertIn('temperature_reading_time', plan)
+            if connection.vendor == 'sqlite':
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_merge_thermometers(self):
+        """
+        Walking both thermometers' readings forward and back, merging the keys read from each
+        thermometer, should give them in the same order as sorting them all. Each page should
+        seek the (thermometer, time_recorded, id) index and load only the readings it returns.
+        """
+        queryset = TemperatureReading.objects.all()
+        expected = list(queryset.order_by('-time_recorded', '-pk').values_list('pk', flat=True))
+        view = mock.Mock(**{'get_page_thermometers.return_value': list(
+            Thermometer.objects.values_list('pk', flat=True)
+        )})
+
+        pages, url = [], '/temperatures/'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                results, data = self.page(url, queryset, view)
+            self.assertEquals(len(queries), 3)
+            self.assertTrue(all('"thermometer_id" = ' in query['sql'] for query in queries[:2]))
+            self.assertNotIn('"degrees_c"', queries[0]['sql'])
+            loaded = re.search(r'"id" IN \(([^)]*)\)', queries[2]['sql']).group(1).split(', ')
+            self.assertLessEqual(set(results), set(map(int, loaded)))
+            self.assertLessEqual(len(loaded), len(results) + 1)
+            pages.append(results)
+            last, url = data, data['next']
+        self.assertEquals(sum(pages, []), expected)
+
+        backward, url = [], last['previous']
+        while url:
+            results, data = self.page(url, queryset, view)
+            backward.append(results)
+            url = data['previous']
+        self.assertEquals(backward, pages[-2::-1])
@@ -0,0 +1,110 @@
+import datetime
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+
+from temperature import partitions
+
+UTC = datetime.timezone.utc
+
+
+def month(year, number):
+    return datetime.datetime(year, number, 1, tzinfo=UTC)
+
+
+class PartitionPlanningTests(SimpleTestCase):
+    """Tests for monthly partition planning
+
+    Methods:
+        test_months: Month starts should be found and stepped across year boundaries
+        test_partition_names: Partition names should round trip to their months
+        test_plan_partitions: Missing upcoming partitions should be created and old ones dropped
+        test_create_partition_sql: Creating a partition should move its readings out of the
+            default partition
+        test_partition_table_sql: Partitioning the table should rebuild every index on it
+    """
+
+    def test_months(self):
+        """
+        Month starts should be in UTC, and stepping should cross year boundaries
+        """
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        late = datetime.datetime(2019, 12, 31, 22, tzinfo=eastern)
+        self.assertEquals(partitions.month_start(late), month(2020, 1))
+        self.assertEquals(partitions.add_months(month(2019, 11), 3), month(2020, 2))
+        self.assertEquals(partitions.add_months(month(2020, 1), -1), month(2019, 12))
+        self.assertEquals(
+            partitions.months_between(month(2019, 11) + datetime.timedelta(days=3),
+                                      month(2020, 1) + datetime.timedelta(days=3)),
+            [month(2019, 11), month(2019, 12), month(2020, 1)]
+        )
+
+    def test_partition_names(self):
+        """
+        Partition names should round trip to the months they hold
+        """
+        name = partitions.partition_name(month(2020, 3))
+        self.assertEquals(name, 'temperature_temperaturereading_y2020m03')
+        self.assertEquals(partitions.partition_month(name), month(2020, 3))
+        self.assertIsNone(partitions.partition_month(partitions.DEFAULT_PARTITION))
+
+    def test_plan_partitions(self):
+        """
+        Missing partitions up to `ahead` months should be created, and partitions older than
+        `keep` months dropped
+        """
+        now = datetime.datetime(2020, 3, 15, tzinfo=UTC)
+        existing = [month(2019, 12), month(2020, 1), month(2020, 2), month(2020, 3)]
+        create, drop = partitions.plan_partitions(existing, now, ahead=2)
+        self.assertEquals(create, [month(2020, 4), month(2020, 5)])
+        self.assertEquals(drop, [])
+
+        create, drop = partitions.plan_partitions(existing, now, ahead=0, keep=2)
+        self.assertEquals(create, [])
+        self.assertEquals(drop, [month(2019, 12)])
+
+    def test_create_partition_sql(self):
+        """
+        Creating a partition should move that month's readings out of the default partition
+        while it is detached
+        """
+        statements = partitions.create_partition_sql(month(2020, 12))
+        self.assertIn('DETACH PARTITION "temperature_temperaturereading_default"', statements[0])
+        self.assertIn(
+            "FOR VALUES FROM ('2020-12-01T00:00:00+00:00') TO ('2021-01-01T00:00:00+00:00')",
+            statements[1]
+        )
+        self.assertTrue(statements[2].startswith('INSERT'))
+        self.assertTrue(statements[3].startswith('DELETE'))
+        self.assertIn('ATTACH PARTITION', statements[4])
+
+    def test_partition_table_sql(self):
+        """
+        Partitioning the reading table should rebuild each of its indexes on the partitioned
+        table, so readings are still listed without a sort
+        """
+        statements = partitions.partition_table_sql([month(2020, 3)], 'reading_id_seq')
+        indexes = [statement for statement in statements if statement.startswith('CREATE INDEX')]
+        self.assertEquals(indexes, [
+            'CREATE INDEX "temperature_reading_time" ON "temperature_temperaturereading" '
+            '("thermometer_id", "time_recorded", "id")',
+            'CREATE INDEX "temperature_reading_recent" ON "temperature_temperaturereading" '
+            '("time_recorded", "id")',
+        ])
+
+
+class PartitionReadingsCommandTests(TestCase):
+    """Tests for the partitionreadings command
+
+    Methods:
+        test_requires_partitioned_table: The command should refuse to run on an unpartitioned
+            table
+    """
+
+    def test_requires_partitioned_table(self):
+        """
+        The command should refuse to run when the reading table isn't partitioned, as on SQLite
+        """
+        with self.assertRaisesMessage(CommandError, 'not partitioned'):
+            call_command('partitionreadings')
@@ -0,0 +1,114 @@
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connections, transaction
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from temperature.models import TemperatureReading, Thermometer
+from temperature.viewsets import ThermometerViewset
+from thermometer.database import sqlite_profile
+from thermometer.replicas import REPLICA, ReplicaRouter, use_replica
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """Tests for sending reads to a read replica
+
+    A second SQLite file stands in for the replica, holding different rows from the primary so
+    the tests can tell which database a response was read from. Transactions are real, since
+    reads inside a transaction on the primary always stay on the primary.
+
+    Methods:
+        setUpClass: Add the replica database and create its tables
+        tearDownClass: Remove the replica database
+        setUp: Create a user with a thermometer on each database
+        test_safe_requests_read_replica: Safe requests should read from the replica
+        test_writes_pin_to_primary: Users should read from the primary after writing
+        test_router: The router should keep transactions, the cache table and migrations on the
+            primary
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.databases[REPLICA] = sqlite_profile(
+            os.path.join(cls.directory.name, 'replica.sqlite3')
+        )
+        with connections[REPLICA].schema_editor() as editor:
+            for model in (get_user_model(), Thermometer, TemperatureReading):
+                editor.create_model(model)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA].close()
+        del connections.databases[REPLICA]
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='owner', password='pass')
+        # bulk_create skips the signal that would create a profile on the primary
+        get_user_model().objects.using(REPLICA).bulk_create(
+            [get_user_model()(pk=self.user.pk, username='owner')]
+        )
+        for alias in ('default', REPLICA):
+            Thermometer.objects.using(alias).create(owner_id=self.user.pk, display_name=alias)
+        self.factory = APIRequestFactory()
+        self.url = reverse('thermometer-list')
+
+    def tearDown(self):
+        # Straight to the database, since the replica lacks the tables deletes would cascade to
+        for model in (Thermometer, get_user_model()):
+            model.objects.using(REPLICA).all()._raw_delete(REPLICA)
+
+    def list_names(self):
+        request = self.factory.get(self.url)
+        force_authenticate(request, user=self.user)
+        response = ThermometerViewset.as_view({'get': 'list'})(request)
+        return [thermometer['display_name'] for thermometer in response.data['results']]
+
+    def test_safe_requests_read_replica(self):
+        """
+        Safe requests should read from the replica, and nothing else should
+        """
+        self.assertEquals(self.list_names(), [REPLICA])
+        self.assertFalse(use_replica.get())
+        self.assertEquals(Thermometer.objects.get().display_name, 'default')
+
+    def test_writes_pin_to_primary(self):
+        """
+        After a user writes, their reads should go to the primary for a while
+        """
+        request = self.factory.post(self.url, {'display_name': 'new'})
+        force_authenticate(request, user=self.user)
+        response = ThermometerViewset.as_view({'post': 'create'})(request)
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(sorted(self.list_names()), ['default', 'new'])
+
+        cache.clear()
+        self.assertEquals(self.list_names(), [REPLICA])
+
+    def test_router(self):
+        """
+        Reads inside a transaction on the primary, reads of the cache table pins are kept in,
+        and every migration, should stay on the primary
+        """
+        router = ReplicaRouter()
+        cache_table = DatabaseCache('thermometer_cache', {}).cache_model_class
+        token = use_replica.set(True)
+        try:
+            self.assertEquals(router.db_for_read(Thermometer), REPLICA)
+            self.assertIsNone(router.db_for_read(cache_table))
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Thermometer))
+        finally:
+            use_replica.reset(token)
+        self.assertIsNone(router.db_for_read(Thermometer))
+        self.assertFalse(router.allow_migrate(REPLICA, 'temperature'))
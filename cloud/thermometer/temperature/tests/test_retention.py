@@ -0,0 +1,149 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from temperature import retention
+from temperature.blocks import compact
+from temperature.ingest import refresh_latest_reading, store_readings
+from temperature.models import ReadingRollup, Thermometer, TemperatureReading
+from temperature.rollups import history
+
+POLICY = {
+    'RAW_DAYS': 7,
+    'MINUTE_DAYS': 7,
+    'HOUR_MONTHS': 1,
+    'CHUNK_SIZE': 10,
+    'CHUNK_PAUSE_MS': 0,
+}
+
+
+@override_settings(TEMPERATURE_RETENTION=POLICY)
+class RetentionTests(TestCase):
+    """Tests for tiered retention
+
+    Methods:
+        setUp: Store a reading every 6 hours for the last 60 days on two thermometers
+        test_cutoffs: Each tier should expire at its own age, and daily rollups never
+        test_expire: Expired rows should be deleted in chunks and everything else kept
+        test_expire_counts: Expired readings should be taken off the reading counts
+        test_history_after_expiry: History should fall back to tiers that are still kept
+        test_command: The command should expire rows and support a dry run
+        test_rebuild_after_expiry: Rebuilding rollups should leave those of expired readings
+    """
+
+    def setUp(self):
+        self.now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.therms = [Thermometer.objects.create(), Thermometer.objects.create()]
+        for therm in self.therms:
+            store_readings(therm, [
+                {'degrees_c': Decimal(20 + hours % 5),
+                 'time_recorded': self.now - datetime.timedelta(hours=hours)}
+                for hours in range(0, 24 * 60, 6)
+            ])
+
+    def test_cutoffs(self):
+        """
+        Each tier should expire at its own age, and daily rollups never
+        """
+        now = datetime.datetime(2020, 3, 31, 12, tzinfo=datetime.timezone.utc)
+        cutoffs = retention.cutoffs(now)
+        self.assertEquals(cutoffs['raw'], now - datetime.timedelta(days=7))
+        self.assertEquals(cutoffs['hour'], datetime.datetime(2020, 2, 29, 12,
+                                                             tzinfo=datetime.timezone.utc))
+        self.assertIsNone(cutoffs['day'])
+        self.assertEquals(retention.months_ago(now, 14).date(), datetime.date(2019, 1, 31))
+
+    def test_expire(self):
+        """
+        Expired rows should be deleted, and days' rollups kept
+        """
+        days = ReadingRollup.objects.filter(period='day').count()
+        deleted, dropped = retention.expire(self.now, chunk_size=7)
+        self.assertEquals(dropped, [])
+        self.assertEquals(deleted['raw'], 2 * (240 - 29))
+
+        cutoff = self.now - datetime.timedelta(days=7)
+        self.assertFalse(TemperatureReading.objects.filter(time_recorded__lt=cutoff).exists())
+        self.assertEquals(TemperatureReading.objects.count(), 2 * 29)
+        self.assertFalse(
+            ReadingRollup.objects.filter(period='minute', bucket_start__lt=cutoff).exists()
+        )
+        hour_cutoff = retention.cutoffs(self.now)['hour']
+        self.assertFalse(
+            ReadingRollup.objects.filter(period='hour', bucket_start__lt=hour_cutoff).exists()
+        )
+        self.assertTrue(ReadingRollup.objects.filter(period='hour').exists())
+        self.assertEquals(ReadingRollup.objects.filter(period='day').count(), days)
+
+    def test_expire_counts(self):
+        """
+        Expired readings, raw and compacted, should be taken off the reading counts, leaving
+        the counts refresh_latest_reading computes from the readings kept
+        """
+        compact(self.therms[0], self.now - datetime.timedelta(days=14))
+        retention.expire(self.now, chunk_size=7)
+        counts = list(Thermometer.objects.order_by('pk').values_list('reading_count', flat=True))
+        self.assertEquals(counts, [29, 29])
+
+        for therm in self.therms:
+            refresh_latest_reading(therm)
+        self.assertEquals(
+            list(Thermometer.objects.order_by('pk').values_list('reading_count', flat=True)),
+            counts
+        )
+
+    def test_history_after_expiry(self):
+        """
+        Once raw readings have expired, history for their range should come from the rollups
+        """
+        retention.expire(self.now, chunk_size=100)
+        since = self.now - datetime.timedelta(days=20, hours=1)
+        with self.settings(TEMPERATURE_ROLLUP_RAW_RANGE=datetime.timedelta(days=1)):
+            resolution, points = history(self.therms[0], since, since + datetime.timedelta(hours=7))
+        self.assertEquals(resolution, 'hour')
+        self.assertEquals(sum(point['count'] for point in points), 1)
+
+        since = self.now - datetime.timedelta(days=59)
+        resolution, points = history(self.therms[0], since, self.now)
+        self.assertEquals(resolution, 'day')
+        # Daily points cover whole days, from the start of the first one to the end of today
+        day_start = since.replace(hour=0)
+        self.assertEquals(sum(point['count'] for point in points),
+                          sum(1 for hours in range(0, 24 * 60, 6)
+                              if self.now - datetime.timedelta(hours=hours) >= day_start))
+
+    def test_command(self):
+        """
+        The command should report cutoffs on a dry run and expire rows otherwise
+        """
+        out = StringIO()
+        call_command('expirereadings', dry_run=True, stdout=out)
+        self.assertIn('day: kept forever', out.getvalue())
+        self.assertEquals(TemperatureReading.objects.count(), 2 * 240)
+
+        out = StringIO()
+        call_command('expirereadings', tiers=['raw'], stdout=out)
+        self.assertIn('Deleted', out.getvalue())
+        self.assertLess(TemperatureReading.objects.count(), 2 * 240)
+        self.assertEquals(ReadingRollup.objects.filter(period='minute').count(), 2 * 240)
+
+    def test_rebuild_after_expiry(self):
+        """
+        Rebuilding rollups over a range whose raw readings have expired should keep the rollups
+        that are all that is left of them, and rebuild the rest unchanged
+        """
+        retention.expire(self.now, chunk_size=100)
+        rollups = sorted(ReadingRollup.objects.values_list(
+            'thermometer', 'period', 'bucket_start', 'count', 'degrees_sum', 'degrees_min',
+            'degrees_max'
+        ))
+        since = self.now - datetime.timedelta(days=61)
+        call_command('rebuildrollups', since=since.isoformat(), stdout=StringIO())
+        self.assertEquals(sorted(ReadingRollup.objects.values_list(
+            'thermometer', 'period', 'bucket_start', 'count', 'degrees_sum', 'degrees_min',
+            'degrees_max'
+        )), rollups)
@@ -0,0 +1,142 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from temperature.ingest import store_readings
+from temperature.models import Thermometer, TemperatureReading
+from temperature.rollups import history, rebuild_rollups
+
+START = datetime.datetime(2020, 3, 1, 23, 58, tzinfo=datetime.timezone.utc)
+KEEP_FOREVER = {
+    'RAW_DAYS': None,
+    'MINUTE_DAYS': None,
+    'HOUR_MONTHS': None,
+    'CHUNK_SIZE': 5000,
+    'CHUNK_PAUSE_MS': 0,
+}
+
+
+def rollups(thermometer):
+    """
+    Return a thermometer's rollups as comparable tuples
+    """
+    return sorted(
+        (r.period, r.bucket_start, r.count, r.degrees_sum, r.degrees_min, r.degrees_max)
+        for r in thermometer.rollups.all()
+    )
+
+
+@override_settings(TEMPERATURE_RETENTION=KEEP_FOREVER)
+class RollupTests(TestCase):
+    """Tests for reading rollups
+
+    Methods:
+        setUp: Create a thermometer
+        test_incremental_rollups: Stored batches should be added to minute, hour and day rollups
+        test_retried_readings: Retried readings should not be counted twice
+        test_rebuild: Rebuilding should recompute the same rollups from raw readings
+        test_rebuild_command: The command should rebuild rollups for readings stored directly
+        test_history: Short ranges should come from raw readings, long ones from rollups
+    """
+
+    def setUp(self):
+        self.therm = Thermometer.objects.create(display_name='tank')
+
+    def readings(self, count, offset=0, step=30):
+        """
+        Return `count` readings `step` seconds apart, starting `offset` seconds after START
+        """
+        return [
+            {'degrees_c': Decimal(20) + Decimal(i % 7) / 8,
+             'time_recorded': START + datetime.timedelta(seconds=offset + step * i),
+             'sequence': offset // step + i}
+            for i in range(count)
+        ]
+
+    def test_incremental_rollups(self):
+        """
+        Stored batches should be added to the rollups for every period they touch, including
+        buckets started by earlier batches
+        """
+        store_readings(self.therm, self.readings(4))
+        store_readings(self.therm, self.readings(4, offset=120))
+
+        minutes = {r.bucket_start: r for r in self.therm.rollups.filter(period='minute')}
+        self.assertEquals(len(minutes), 4)
+        first = minutes[START]
+        self.assertEquals((first.count, first.degrees_min, first.degrees_max),
+                          (2, 20, Decimal('20.125')))
+        self.assertEquals(first.degrees_mean, Decimal('20.0625'))
+
+        days = {r.bucket_start: r.count for r in self.therm.rollups.filter(period='day')}
+        self.assertEquals(days, {
+            datetime.datetime(2020, 3, 1, tzinfo=datetime.timezone.utc): 4,
+            datetime.datetime(2020, 3, 2, tzinfo=datetime.timezone.utc): 4,
+        })
+        self.assertEquals(self.therm.rollups.filter(period='hour').count(), 2)
+
+    def test_retried_readings(self):
+        """
+        Readings with sequence numbers already stored should not be counted twice
+        """
+        store_readings(self.therm, self.readings(10))
+        before = rollups(self.therm)
+        self.assertEquals(store_readings(self.therm, self.readings(10)), [])
+        self.assertEquals(rollups(self.therm), before)
+        self.assertEquals(self.therm.temperatures.count(), 10)
+
+    def test_rebuild(self):
+        """
+        Rebuilding should recompute exactly the rollups kept up incrementally
+        """
+        for offset in range(0, 3600, 600):
+            store_readings(self.therm, self.readings(20, offset=offset))
+        incremental = rollups(self.therm)
+        self.therm.rollups.filter(period='hour').update(count=0)
+
+        rebuild_rollups(self.therm, START, START + datetime.timedelta(hours=1))
+        self.assertEquals(rollups(self.therm), incremental)
+
+    def test_rebuild_command(self):
+        """
+        The command should create rollups for readings stored without them
+        """
+        TemperatureReading.objects.bulk_create(
+            TemperatureReading(thermometer=self.therm, **reading)
+            for reading in self.readings(100, step=90)
+        )
+        self.assertFalse(self.therm.rollups.exists())
+        out = StringIO()
+        call_command('rebuildrollups', thermometer=[str(self.therm.therm_id)], stdout=out)
+        self.assertIn('Rebuilt', out.getvalue())
+        self.assertEquals(
+            sum(self.therm.rollups.filter(period='day').values_list('count', flat=True)), 100
+        )
+        self.assertEquals(self.therm.rollups.filter(period='minute').count(), 100)
+
+    @override_settings(TEMPERATURE_ROLLUP_RAW_RANGE=datetime.timedelta(hours=1),
+                       TEMPERATURE_HISTORY_MAX_POINTS=100)
+    def test_history(self):
+        """
+        Short ranges should list raw readings; longer ones the finest rollups with few enough
+        points
+        """
+        store_readings(self.therm, self.readings(200, step=60))
+
+        resolution, points = history(self.therm, START, START + datetime.timedelta(minutes=10))
+        self.assertEquals(resolution, 'raw')
+        self.assertEquals(len(points), 10)
+        self.assertEquals(points[0]['time'], START)
+
+        resolution, points = history(self.therm, START, START + datetime.timedelta(minutes=90))
+        self.assertEquals(resolution, 'minute')
+        self.assertEquals(len(points), 90)
+
+        with self.assertNumQueries(1):
+            resolution, points = history(self.therm, START, START + datetime.timedelta(days=2))
+        self.assertEquals(resolution, 'hour')
+        self.assertEquals([point['count'] for point in points], [2, 60, 60, 60, 18])
+        self.assertEquals(sum(point['count'] for point in points), 200)
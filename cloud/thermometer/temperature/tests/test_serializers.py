@@ -5,6 +5,7 @@ from django.db import transaction
 
 from rest_framework.test import APITestCase
 
+from temperature.ingest import store_readings
 from temperature.models import Thermometer, TemperatureReading
 from temperature.serializers import TemperatureReadingSerializer, ThermometerSerializer
 
@@ -140,6 +141,8 @@ class ThermometerSerializerTests(APITestCase):
         create_invalid_data: Serializer should reject invalid data
         update_add_temperatures: Passing new temperatures to a serializer with an existing instance
             should create new corresponding temperature records
+        update_keeps_counts: Updating or registering a stale instance should keep the reading
+            count and latest reading of batches stored since it was loaded
     """
 
     def setUp(self):
@@ -240,3 +243,23 @@ class ThermometerSerializerTests(APITestCase):
             self.assertEquals(temps[i].degrees_c, expected_temps[i])
 
         self.assertEquals(len(TemperatureReading.objects.all()), 3)
+
+    def test_update_keeps_counts(self):
+        """
+        Registering or renaming a thermometer loaded before a batch was stored should not reset
+        its reading count and latest reading
+        """
+        stale = Thermometer.objects.get(pk=self.test_thermometer.pk)
+        store_readings(self.test_thermometer, [{'degrees_c': 21}, {'degrees_c': 22}])
+
+        stale.register(self.user)
+        serializer = ThermometerSerializer(
+            stale, data={'display_name': 'renamed'}, context=self.context, partial=True
+        )
+        self.assertTrue(serializer.is_valid())
+        thermometer = serializer.save()
+        self.assertEquals(thermometer.reading_count, 2)
+
+        thermometer = Thermometer.objects.get(pk=self.test_thermometer.pk)
+        self.assertEquals((thermometer.display_name, thermometer.owner), ('renamed', self.user))
+        self.assertEquals((thermometer.reading_count, thermometer.latest_degrees_c), (2, 22))
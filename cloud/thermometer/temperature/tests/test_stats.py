@@ -0,0 +1,110 @@
+import datetime
+from decimal import Decimal
+
+import pytz
+
+from django.test import TestCase, override_settings
+
+from temperature.blocks import compact
+from temperature.ingest import store_readings
+from temperature.models import Thermometer
+from temperature.stats import BUCKETS, bucket_starts, stats
+
+# Clocks in New York went forward at 07:00 UTC on 8 March 2020
+START = datetime.datetime(2020, 3, 7, 20, tzinfo=datetime.timezone.utc)
+UNTIL = datetime.datetime(2020, 3, 9, 12, tzinfo=datetime.timezone.utc)
+NEW_YORK = pytz.timezone('America/New_York')
+KOLKATA = pytz.timezone('Asia/Kolkata')
+KEEP_FOREVER = {
+    'RAW_DAYS': None,
+    'MINUTE_DAYS': None,
+    'HOUR_MONTHS': None,
+    'CHUNK_SIZE': 5000,
+    'CHUNK_PAUSE_MS': 0,
+}
+
+
+@override_settings(TEMPERATURE_RETENTION=KEEP_FOREVER)
+class StatsTests(TestCase):
+    """Tests for bucketed reading statistics
+
+    Methods:
+        setUp: Store readings every ten minutes over two days
+        test_bucket_starts: Buckets should follow local wall-clock time through daylight saving
+        test_rollup_sources: Statistics should come from the coarsest rollups that line up with
+            the local buckets
+        test_raw_fallback: Grouping raw and compacted readings should give the same statistics
+            as the rollups
+        test_expired_fallback: With neither aligned rollups nor raw readings retained, the finest
+            retained rollups should be used
+    """
+
+    def setUp(self):
+        self.therm = Thermometer.objects.create(display_name='tank')
+        self.count = (UNTIL - START) // datetime.timedelta(minutes=10)
+        store_readings(self.therm, [
+            {'degrees_c': Decimal(20) + Decimal(i % 9) / 8,
+             'time_recorded': START + datetime.timedelta(minutes=10 * i)}
+            for i in range(self.count)
+        ])
+
+    def test_bucket_starts(self):
+        """
+        Daily buckets should start at local midnight, making the day clocks go forward 23 hours
+        long, and hourly buckets on the local hour
+        """
+        starts = bucket_starts(START, UNTIL, BUCKETS['1d'], NEW_YORK)
+        self.assertEquals([start.astimezone(NEW_YORK).hour for start in starts], [0, 0, 0, 0])
+        self.assertEquals([b - a for a, b in zip(starts, starts[1:])], [
+            datetime.timedelta(hours=24), datetime.timedelta(hours=23),
+            datetime.timedelta(hours=24),
+        ])
+
+        starts = bucket_starts(START, START + datetime.timedelta(hours=2), BUCKETS['1h'], KOLKATA)
+        self.assertEquals([start.astimezone(pytz.utc).minute for start in starts], [30] * 4)
+
+    def test_rollup_sources(self):
+        """
+        Statistics should come from the coarsest rollups whose buckets fit inside the local
+        buckets, and count every reading once
+        """
+        for bucket, tz, source in (('1d', pytz.utc, 'day'), ('1d', NEW_YORK, 'hour'),
+                                   ('6h', pytz.utc, 'hour'), ('1h', KOLKATA, 'minute'),
+                                   ('15m', NEW_YORK, 'minute')):
+            resolution, points = stats(self.therm, START, UNTIL, BUCKETS[bucket], tz)
+            self.assertEquals(resolution, source)
+            self.assertEquals(sum(point['count'] for point in points), self.count)
+
+        resolution, points = stats(self.therm, START, UNTIL, BUCKETS['1d'], NEW_YORK)
+        self.assertEquals([point['count'] for point in points], [54, 138, 48])
+        self.assertEquals(points[0]['time'], NEW_YORK.localize(datetime.datetime(2020, 3, 7)))
+        self.assertEquals((points[0]['degrees_min'], points[0]['degrees_max']),
+                          (Decimal(20), Decimal(21)))
+
+    def test_raw_fallback(self):
+        """
+        With no rollups that line up, raw readings, including compacted ones, should be grouped
+        into the same statistics the rollups give
+        """
+        expected = stats(self.therm, START, UNTIL, BUCKETS['1h'], KOLKATA)[1]
+        compact(self.therm, datetime.datetime(2020, 3, 9, tzinfo=datetime.timezone.utc))
+
+        retention = {**KEEP_FOREVER, 'MINUTE_DAYS': 1}
+        with self.settings(TEMPERATURE_RETENTION=retention):
+            resolution, points = stats(self.therm, START, UNTIL, BUCKETS['1h'], KOLKATA)
+        self.assertEquals(resolution, 'raw')
+        self.assertEquals(points, expected)
+
+    def test_expired_fallback(self):
+        """
+        Once minute rollups and raw readings have expired, hourly buckets in India should come
+        from the hourly rollups, each counted in the local hour it starts in
+        """
+        retention = {**KEEP_FOREVER, 'RAW_DAYS': 1, 'MINUTE_DAYS': 1}
+        with self.settings(TEMPERATURE_RETENTION=retention):
+            resolution, points = stats(self.therm, START, UNTIL, BUCKETS['1h'], KOLKATA)
+        self.assertEquals(resolution, 'hour')
+        self.assertEquals(sum(point['count'] for point in points), self.count)
+        self.assertTrue(all(point['count'] == 6 for point in points))
+        self.assertEquals(points[0]['time'], START.astimezone(KOLKATA) - datetime.timedelta(
+            minutes=30))
@@ -0,0 +1,234 @@
+import datetime
+from decimal import Decimal
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from temperature import codecs
+from temperature.models import TemperatureReading, Thermometer
+
+
+class DeviceIngestViewTests(TestCase):
+    """Tests for the device ingestion view
+
+    Methods:
+        setUp: Create test data
+        tearDown: Clear test database
+        test_valid_upload: Authenticated devices should be able to upload readings
+        test_binary_upload: Devices should be able to upload packed DS18B20 batches
+        test_sequenced_uploads: Retried uploads with sequence numbers should be stored once
+        test_device_timestamps: Buffered readings should keep the time the device took them,
+            within the accepted clock window
+        test_bad_credentials: Uploads without a valid device key should return 401
+        test_invalid_payloads: Malformed uploads should return 400 and store nothing
+        test_device_status: Devices should be able to read back their highest stored sequence
+        test_other_methods: Methods other than GET and POST should return 405
+    """
+
+    def setUp(self):
+        """
+        Create a registered thermometer with a device key
+        """
+        self.user = get_user_model().objects.create_user(
+            username='owner',
+            password='pass',
+            email='owner@e.mail'
+        )
+        self.therm = Thermometer.objects.create(display_name='tank')
+        self.therm.register(self.user)
+        self.key = self.therm.set_device_key()
+        self.url = reverse('device-ingest', args=[self.therm.therm_id])
+
+    def tearDown(self):
+        """
+        Clear test database
+        """
+        with transaction.atomic():
+            self.user.delete()
+        self.assertEquals(len(TemperatureReading.objects.all()), 0)
+
+    def upload(self, payload, key=None, url=None):
+        return self.client.post(
+            url or self.url,
+            data=payload,
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Device {key or self.key}'
+        )
+
+    def test_valid_upload(self):
+        """
+        Valid uploads should be stored to the nearest thousandth of a degree and return 204 with
+        no body
+        """
+        response = self.upload('[21.5, 21.5625, 22]')
+        self.assertEquals(response.status_code, 204)
+        self.assertEquals(response.content, b'')
+        temps = sorted(t.degrees_c for t in self.therm.temperatures.all())
+        self.assertEquals([float(t) for t in temps], [21.5, 21.563, 22])
+
+    def test_binary_upload(self):
+        """
+        Binary batches should be stored with their timestamps
+        """
+        start = timezone.now().replace(microsecond=0)
+        readings = [(start + datetime.timedelta(seconds=i), 400 + i) for i in range(20)]
+        response = self.client.post(
+            self.url,
+            data=codecs.encode_readings(readings),
+            content_type=codecs.CONTENT_TYPE,
+            HTTP_AUTHORIZATION=f'Device {self.key}'
+        )
+        self.assertEquals(response.status_code, 204)
+        temps = self.therm.temperatures.order_by('time_recorded')
+        self.assertEquals(len(temps), 20)
+        self.assertEquals(temps[0].time_recorded, start)
+        self.assertEquals(temps[19].degrees_c, Decimal('26.188'))
+
+        response = self.client.post(
+            self.url,
+            data=b'garbage',
+            content_type=codecs.CONTENT_TYPE,
+            HTTP_AUTHORIZATION=f'Device {self.key}'
+        )
+        self.assertEquals(response.status_code, 400)
+
+    def test_sequenced_uploads(self):
+        """
+        Sequence numbers should deduplicate retried JSON and binary uploads
+        """
+        payload = json.dumps([{'degrees_c': 21.5, 'sequence': i} for i in range(5)])
+        self.assertEquals(self.upload(payload).status_code, 204)
+        self.assertEquals(self.upload(payload).status_code, 204)
+        self.assertEquals(self.therm.temperatures.count(), 5)
+
+        start = timezone.now().replace(microsecond=0)
+        readings = [(start + datetime.timedelta(seconds=i), 400) for i in range(10)]
+        for i in range(2):
+            response = self.client.post(
+                self.url,
+                data=codecs.encode_readings(readings, first_sequence=3),
+                content_type=codecs.CONTENT_TYPE,
+                HTTP_AUTHORIZATION=f'Device {self.key}'
+            )
+            self.assertEquals(response.status_code, 204)
+        self.assertEquals(self.therm.temperatures.count(), 13)
+
+        payloads = [
+            '[{"degrees_c": 21, "sequence": -1}]',
+            '[{"degrees_c": 21, "sequence": 1.5}]',
+            '[{"sequence": 1}]',
+        ]
+        for payload in payloads:
+            self.assertEquals(self.upload(payload).status_code, 400)
+
+    def test_device_timestamps(self):
+        """
+        Device timestamps should be stored as given, unless outside the accepted window
+        """
+        taken = timezone.now().replace(microsecond=0) - datetime.timedelta(hours=6)
+        payload = json.dumps([
+            {'degrees_c': 21, 'time_recorded': taken.isoformat()},
+            {'degrees_c': 22, 'time_recorded': int(taken.timestamp()) + 60},
+            {'degrees_c': 23, 'time_recorded': taken.replace(tzinfo=None).isoformat()},
+        ])
+        self.assertEquals(self.upload(payload).status_code, 204)
+        times = {t.degrees_c: t.time_recorded for t in self.therm.temperatures.all()}
+        self.assertEquals(times[21], taken)
+        self.assertEquals(times[22], taken + datetime.timedelta(seconds=60))
+        self.assertEquals(times[23], taken)
+
+        now = timezone.now()
+        payloads = [
+            [{'degrees_c': 21, 'time_recorded': (now + datetime.timedelta(hours=1)).isoformat()}],
+            [{'degrees_c': 21, 'time_recorded': (now - datetime.timedelta(days=30)).isoformat()}],
+            [{'degrees_c': 21, 'time_recorded': 'yesterday'}],
+            [{'degrees_c': 21, 'time_recorded': [2020]}],
+        ]
+        for payload in payloads:
+            self.assertEquals(self.upload(json.dumps(payload)).status_code, 400)
+
+        with self.settings(TEMPERATURE_CLOCK_SKEW=datetime.timedelta(hours=2)):
+            self.assertEquals(self.upload(json.dumps(payloads[0])).status_code, 204)
+
+        old = [(now - datetime.timedelta(days=30), 400)]
+        response = self.client.post(
+            self.url,
+            data=codecs.encode_readings(old),
+            content_type=codecs.CONTENT_TYPE,
+            HTTP_AUTHORIZATION=f'Device {self.key}'
+        )
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(self.therm.temperatures.count(), 4)
+
+    def test_bad_credentials(self):
+        """
+        Missing or wrong keys, and unknown thermometers, should all look the same
+        """
+        other = Thermometer.objects.create(display_name='other')
+        responses = [
+            self.upload('[21]', key='wrong'),
+            self.client.post(self.url, data='[21]', content_type='application/json'),
+            self.client.post(self.url, data='[21]', content_type='application/json',
+                             HTTP_AUTHORIZATION=f'Token {self.key}'),
+            self.upload('[21]', url=reverse('device-ingest', args=[other.therm_id])),
+        ]
+        for response in responses:
+            self.assertEquals(response.status_code, 401)
+        self.assertEquals(self.therm.temperatures.count(), 0)
+        other.delete()
+
+    def test_invalid_payloads(self):
+        """
+        Malformed, empty, oversized or out of range payloads should be rejected
+        """
+        payloads = [
+            'warm',
+            '[]',
+            '{"degrees_c": 21}',
+            '[21, "22"]',
+            '[true]',
+            '[123456]',
+        ]
+        for payload in payloads:
+            response = self.upload(payload)
+            self.assertEquals(response.status_code, 400)
+            self.assertIn('detail', json.loads(response.content))
+
+        with self.settings(TEMPERATURE_MAX_BATCH_SIZE=2):
+            self.assertEquals(self.upload('[1, 2, 3]').status_code, 400)
+
+        self.assertEquals(self.therm.temperatures.count(), 0)
+
+    def test_device_status(self):
+        """
+        GET should return the highest sequence number stored for the device, including those
+        merged by the deadband
+        """
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Device {self.key}')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content), {'sequence': None})
+
+        self.upload(json.dumps([{'degrees_c': 21, 'sequence': i} for i in (4, 9, 7)]))
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Device {self.key}')
+        self.assertEquals(json.loads(response.content), {'sequence': 9})
+
+        Thermometer.objects.filter(pk=self.therm.pk).update(deadband_c=1, deadband_seconds=60)
+        self.upload(json.dumps([{'degrees_c': 21, 'sequence': 10}]))
+        self.assertEquals(self.therm.temperatures.count(), 3)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Device {self.key}')
+        self.assertEquals(json.loads(response.content), {'sequence': 10})
+
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Device wrong')
+        self.assertEquals(response.status_code, 401)
+
+    def test_other_methods(self):
+        """
+        Devices can only upload and check their status
+        """
+        response = self.client.put(self.url, data='[21]', content_type='application/json',
+                                   HTTP_AUTHORIZATION=f'Device {self.key}')
+        self.assertEquals(response.status_code, 405)
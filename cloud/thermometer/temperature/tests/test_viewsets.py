@@ -1,11 +1,20 @@
+import datetime
+from decimal import Decimal
+import io
 import uuid
 
+import numpy
+
 from django.contrib.auth import get_user_model
-from django.db import transaction
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
 
+from temperature.blocks import compact
 from temperature.models import TemperatureReading, Thermometer
 from temperature.viewsets import TemperatureReadingViewset, ThermometerViewset
 
@@ -21,6 +30,11 @@ class TemperatureReadingViewsetTests(APITestCase):
         test_authenticated_get: Users should be able to see their own temperature readings
             Staff should be able to see all temperature readings
         test_authenticated_post: Viewset should not allow post requests
+        test_filters: Readings should be filterable by thermometer and time range
+        test_filters_use_index: Filtered lists should read the range from the
+            (thermometer, time_recorded, id) index
+        test_max_points: A thermometer's readings should be downsampled to ?max_points=
+        test_max_points_compacted: Downsampling should include readings compacted into blocks
     
     """
     def setUp(self):
@@ -194,6 +208,131 @@ class TemperatureReadingViewsetTests(APITestCase):
         self.assertEquals(str(response.data['detail']), 'Method "DELETE" not allowed.')
 
 
+    def test_filters(self):
+        """
+        Readings should be filterable by thermometer and time range, and invalid filters rejected
+        """
+        other = Thermometer.objects.create(display_name='other thermometer')
+        other.register(self.user)
+        now = timezone.now().replace(microsecond=0)
+        TemperatureReading.objects.bulk_create(
+            TemperatureReading(thermometer=thermometer, degrees_c=20 + i,
+                               time_recorded=now - datetime.timedelta(hours=i))
+            for thermometer in (self.thermometer, other)
+            for i in range(1, 6)
+        )
+        url = reverse('temperaturereading-list')
+
+        def degrees(params):
+            request = self.factory.get(url, params)
+            force_authenticate(request, user=self.user)
+            response = self.listview(request)
+            self.assertEquals(response.status_code, 200)
+            return [reading['degrees_c'] for reading in response.data['results']]
+
+        self.assertEquals(len(degrees({'thermometer': other.pk})), 5)
+        self.assertEquals(
+            degrees({'thermometer': other.pk,
+                     'since': (now - datetime.timedelta(hours=4)).isoformat(),
+                     'until': (now - datetime.timedelta(hours=1)).isoformat()}),
+            ['22.000000', '23.000000', '24.000000']
+        )
+        self.assertEquals(
+            len(degrees({'until': (now - datetime.timedelta(minutes=150)).isoformat()})), 6
+        )
+
+        for params in ({'thermometer': 'tank'}, {'since': 'yesterday'},
+                       {'since': now.isoformat(), 'until': now.isoformat()}):
+            request = self.factory.get(url, params)
+            force_authenticate(request, user=self.user)
+            self.assertEquals(self.listview(request).status_code, 400)
+
+    def test_filters_use_index(self):
+        """
+        Filtering by thermometer and time range should read only that range of the
+        (thermometer, time_recorded, id) index
+        """
+        now = timezone.now()
+        view = TemperatureReadingViewset(action_map={'get': 'list'}, format_kwarg=None)
+        view.request = view.initialize_request(self.factory.get(
+            reverse('temperaturereading-list'),
+            {'thermometer': self.thermometer.pk,
+             'since': (now - datetime.timedelta(hours=6)).isoformat(),
+             'until': now.isoformat()}
+        ))
+        view.request.user = self.user
+        plan = view.filter_queryset(view.get_queryset())[:10].explain()
+        self.assertIn('temperature_reading_time', plan)
+        if connection.vendor == 'sqlite':
+            self.assertIn('thermometer_id=? AND time_recorded>? AND time_recorded<?', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+    def test_max_points(self):
+        """
+        A thermometer's readings over a range should be downsampled to ?max_points= readings,
+        oldest first, and downsampling without a thermometer rejected
+        """
+        now = timezone.now()
+        TemperatureReading.objects.bulk_create(
+            TemperatureReading(thermometer=self.thermometer, degrees_c=30 if i == 500 else 25,
+                               time_recorded=now - datetime.timedelta(hours=2, seconds=10 * i))
+            for i in range(1000)
+        )
+        url = reverse('temperaturereading-list')
+        request = self.factory.get(url, {'thermometer': self.thermometer.pk, 'max_points': 50,
+                                         'until': (now - datetime.timedelta(hours=1)).isoformat()})
+        force_authenticate(request, user=self.user)
+        response = self.listview(request)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['count'], 1000)
+        results = response.data['results']
+        self.assertEquals(len(results), 50)
+        self.assertEquals(
+            [parse_datetime(reading['time_recorded']) for reading in results[::49]],
+            [now - datetime.timedelta(hours=2, seconds=9990), now - datetime.timedelta(hours=2)]
+        )
+        self.assertIn('30.000000', [reading['degrees_c'] for reading in results])
+
+        for params in ({'max_points': 50}, {'thermometer': self.thermometer.pk, 'max_points': 2},
+                       {'thermometer': self.thermometer.pk, 'max_points': 10 ** 6}):
+            request = self.factory.get(url, params)
+            force_authenticate(request, user=self.user)
+            self.assertEquals(self.listview(request).status_code, 400)
+
+    def test_max_points_compacted(self):
+        """
+        Readings compacted into blocks should be downsampled along with those still in the
+        reading table, and other users' thermometers should have none
+        """
+        midnight = (timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) -
+                    datetime.timedelta(days=1))
+        until = midnight + datetime.timedelta(hours=1)
+        TemperatureReading.objects.bulk_create(
+            TemperatureReading(thermometer=self.thermometer, degrees_c=30 if i == 400 else 25,
+                               time_recorded=until - datetime.timedelta(minutes=i + 1))
+            for i in range(600)
+        )
+        # The spike is in the day before midnight, which is compacted; the hour after isn't
+        compact(self.thermometer, midnight)
+        self.assertEquals(self.thermometer.temperatures.filter(time_recorded__lt=until).count(),
+                          60)
+
+        url = reverse('temperaturereading-list')
+        params = {'thermometer': self.thermometer.pk, 'max_points': 50, 'until': until.isoformat()}
+        request = self.factory.get(url, params)
+        force_authenticate(request, user=self.user)
+        response = self.listview(request)
+        self.assertEquals(response.data['count'], 600)
+        self.assertEquals(len(response.data['results']), 50)
+        self.assertIn('30.000000', [reading['degrees_c'] for reading in response.data['results']])
+
+        other = get_user_model().objects.create_user(username='other', password='pass')
+        request = self.factory.get(url, params)
+        force_authenticate(request, user=other)
+        self.assertEquals(self.listview(request).data, {'count': 0, 'results': []})
+
+
 class ThermometerViewsetTests(APITestCase):
     """Tests for Thermometer Viewset
 
@@ -613,3 +752,343 @@ class ThermometerViewsetTests(APITestCase):
             self.fail("Query should fail, as oject should no longer exist")
         except Thermometer.DoesNotExist as dne:
             self.assertEquals(str(dne), "Thermometer matching query does not exist.")
+
+
+class ThermometerReadingsTests(APITestCase):
+    """Tests for the bulk readings endpoint on Thermometer Viewset
+
+    Methods:
+        setUp: Create test data
+        tearDown: Empty test database
+        test_post_batch: A valid batch should be written with one insert and return 201
+        test_post_invalid_batch: Invalid, empty, or oversized batches should return 400 and
+            write nothing
+        test_post_other_users_thermometer: Users should not be able to post readings to
+            thermometers they don't own
+        test_post_retried_batch: Posting the same sequenced batch twice should store it once
+        test_post_merged_batch: Readings merged by the deadband should not be counted as created
+        test_post_timestamped_batch: Readings should keep device timestamps within the clock
+            window
+        test_device_key: Owners should be able to generate device keys
+        test_latest_reading: Thermometers should show their latest reading and reading count
+        test_summary: Thermometers should not include their readings unless asked to
+        test_list_readings: Thermometers' readings should be paginated by cursor
+        test_history: Owners should be able to read a range of readings
+        test_stats: Owners should be able to read per-bucket statistics in their time zone
+        test_export: Owners should be able to download a range of readings as NumPy arrays
+    """
+
+    def setUp(self):
+        """
+        Create test data
+        """
+        self.user = get_user_model().objects.create_user(
+            username='owner',
+            password='pass',
+            email='owner@e.mail'
+        )
+        self.therm = Thermometer.objects.create(display_name='tank')
+        self.therm.register(self.user)
+        self.factory = APIRequestFactory()
+        self.view = ThermometerViewset.as_view({'post': 'readings'})
+        self.url = reverse('thermometer-readings', args=[self.therm.pk])
+
+    def tearDown(self):
+        """
+        Empty test database
+        """
+        with transaction.atomic():
+            for user in get_user_model().objects.all():
+                user.delete()
+
+        self.assertEquals(len(Thermometer.objects.all()), 0)
+        self.assertEquals(len(TemperatureReading.objects.all()), 0)
+
+    def post(self, data, user=None):
+        request = self.factory.post(self.url, data=data, format='json')
+        force_authenticate(request, user=user or self.user)
+        return self.view(request, pk=self.therm.pk)
+
+    def test_post_batch(self):
+        """
+        A valid batch should be stored with a single insert
+        """
+        data = {'readings': [{'degrees_c': 20 + i / 10} for i in range(100)]}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(data)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT')
+                   and 'INTO "temperature_temperaturereading"' in q['sql']]
+        self.assertEquals(len(inserts), 1)
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.data, {'created': 100})
+        self.assertEquals(self.therm.temperatures.count(), 100)
+
+    def test_post_invalid_batch(self):
+        """
+        Invalid batches should be rejected as a whole
+        """
+        datasets = [
+            {'readings': []},
+            {'readings': [{'degrees_c': 21}, {'degrees_c': 'warm'}]},
+            {'readings': [{'degrees_c': 123456789012334567}]},
+            {'degrees_c': 21},
+        ]
+        for data in datasets:
+            response = self.post(data)
+            self.assertEquals(response.status_code, 400)
+
+        with self.settings(TEMPERATURE_MAX_BATCH_SIZE=3):
+            response = self.post({'readings': [{'degrees_c': 21}] * 4})
+            self.assertEquals(response.status_code, 400)
+            self.assertIn('readings', response.data)
+
+        self.assertEquals(self.therm.temperatures.count(), 0)
+
+    def test_post_retried_batch(self):
+        """
+        Retried uploads should not store duplicate readings
+        """
+        data = {'readings': [{'degrees_c': 21, 'sequence': i} for i in range(50)]}
+        response = self.post(data)
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.data, {'created': 50})
+        response = self.post(data)
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.data, {'created': 0})
+        self.assertEquals(self.therm.temperatures.count(), 50)
+
+        data = {'readings': [{'degrees_c': 22, 'sequence': i} for i in range(40, 60)]}
+        response = self.post(data)
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.data, {'created': 10})
+        self.assertEquals(self.therm.temperatures.count(), 60)
+        self.assertEquals(self.therm.temperatures.filter(degrees_c=22).count(), 10)
+
+        # readings without a sequence number are never treated as duplicates
+        data = {'readings': [{'degrees_c': 21}]}
+        self.post(data)
+        self.post(data)
+        self.assertEquals(self.therm.temperatures.count(), 62)
+
+        data = {'readings': [{'degrees_c': 21, 'sequence': -1}]}
+        self.assertEquals(self.post(data).status_code, 400)
+
+    def test_post_merged_batch(self):
+        """
+        Only the readings stored after the deadband merges should be counted as created
+        """
+        self.therm.deadband_c = Decimal('0.1')
+        self.therm.deadband_seconds = 60
+        self.therm.save()
+        data = {'readings': [{'degrees_c': 21, 'sequence': 0}, {'degrees_c': 21, 'sequence': 1},
+                             {'degrees_c': 25, 'sequence': 2}]}
+        response = self.post(data)
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.data, {'created': 2})
+        self.assertEquals(self.therm.temperatures.count(), 2)
+
+    def test_post_timestamped_batch(self):
+        """
+        Device timestamps should be stored, and rejected when outside the clock window
+        """
+        taken = timezone.now() - datetime.timedelta(days=2)
+        data = {'readings': [
+            {'degrees_c': 21, 'time_recorded': taken + datetime.timedelta(minutes=i)}
+            for i in range(10)
+        ]}
+        self.assertEquals(self.post(data).status_code, 201)
+        first = self.therm.temperatures.order_by('time_recorded').first()
+        self.assertEquals(first.time_recorded, taken)
+
+        data = {'readings': [
+            {'degrees_c': 21, 'time_recorded': timezone.now() + datetime.timedelta(days=1)}
+        ]}
+        response = self.post(data)
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('time_recorded', response.data['readings'][0])
+        self.assertEquals(self.therm.temperatures.count(), 10)
+
+    def test_post_other_users_thermometer(self):
+        """
+        Posting to another user's thermometer should 404
+        """
+        other = get_user_model().objects.create_user(
+            username='other',
+            password='pass',
+            email='other@e.mail'
+        )
+        response = self.post({'readings': [{'degrees_c': 21}]}, user=other)
+        self.assertEquals(response.status_code, 404)
+        self.assertEquals(self.therm.temperatures.count(), 0)
+
+    def test_device_key(self):
+        """
+        Owners should be able to generate a device key for their thermometer
+        """
+        view = ThermometerViewset.as_view({'post': 'device_key'})
+        url = reverse('thermometer-device-key', args=[self.therm.pk])
+        request = self.factory.post(url)
+        force_authenticate(request, user=self.user)
+        response = view(request, pk=self.therm.pk)
+        self.assertEquals(response.status_code, 201)
+        self.therm.refresh_from_db()
+        self.assertTrue(self.therm.check_device_key(response.data['device_key']))
+
+    def test_latest_reading(self):
+        """
+        Thermometers should show their latest reading and reading count
+        """
+        now = timezone.now().replace(microsecond=0)
+        self.post({'readings': [
+            {'degrees_c': 20 + i, 'time_recorded': now - datetime.timedelta(minutes=i)}
+            for i in range(3)
+        ]})
+        view = ThermometerViewset.as_view({'get': 'list'})
+        request = self.factory.get(reverse('thermometer-list'))
+        force_authenticate(request, user=self.user)
+        thermometer, = view(request).data['results']
+        self.assertEquals(thermometer['latest_degrees_c'], '20.000')
+        self.assertEquals(thermometer['reading_count'], 3)
+        self.assertEquals(parse_datetime(thermometer['latest_time_recorded']), now)
+
+    def test_summary(self):
+        """
+        Thermometers should be summarized without reading the readings table, unless the
+        readings are expanded
+        """
+        self.post({'readings': [{'degrees_c': 20 + i / 10} for i in range(25)]})
+        view = ThermometerViewset.as_view({'get': 'list'})
+        url = reverse('thermometer-list')
+
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            thermometer, = view(request).data['results']
+        self.assertFalse([q for q in queries if '"temperature_temperaturereading"' in q['sql']])
+        self.assertNotIn('temperatures', thermometer)
+        self.assertEquals(thermometer['reading_count'], 25)
+        self.assertTrue(thermometer['readings'].endswith(
+            reverse('thermometer-readings', args=[self.therm.pk])))
+
+        request = self.factory.get(url, {'expand': 'temperatures'})
+        force_authenticate(request, user=self.user)
+        thermometer, = view(request).data['results']
+        self.assertEquals(len(thermometer['temperatures']), 25)
+
+    def test_list_readings(self):
+        """
+        The readings sub-resource should page through a thermometer's readings, newest first
+        """
+        now = timezone.now()
+        self.post({'readings': [
+            {'degrees_c': 20 + i / 10, 'time_recorded': now - datetime.timedelta(minutes=i)}
+            for i in range(25)
+        ]})
+        view = ThermometerViewset.as_view({'get': 'list_readings'})
+        request = self.factory.get(self.url)
+        force_authenticate(request, user=self.user)
+        response = view(request, pk=self.therm.pk)
+        self.assertIsNone(response.data['previous'])
+
+        request = self.factory.get(response.data['next'])
+        force_authenticate(request, user=self.user)
+        response = view(request, pk=self.therm.pk)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([reading['degrees_c'] for reading in response.data['results']],
+                          [f'{21 + i / 10:.6f}' for i in range(10)])
+        self.assertIsNotNone(response.data['previous'])
+
+        other = get_user_model().objects.create_user(username='other', password='pass')
+        request = self.factory.get(self.url)
+        force_authenticate(request, user=other)
+        self.assertEquals(view(request, pk=self.therm.pk).status_code, 404)
+
+    def test_history(self):
+        """
+        Owners should be able to read a range of readings, and bad ranges should be rejected
+        """
+        now = timezone.now()
+        self.post({'readings': [
+            {'degrees_c': 20 + i, 'time_recorded': now - datetime.timedelta(minutes=i)}
+            for i in range(3)
+        ]})
+        view = ThermometerViewset.as_view({'get': 'history'})
+        url = reverse('thermometer-history', args=[self.therm.pk])
+
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        response = view(request, pk=self.therm.pk)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['resolution'], 'minute')
+        self.assertEquals(sum(point['count'] for point in response.data['points']), 3)
+
+        since = (now - datetime.timedelta(minutes=5)).isoformat()
+        request = self.factory.get(url, {'since': since})
+        force_authenticate(request, user=self.user)
+        response = view(request, pk=self.therm.pk)
+        self.assertEquals(response.data['resolution'], 'raw')
+        self.assertEquals([point['degrees_max'] for point in response.data['points']],
+                          ['22.000', '21.000', '20.000'])
+
+        request = self.factory.get(url, {'since': now.isoformat(), 'until': since})
+        force_authenticate(request, user=self.user)
+        self.assertEquals(view(request, pk=self.therm.pk).status_code, 400)
+
+    def test_stats(self):
+        """
+        Owners should be able to read per-bucket statistics, bucketed and timed in their time
+        zone, and bad buckets and ranges should be rejected
+        """
+        self.user.profile.time_zone = 'Asia/Kolkata'
+        self.user.profile.save()
+        now = timezone.now()
+        self.post({'readings': [
+            {'degrees_c': 20 + i, 'time_recorded': now - datetime.timedelta(minutes=i)}
+            for i in range(3)
+        ]})
+        view = ThermometerViewset.as_view({'get': 'stats'})
+        url = reverse('thermometer-stats', args=[self.therm.pk])
+
+        request = self.factory.get(url, {'bucket': '1d'})
+        force_authenticate(request, user=self.user)
+        response = view(request, pk=self.therm.pk)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals((response.data['time_zone'], response.data['source']),
+                          ('Asia/Kolkata', 'minute'))
+        self.assertEquals(sum(point['count'] for point in response.data['points']), 3)
+        self.assertEquals(max(point['degrees_max'] for point in response.data['points']),
+                          '22.000')
+        self.assertTrue(all(point['time'].endswith('T00:00:00+05:30')
+                            for point in response.data['points']))
+
+        since = (now - datetime.timedelta(days=30)).isoformat()
+        for params in ({'bucket': '7m'}, {'bucket': '1m', 'since': since}):
+            request = self.factory.get(url, params)
+            force_authenticate(request, user=self.user)
+            self.assertEquals(view(request, pk=self.therm.pk).status_code, 400)
+
+    def test_export(self):
+        """
+        Owners should be able to download a range of readings as an .npz archive of columns, and
+        overlong ranges should be rejected
+        """
+        now = timezone.now().replace(microsecond=0)
+        self.post({'readings': [
+            {'degrees_c': 20 + i, 'time_recorded': now - datetime.timedelta(minutes=i)}
+            for i in range(3)
+        ]})
+        view = ThermometerViewset.as_view({'get': 'export'})
+        url = reverse('thermometer-export', args=[self.therm.pk])
+
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        response = view(request, pk=self.therm.pk)
+        self.assertEquals(response.status_code, 200)
+        arrays = numpy.load(io.BytesIO(response.content))
+        self.assertEquals(arrays['degrees_c'].dtype, numpy.dtype('<f4'))
+        self.assertEquals(arrays['degrees_c'].tolist(), [22, 21, 20])
+        self.assertEquals(arrays['time_recorded'][-1], int(now.timestamp()) * 10 ** 6)
+
+        request = self.factory.get(url, {'since': (now - datetime.timedelta(days=400)).isoformat()})
+        force_authenticate(request, user=self.user)
+        self.assertEquals(view(request, pk=self.therm.pk).status_code, 400)
@@ -0,0 +1,102 @@
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .exceptions import IngestBufferFull, ReadingUploadError
+from .ingest import authenticate_device, parse_readings, record_readings
+
+DEVICE_AUTH_SCHEME = 'Device'
+RETRY_AFTER = 1
+
+
+def get_device_key(authorization):
+    """
+    Return the key from an Authorization header value, or None if it isn't a device key.
+    """
+    scheme, _, key = (authorization or '').partition(' ')
+    if scheme != DEVICE_AUTH_SCHEME:
+        return None
+    return key.strip()
+
+
+def device_upload(therm_id, key, content_type, body):
+    """Authenticate a device, parse its upload and record the readings.
+
+    Shared by the WSGI view and the ASGI ingest application, so both answer identically.
+
+    Returns:
+        tuple of (http status, response data or None, extra response headers)
+    """
+    thermometer = authenticate_device(therm_id, key)
+    if thermometer is None:
+        return 401, {'detail': 'Invalid device credentials.'}, {}
+
+    try:
+        readings = parse_readings(content_type, body)
+    except ReadingUploadError as error:
+        return 400, {'detail': str(error)}, {}
+
+    try:
+        record_readings(thermometer, readings)
+    except IngestBufferFull as error:
+        return 503, {'detail': str(error)}, {'Retry-After': str(RETRY_AFTER)}
+    return 204, None, {}
+
+
+def device_status(therm_id, key):
+    """Report the highest sequence number stored for a device, or merged into a stored reading.
+
+    Devices that buffer readings use this to find out which readings the server already has, so
+    they can discard them.
+
+    Returns:
+        tuple of (http status, response data or None, extra response headers)
+    """
+    thermometer = authenticate_device(therm_id, key)
+    if thermometer is None:
+        return 401, {'detail': 'Invalid device credentials.'}, {}
+
+    # The deadband merges readings into the newest stored one, so the highest merged sequence is
+    # either on the newest reading or below the highest stored sequence. Both are index lookups.
+    readings = thermometer.temperatures.values_list('sequence', 'merged_sequence')
+    rows = (readings.filter(sequence__isnull=False).order_by('-sequence').first(),
+            readings.order_by('-time_recorded').first())
+    sequences = [number for row in rows if row is not None for number in row if number is not None]
+    return 200, {'sequence': max(sequences, default=None)}, {}
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class DeviceIngestView(View):
+    """Lean upload endpoint for thermometers to post their own readings.
+
+    Bypasses the REST framework entirely: no user lookup, no permission classes and no
+    hyperlinked response. Devices authenticate with their therm_id (in the url) and the key
+    generated by Thermometer.set_device_key, sent as `Authorization: Device <key>`. Readings are
+    either a JSON array of temperatures or, with the content type codecs.CONTENT_TYPE, a packed
+    batch of raw DS18B20 values.
+
+    Methods:
+        get: Return the highest sequence number stored for the device
+        post: Authenticate the device, parse the payload and store the readings. Returns 204 on
+            success, 401 if the device can't be authenticated, 400 if the payload is invalid and
+            503 if the ingestion buffer is full.
+    """
+    http_method_names = ['get', 'post']
+
+    def get(self, request, therm_id):
+        key = get_device_key(request.META.get('HTTP_AUTHORIZATION'))
+        return self.respond(*device_status(therm_id, key))
+
+    def post(self, request, therm_id):
+        key = get_device_key(request.META.get('HTTP_AUTHORIZATION'))
+        return self.respond(*device_upload(therm_id, key, request.content_type, request.body))
+
+    def respond(self, status, data, headers):
+        if data is None:
+            response = HttpResponse(status=status)
+        else:
+            response = JsonResponse(data, status=status)
+        for header, value in headers.items():
+            response[header] = value
+        return response
@@ -1,14 +1,35 @@
-from rest_framework import viewsets, mixins
+import numpy
 
+from django.http import HttpResponse
+from django.utils import timezone
+
+from rest_framework import viewsets, mixins, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from thermometer.replicas import ReplicaReadMixin
 from utils.permissions import IsOwnerOrStaff, IsSelfOrAdmin, IsUserOrReadOnly
 
+from .blocks import MICROSECOND
+from .codecs import EPOCH
+from .exceptions import IngestBufferFull
+from .downsample import lttb
+from .export import READING_DTYPE, export_npz, reading_array, to_arrays
+from .ingest import record_readings
+from .rollups import from_millidegrees, history
 from .models import Thermometer, TemperatureReading
+from .pagination import ReadingCursorPagination
 from .permissions import IsThermometerOwnerOrStaff
-from .serializers import ThermometerSerializer, TemperatureReadingSerializer
+from .serializers import (
+    ExportQuerySerializer, HistoryPointSerializer, HistoryQuerySerializer, ReadingFilterSerializer,
+    ReadingPointSerializer, StatsQuerySerializer, ThermometerSerializer,
+    TemperatureReadingSerializer, TemperatureReadingBatchSerializer, expansions
+)
+from .stats import BUCKETS, owner_time_zone, stats
 
 
-class ThermometerViewset(viewsets.ModelViewSet):
-    """Viewset for Thermometers
+class ThermometerViewset(ReplicaReadMixin, viewsets.ModelViewSet):
+    """Viewset for Thermometers. Safe requests read from the read replica, if there is one.
 
     Fields:
         serializer_class: Serializer used to convert thermometer to JSON
@@ -16,8 +37,16 @@ class ThermometerViewset(viewsets.ModelViewSet):
 
     Methods:
         get_queryset: Return all records if user is staff, otherwise the records associated with the
-            current user
+            current user. Readings are prefetched newest first only when they are expanded.
         create: Create a new thermometer record and register it to the currently authenticated user
+        readings: Record a batch of temperature readings for a thermometer with a single insert
+        list_readings: Page through a thermometer's raw readings, newest first. Readings
+            compacted into blocks aren't listed.
+        device_key: Generate a new key for the thermometer to authenticate its own uploads with
+        history: Return the thermometer's readings over a time range, from rollups when the range
+            is long
+        stats: Return per-bucket statistics of the thermometer's readings over a time range
+        export: Return the thermometer's readings over a time range as NumPy arrays
     """
     serializer_class = ThermometerSerializer
     permission_classes = (IsOwnerOrStaff,)
@@ -25,11 +54,17 @@ class ThermometerViewset(viewsets.ModelViewSet):
     def get_queryset(self):
         """
         If current user is staff, return all thermometers. Otherwise return the thermometers owned
-        ther current user.
+        ther current user. When `?expand=temperatures` asks for every reading, readings are
+        fetched in one query for the whole page, walking the (thermometer, time_recorded) index,
+        instead of one query per thermometer.
         """
         if self.request.user.is_staff:
-            return Thermometer.objects.all()
-        return Thermometer.objects.filter(owner=self.request.user)
+            queryset = Thermometer.objects.all()
+        else:
+            queryset = Thermometer.objects.filter(owner=self.request.user)
+        if 'temperatures' in expansions(self.request):
+            queryset = queryset.prefetch_related('temperatures')
+        return queryset
 
     def perform_create(self, serializer):
         """
@@ -38,27 +73,207 @@ class ThermometerViewset(viewsets.ModelViewSet):
         thermometer = serializer.save()
         thermometer.register(self.request.user)
 
+    @action(detail=True, methods=['post'])
+    def readings(self, request, pk=None):
+        """
+        Validate a whole batch of readings, then write it with one multi-row insert in one
+        transaction. Readings with a sequence number already stored are skipped, and the 201
+        response counts the readings actually stored as created. When the ingestion buffer is
+        enabled the batch is queued instead, and the response is 202 with the number of readings
+        accepted, or 503 if the buffer is full.
+        """
+        thermometer = self.get_object()
+        serializer = TemperatureReadingBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        readings = serializer.validated_data['readings']
+        try:
+            created = record_readings(thermometer, readings)
+        except IngestBufferFull as error:
+            return Response({'detail': str(error)},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': '1'})
+        if created is None:
+            return Response({'accepted': len(readings)}, status=status.HTTP_202_ACCEPTED)
+        return Response({'created': len(created)}, status=status.HTTP_201_CREATED)
+
+    @readings.mapping.get
+    def list_readings(self, request, pk=None):
+        """
+        Page through the thermometer's readings, newest first, without loading the rest of them.
+        Pages are cursor-based, like the readings list. Only readings still in the reading
+        table are listed: once the compactreadings command has packed a day into a block,
+        after TEMPERATURE_COLD_STORAGE_DAYS, its readings are read through history, stats,
+        export and the readings list's ?max_points= instead.
+        """
+        thermometer = self.get_object()
+        paginator = ReadingCursorPagination()
+        page = paginator.paginate_queryset(thermometer.temperatures.all(), request, view=self)
+        serializer = TemperatureReadingSerializer(page, many=True,
+                                                  context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def device_key(self, request, pk=None):
+        """
+        Generate a new device key for the thermometer. The key is only ever returned here, so it
+        must be copied onto the device straight away.
+        """
+        thermometer = self.get_object()
+        return Response({'device_key': thermometer.set_device_key()},
+                        status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Return the thermometer's readings from `since` up to `until`. Short ranges list every
+        reading; longer ones are summarized per minute, hour or day from the rollups.
+        """
+        thermometer = self.get_object()
+        query = HistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        since, until = query.validated_data['since'], query.validated_data['until']
+        resolution, points = history(thermometer, since, until)
+        return Response({
+            'resolution': resolution,
+            'since': since,
+            'until': until,
+            'points': HistoryPointSerializer(points, many=True).data,
+        })
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """
+        Return the count, min, max and mean of the thermometer's readings per `bucket` from
+        `since` up to `until`, in buckets local to the owner's time zone. Times are given in
+        that time zone too.
+        """
+        thermometer = self.get_object()
+        query = StatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        since, until = query.validated_data['since'], query.validated_data['until']
+        bucket = query.validated_data['bucket']
+        tz = owner_time_zone(thermometer)
+        source, points = stats(thermometer, since, until, BUCKETS[bucket], tz)
+        with timezone.override(tz):
+            return Response({
+                'bucket': bucket,
+                'time_zone': str(tz),
+                'source': source,
+                'since': timezone.localtime(since, tz),
+                'until': timezone.localtime(until, tz),
+                'points': HistoryPointSerializer(points, many=True).data,
+            })
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Return every reading from `since` up to `until` as an .npz archive of time_recorded
+        (int64 microseconds since the unix epoch) and degrees_c (float32) arrays, for loading
+        with numpy.load instead of paging through the reading list.
+        """
+        thermometer = self.get_object()
+        query = ExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        response = HttpResponse(
+            export_npz(thermometer, query.validated_data['since'], query.validated_data['until']),
+            content_type='application/octet-stream'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{thermometer.therm_id}.npz"'
+        return response
+
 
-class TemperatureReadingViewset(mixins.ListModelMixin,
+class TemperatureReadingViewset(ReplicaReadMixin,
+                                mixins.ListModelMixin,
                                 mixins.RetrieveModelMixin,
                                 viewsets.GenericViewSet):
-    """Viewset for Temperature Readings
+    """Viewset for Temperature Readings. Requests read from the read replica, if there is one.
+
+    Readings are individual rows of the reading table, so readings the compactreadings command
+    has packed into blocks, those older than TEMPERATURE_COLD_STORAGE_DAYS, are no longer
+    listed or retrievable here. Downsampling with ?max_points= decodes them, as do the
+    thermometer history, stats and export endpoints.
 
     Fields:
         serializer_class: Serializer used to convert temperature readings to JSON
         permission_classes: Permission classes to be applied ot incoming requests
+        pagination_class: Cursor pagination keyed on (time_recorded, id), so every page costs the
+            same however far back it is. An owner's list without ?thermometer= costs one index
+            seek per thermometer they own for each page.
 
     Methods:
         get_queryset: Queryset for the view should include records owned by 
+        filter_queryset: Narrow the list by ?thermometer=, ?since= and ?until=
+        get_page_thermometers: The owner's thermometers, for the paginator to page each one's
+            readings from its own index
+        list: Page through readings, or downsample one thermometer's for a chart with
+            ?max_points=
     """
     serializer_class = TemperatureReadingSerializer
     permission_classes = (IsThermometerOwnerOrStaff,)
+    pagination_class = ReadingCursorPagination
 
     def get_queryset(self):
         """
         Queryset should include only thermometers related to current user. If user is staff,
-        they can see all records
+        they can see all records. Readings come newest first, and their thermometers are joined
+        in rather than fetched once per reading for the display name.
         """
+        queryset = TemperatureReading.objects.select_related('thermometer')
         if self.request.user.is_staff:
-            return TemperatureReading.objects.all()
-        return TemperatureReading.objects.filter(thermometer__owner=self.request.user)
+            return queryset
+        return queryset.filter(thermometer__owner=self.request.user)
+
+    def filter_queryset(self, queryset):
+        """
+        Narrow the list to one thermometer and a time range, in the database, when the request
+        asks for them. Invalid filters are a 400 rather than being ignored.
+        """
+        queryset = super().filter_queryset(queryset)
+        if self.action != 'list':
+            return queryset
+        self.filters = ReadingFilterSerializer(data=self.request.query_params)
+        self.filters.is_valid(raise_exception=True)
+        return self.filters.filter(queryset)
+
+    def get_page_thermometers(self):
+        """
+        Return the ids of the current user's thermometers when their readings are listed without
+        ?thermometer=, or None otherwise. Without these the database would sort all of the
+        user's readings for every page. Staff lists walk the (time_recorded, id) index instead.
+        """
+        if self.request.user.is_staff or 'thermometer' in self.filters.validated_data:
+            return None
+        return list(
+            Thermometer.objects.filter(owner=self.request.user).values_list('pk', flat=True)
+        )
+
+    def list(self, request, *args, **kwargs):
+        """
+        With ?max_points=, return the filtered range's readings downsampled by LTTB to at most
+        that many, oldest first and unpaginated, with the count of readings in the range.
+        Readings compacted into blocks are included, and the range is read into arrays rather
+        than Python objects. Thermometers the user can't see have no readings. Otherwise page
+        through the readings as usual.
+        """
+        if 'max_points' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        filters = ReadingFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        data = filters.validated_data
+        thermometers = Thermometer.objects.all()
+        if not request.user.is_staff:
+            thermometers = thermometers.filter(owner=request.user)
+        thermometer = thermometers.filter(pk=data['thermometer']).first()
+        readings = numpy.empty(0, READING_DTYPE)
+        if thermometer is not None:
+            readings = reading_array(thermometer, data['since'], data['until'])
+        kept = readings[lttb(*to_arrays(readings), data['max_points'])]
+        points = [
+            {'time_recorded': EPOCH + time_recorded * MICROSECOND,
+             'degrees_c': from_millidegrees(millidegrees)}
+            for time_recorded, millidegrees in kept.tolist()
+        ]
+        return Response({
+            'count': len(readings),
+            'results': ReadingPointSerializer(points, many=True).data,
+        })
@@ -1,13 +1,14 @@
 from rest_framework import viewsets
 
+from thermometer.replicas import ReplicaReadMixin
 from utils.permissions import IsUserOrReadOnly
 
 from .models import Testimonial
 from .serializers import TestimonialSerializer
 
 
-class TestimonialViewset(viewsets.ModelViewSet):
-    """Viewset for Testimonials
+class TestimonialViewset(ReplicaReadMixin, viewsets.ModelViewSet):
+    """Viewset for Testimonials. Safe requests read from the read replica, if there is one.
 
     Fields:
         serializer_class: Serializer used to convert testimonials to JSON
@@ -0,0 +1,21 @@
+"""
+ASGI config for thermometer project.
+
+It exposes the ASGI callable as a module-level variable named ``application``. Device uploads to
+/ingest/<therm_id>/ are served on the event loop; every other request goes to Django.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'thermometer.settings')
+
+django_application = get_asgi_application()
+
+from temperature.asgi import DeviceIngestApplication  # noqa: E402 needs apps to be loaded
+
+application = DeviceIngestApplication(django_application)
@@ -0,0 +1,150 @@
+"""Database profiles.
+
+settings.DATABASES is built from one of these profiles, picked by the THERMOMETER_DATABASE
+environment variable:
+
+    sqlite: The SQLite file in BASE_DIR, tuned for many small writes alongside reads. The
+        write-ahead log lets readers carry on while a batch of readings is written, instead of
+        every writer blocking every reader as in the default rollback journal.
+    postgres: PostgreSQL, configured from POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD,
+        POSTGRES_HOST and POSTGRES_PORT. Set THERMOMETER_PGBOUNCER when connecting through
+        PgBouncer in transaction pooling mode.
+
+Setting THERMOMETER_REPLICA adds a read replica of the same kind: the path of a copy of the
+SQLite file, or the host of a PostgreSQL standby. See thermometer.replicas for which reads go to
+it.
+
+Both keep connections open between requests for CONN_MAX_AGE seconds rather than connecting
+for every request. Besides Django's own settings, a profile can hold:
+
+    PRAGMAS: SQLite pragmas to set on every new connection
+    HEALTH_CHECKS: Check a persistent connection still works before each request reuses it,
+        so a connection dropped by the server or a pooler fails over to a new one instead of
+        failing the request
+
+The signal receivers that apply them are connected by connect_signals, when the temperature
+app is ready.
+"""
+import os
+
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Seconds to keep a connection open for reuse by later requests
+CONN_MAX_AGE = 600
+
+SQLITE_PRAGMAS = {
+    # Readers don't block the writer, or the writer readers
+    'journal_mode': 'WAL',
+    # With the write-ahead log, only a power loss can lose the last commits, never corrupt
+    'synchronous': 'NORMAL',
+    # Read the database through 256MB of memory-mapped I/O instead of read() calls
+    'mmap_size': 256 * 1024 * 1024,
+    # 64MB page cache per connection. Negative values are in KiB rather than pages.
+    'cache_size': -64 * 1024,
+    # Wait up to five seconds for another connection's write lock instead of failing
+    'busy_timeout': 5000,
+}
+
+
+def sqlite_profile(name, pragmas=SQLITE_PRAGMAS, conn_max_age=CONN_MAX_AGE):
+    """
+    Return a DATABASES entry for the SQLite file `name`.
+    """
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': conn_max_age,
+        'PRAGMAS': dict(pragmas),
+        'HEALTH_CHECKS': False,
+    }
+
+
+def postgres_profile(environ, conn_max_age=CONN_MAX_AGE):
+    """
+    Return a DATABASES entry for PostgreSQL, configured from environment variables.
+
+    Django keeps one connection per worker thread, so the pool is the set of workers'
+    persistent connections. To share fewer server connections between more workers, connect
+    through PgBouncer, which can't keep server-side cursors open across transactions.
+    """
+    pgbouncer = bool(environ.get('THERMOMETER_PGBOUNCER'))
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('POSTGRES_DB', 'thermometer'),
+        'USER': environ.get('POSTGRES_USER', 'thermometer'),
+        'PASSWORD': environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': conn_max_age,
+        'HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': pgbouncer,
+        'OPTIONS': {
+            'connect_timeout': 5,
+            'application_name': 'thermometer',
+            # Notice dead connections within about two minutes instead of hours
+            'keepalives': 1,
+            'keepalives_idle': 60,
+            'keepalives_interval': 10,
+            'keepalives_count': 6,
+        },
+    }
+
+
+def database_profile(profile, base_dir, environ):
+    """
+    Return the DATABASES entry for a named profile.
+    """
+    if profile == 'sqlite':
+        return sqlite_profile(environ.get('SQLITE_PATH', os.path.join(base_dir, 'db.sqlite3')))
+    if profile == 'postgres':
+        return postgres_profile(environ)
+    raise ValueError(f'Unknown database profile {profile!r}, expected sqlite or postgres')
+
+
+def replica_profile(profile, environ):
+    """
+    Return the DATABASES entry for a read replica at THERMOMETER_REPLICA. Tests read the
+    primary in its place.
+    """
+    location = environ['THERMOMETER_REPLICA']
+    if profile == 'sqlite':
+        # The copy belongs to whatever replicates it, so don't change its journal or write to it
+        pragmas = {name: value for name, value in SQLITE_PRAGMAS.items() if name != 'journal_mode'}
+        replica = sqlite_profile(location, pragmas={**pragmas, 'query_only': 'ON'})
+    elif profile == 'postgres':
+        replica = {**postgres_profile(environ), 'HOST': location}
+    else:
+        raise ValueError(f'Unknown database profile {profile!r}, expected sqlite or postgres')
+    replica['TEST'] = {'MIRROR': 'default'}
+    return replica
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """
+    Set a SQLite connection's PRAGMAS as soon as it is opened.
+    """
+    pragmas = connection.settings_dict.get('PRAGMAS')
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def check_connections(**kwargs):
+    """
+    Close persistent connections that have stopped working, before a request uses them. Django
+    only notices once a query fails, which fails the request.
+    """
+    for connection in connections.all():
+        if (connection.settings_dict.get('HEALTH_CHECKS') and connection.connection is not None
+                and not connection.in_atomic_block and not connection.is_usable()):
+            connection.close()
+
+
+def connect_signals():
+    connection_created.connect(apply_pragmas, dispatch_uid='thermometer.database.apply_pragmas')
+    request_started.connect(check_connections,
+                            dispatch_uid='thermometer.database.check_connections')
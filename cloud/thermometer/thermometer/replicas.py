@@ -0,0 +1,96 @@
+"""Routing reads to a read replica.
+
+When a 'replica' database is configured, viewsets that use ReplicaReadMixin run the queries of
+GET, HEAD and OPTIONS requests against it, so dashboard and export reads don't compete with
+ingestion writes on the primary. Everything else, including authentication and every write,
+uses the primary.
+
+A replica lags behind the primary, so a user who has just changed something would not see the
+change if their next read went to the replica. Every unsafe request by a user pins that user's
+reads to the primary for settings.DATABASE_REPLICA_PIN_SECONDS. Pins are kept in the default
+cache, which has to be shared between server processes for them to apply across processes, so
+settings configure a database cache on the primary whenever a replica is configured. Reads of
+the cache table never go to the replica, where a pin written moments ago wouldn't be yet.
+"""
+import contextvars
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA = 'replica'
+# App label of the model Django's database cache backend reads its table through
+CACHE_APP_LABEL = 'django_cache'
+
+# Whether the current request's reads may go to the replica
+use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+def pin_key(user):
+    return f'replica-pin:{user.pk}'
+
+
+def pin_to_primary(user):
+    """
+    Send the user's reads to the primary for the next DATABASE_REPLICA_PIN_SECONDS.
+    """
+    cache.set(pin_key(user), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user):
+    return user.is_authenticated and cache.get(pin_key(user), False)
+
+
+class ReplicaRouter:
+    """Database router sending reads to the replica while use_replica is set. Writes are left to
+    Django, which sends them to the primary.
+
+    Methods:
+        db_for_read: The replica, if one is configured, the current request may use it, no
+            transaction is open on the primary and the model isn't the cache table. Otherwise
+            the primary.
+        allow_relation: Objects from the primary and replica are the same rows
+        allow_migrate: The replica gets its schema from the primary, never from migrations
+    """
+
+    def db_for_read(self, model, **hints):
+        if (use_replica.get() and REPLICA in connections.databases and
+                model._meta.app_label != CACHE_APP_LABEL and
+                not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return REPLICA
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """Viewset mixin reading from the replica for safe requests.
+
+    Requests are authenticated against the primary, so a token created moments ago still
+    works. Then, for safe methods from users who haven't written recently, the handler's reads
+    go to the replica. Unsafe requests pin their user to the primary.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = use_replica.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            use_replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            use_replica.set(not is_pinned_to_primary(request.user))
+        elif request.user.is_authenticated:
+            pin_to_primary(request.user)
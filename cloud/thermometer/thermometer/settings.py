@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import datetime
 import os
 
+from .database import database_profile, replica_profile
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -87,14 +90,32 @@ WSGI_APPLICATION = 'thermometer.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
+# The THERMOMETER_DATABASE environment variable picks the sqlite (default) or postgres profile.
+# See thermometer/database.py for the connection settings and pragmas each one uses.
+
+DATABASE_PROFILE = os.environ.get('THERMOMETER_DATABASE', 'sqlite')
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    'default': database_profile(DATABASE_PROFILE, BASE_DIR, os.environ),
 }
 
+# Read replica, used when THERMOMETER_REPLICA is set. Safe requests to the API's list and detail
+# viewsets read from it, except for users who made a change in the last
+# DATABASE_REPLICA_PIN_SECONDS seconds. See thermometer/replicas.py.
+# Those pins are kept in the default cache, which every server process has to share, so the
+# replica comes with a cache table on the primary. Create it with `manage.py createcachetable`.
+if os.environ.get('THERMOMETER_REPLICA'):
+    DATABASES['replica'] = replica_profile(DATABASE_PROFILE, os.environ)
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'thermometer_cache',
+        },
+    }
+
+DATABASE_ROUTERS = ['thermometer.replicas.ReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -160,3 +181,55 @@ REST_AUTH_SERIALIZERS = {
 }
 OLD_PASSWORD_FIELD_ENABLED = True
 LOGOUT_ON_PASSWORD_CHANGE = False
+
+# Temperature ingestion settings
+# Largest number of readings accepted in a single bulk upload
+TEMPERATURE_MAX_BATCH_SIZE = 5000
+
+# Largest page of readings clients can ask for with ?page_size=. Readings are paged by cursor,
+# so large pages deep into a thermometer's history cost the same as the first.
+TEMPERATURE_MAX_PAGE_SIZE = 5000
+
+# Write-behind buffer for uploaded readings. When enabled, uploads are queued in memory and
+# written in batches every FLUSH_INTERVAL_MS milliseconds or FLUSH_ROWS readings, whichever
+# comes first. Uploads are refused with 503 once MAX_ROWS readings are waiting.
+TEMPERATURE_INGEST_BUFFER = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL_MS': 250,
+    'FLUSH_ROWS': 1000,
+    'MAX_ROWS': 50000,
+}
+
+# Devices may upload readings with their own timestamps. Timestamps more than
+# TEMPERATURE_CLOCK_SKEW ahead of the server clock, or older than TEMPERATURE_MAX_READING_AGE,
+# are rejected.
+TEMPERATURE_CLOCK_SKEW = datetime.timedelta(minutes=5)
+TEMPERATURE_MAX_READING_AGE = datetime.timedelta(days=7)
+
+# Reading history up to TEMPERATURE_ROLLUP_RAW_RANGE long is served from raw readings. Longer
+# ranges are served from the finest minute, hour or day rollups that give no more than
+# TEMPERATURE_HISTORY_MAX_POINTS points.
+TEMPERATURE_ROLLUP_RAW_RANGE = datetime.timedelta(hours=6)
+TEMPERATURE_HISTORY_MAX_POINTS = 1500
+
+# Tiered retention, applied by the expirereadings command. Raw readings are kept for RAW_DAYS
+# days, minute rollups for MINUTE_DAYS days and hourly rollups for HOUR_MONTHS months; None keeps
+# a tier forever. Daily rollups are always kept. Expired rows are deleted CHUNK_SIZE at a time,
+# pausing CHUNK_PAUSE_MS milliseconds between chunks.
+TEMPERATURE_RETENTION = {
+    'RAW_DAYS': 90,
+    'MINUTE_DAYS': 90,
+    'HOUR_MONTHS': 24,
+    'CHUNK_SIZE': 5000,
+    'CHUNK_PAUSE_MS': 50,
+}
+
+# Raw readings older than TEMPERATURE_COLD_STORAGE_DAYS days are packed into one compressed
+# block per thermometer and day by the compactreadings command.
+TEMPERATURE_COLD_STORAGE_DAYS = 14
+
+# Columnar exports of readings for analysis. The exportreadings command writes memory-mappable
+# arrays for each thermometer under TEMPERATURE_EXPORT_ROOT. The export endpoint returns at most
+# TEMPERATURE_EXPORT_MAX_RANGE of readings per request.
+TEMPERATURE_EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+TEMPERATURE_EXPORT_MAX_RANGE = datetime.timedelta(days=366)
@@ -19,6 +19,7 @@ from django.conf.urls.static import static
 from .admin import admin_site
 from .routers import ROUTER
 
+from temperature import views as temp_views
 from temperature import viewsets as temp_vs
 from auth_extension import viewsets as auth_vs
 from testimonials import viewsets as test_vs
@@ -32,6 +33,11 @@ ROUTER.register('testimonials', test_vs.TestimonialViewset)
 urlpatterns = [
     path('admin/', admin_site.urls),
     path('rest-auth/', include(('rest_auth.urls', 'rest_auth'))),
+    path(
+        'ingest/<uuid:therm_id>/',
+        temp_views.DeviceIngestView.as_view(),
+        name='device-ingest'
+    ),
     path('', include(ROUTER.urls))
 ]
 